@@ -3,8 +3,10 @@ from rest_framework.viewsets import ModelViewSet
 from ..models import Company
 from .serializers import CompanySerializer
 from permissions.base_permissions import HasGroupPermission
+from core.tenancy import CompanyScopedMixin
 # Create your views here.
-class CompanyViewSet(ModelViewSet):
+class CompanyViewSet(CompanyScopedMixin, ModelViewSet):
     queryset = Company.objects.all()
+    company_field = "pk"
     serializer_class = CompanySerializer
     # permission_classes = [HasGroupPermission]
@@ -0,0 +1,109 @@
+"""
+Publish/subscribe fan-out for the live event streams.
+
+publish() is called from ordinary (sync) code such as signal handlers, in
+whatever thread the request runs in. Every subscriber is an async stream
+with its own bounded queue on its event loop; events are handed over with
+call_soon_threadsafe and filtered there, so a publish never blocks on a
+slow client. When a queue is full the oldest event is dropped.
+
+InProcessBroadcaster only reaches the subscribers of the process it runs
+in. With several ASGI workers, set LIVE_EVENTS["BACKEND"] to a class with
+the same subscribe / unsubscribe / publish methods that relays the events
+between processes (for example over Redis pub/sub) and hands what it
+receives to InProcessBroadcaster.publish in each of them.
+"""
+import asyncio
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+DEFAULTS = {
+    "BACKEND": "core.broadcast.InProcessBroadcaster",
+    # Events buffered per subscriber before the oldest are dropped
+    "QUEUE_SIZE": 256,
+    # Comment lines sent on idle streams so proxies keep them open
+    "KEEPALIVE_SECONDS": 15,
+}
+
+
+def config():
+    return {**DEFAULTS, **getattr(settings, "LIVE_EVENTS", {})}
+
+
+class Subscription:
+    """One stream's queue; create and read it on the stream's event loop."""
+
+    def __init__(self, matches, queue_size):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.matches = matches
+        self.dropped = 0
+
+    def deliver(self, event):
+        if not self.matches(event):
+            return
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout=None):
+        """The next event, or None when nothing arrived within timeout seconds."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class InProcessBroadcaster:
+    def __init__(self, queue_size=DEFAULTS["QUEUE_SIZE"]):
+        self.queue_size = queue_size
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, matches=lambda event: True):
+        subscription = Subscription(matches, self.queue_size)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # The stream's loop is gone
+                self.unsubscribe(subscription)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "subscribers": len(self._subscriptions),
+                "dropped": sum(subscription.dropped for subscription in self._subscriptions),
+            }
+
+
+_broadcaster = None
+_broadcaster_lock = threading.Lock()
+
+
+def get_broadcaster():
+    global _broadcaster
+    if _broadcaster is None:
+        with _broadcaster_lock:
+            if _broadcaster is None:
+                _broadcaster = import_string(config()["BACKEND"])(queue_size=config()["QUEUE_SIZE"])
+    return _broadcaster
+
+
+def publish(event):
+    get_broadcaster().publish(event)
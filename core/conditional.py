@@ -0,0 +1,58 @@
+"""
+ETag / Last-Modified support for read-mostly viewsets.
+
+ConditionalGetMixin gives list and retrieve responses a strong ETag built
+from the versions of the models they are made of (core/versioning.py), the
+request path with its query string, the response format and the company
+the request is scoped to (core/tenancy.py). A request whose
+If-None-Match (or If-Modified-Since) still matches gets a 304 straight
+after authentication, without querying the table or running the
+serializer.
+
+That needs versions every process sees: while MODEL_VERSIONS uses a
+local-memory cache every request gets a full 200 without validators.
+"""
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from . import versioning
+from .tenancy import request_company_id
+
+
+class ConditionalGetMixin:
+    # Models the responses are built from; defaults to the queryset's model.
+    # List the models of nested serializers too.
+    etag_models = None
+
+    def get_etag_models(self):
+        return self.etag_models or (self.queryset.model,)
+
+    def list(self, request, *args, **kwargs):
+        return self._conditional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._conditional(super().retrieve, request, *args, **kwargs)
+
+    def _conditional(self, render, request, *args, **kwargs):
+        if not versioning.shared():
+            return render(request, *args, **kwargs)
+        token, last_modified = versioning.versions(self.get_etag_models())
+        renderer_format = getattr(request, "accepted_renderer", None) and request.accepted_renderer.format
+        etag = quote_etag(
+            hashlib.sha1(
+                f"{token}|{request.get_full_path()}|{renderer_format}|{request_company_id(request)}".encode()
+            ).hexdigest()
+        )
+        last_modified = int(last_modified)
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = render(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response["ETag"] = etag
+            response["Last-Modified"] = http_date(last_modified)
+            # Cache, but check back every time
+            response["Cache-Control"] = "no-cache"
+        return response
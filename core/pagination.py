@@ -0,0 +1,147 @@
+"""
+Opt-in cursor (keyset) pagination for the large list endpoints.
+
+Lists stay unpaginated unless the request passes `cursor` or `page_size`, so
+existing clients keep getting plain arrays. A paginated request filters on
+the position of the last row it saw instead of OFFSET and never runs a
+COUNT(*), so page 1,000 costs the same as page 1. Follow the `next` /
+`previous` links to move through the results.
+
+DRF's CursorPagination keys the position on the first ordering field only
+and steps over rows sharing it with an offset, which gets slow when many
+breakdowns start at the same minute and can skip or repeat rows when one of
+them changes between two pages. Here the position holds every ordering
+field (the ordering always ends with the id), and the next page is
+
+    WHERE breakdown_start < t OR (breakdown_start = t AND id < n)
+
+so every position is unique and no offsets are needed. Ordering fields
+must not be null.
+"""
+import json
+from functools import reduce
+from operator import or_
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+
+
+class OptInCursorPagination(CursorPagination):
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 500
+    ordering = ("id",)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = tuple(super().get_ordering(request, queryset, view))
+        if not any(field.lstrip("-") in ("id", "pk") for field in ordering):
+            # The id breaks ties, in the direction of the last field
+            ordering += ("-id" if ordering[-1].startswith("-") else "id",)
+        return ordering
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = []
+        for field in ordering:
+            name = field.lstrip("-")
+            value = instance[name] if isinstance(instance, dict) else getattr(instance, name)
+            values.append(str(value))
+        return json.dumps(values)
+
+    def _after(self, position, reverse):
+        """The rows after position in the (reverse) ordering: a row-value comparison spelled out with Q."""
+        try:
+            values = json.loads(position)
+        except ValueError:
+            values = None
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        clauses, equal = [], {}
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") != reverse else "gt"
+            clauses.append(Q(**equal, **{f"{name}__{lookup}": value}))
+            equal[name] = value
+        return reduce(or_, clauses)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+
+        # CursorPagination.paginate_queryset with the position filter on every ordering field
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            (offset, reverse, current_position) = (0, False, None)
+        else:
+            (offset, reverse, current_position) = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(*(
+                field[1:] if field.startswith("-") else f"-{field}" for field in self.ordering
+            ))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if current_position is not None:
+            try:
+                queryset = queryset.filter(self._after(current_position, reverse))
+            except (ValidationError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = list(results[:self.page_size])
+
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+        else:
+            has_following_position = False
+            following_position = None
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = (current_position is not None) or (offset > 0)
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = (current_position is not None) or (offset > 0)
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+
+class BreakdownLogCursorPagination(OptInCursorPagination):
+    # Newest first; keyed on the indexed breakdown_start, id breaks ties
+    ordering = ("-breakdown_start", "-id")
+
+
+class MachineCursorPagination(OptInCursorPagination):
+    ordering = ("id",)
+
+
+class PartsUsageCursorPagination(OptInCursorPagination):
+    ordering = ("-usage_date", "-id")
+
+
+class EmployeeCursorPagination(OptInCursorPagination):
+    ordering = ("id",)
@@ -67,7 +67,7 @@ MIDDLEWARE = [
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'user_management.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
 }
@@ -199,8 +199,82 @@ CSRF_TRUSTED_ORIGINS = [
 ]
 
 
+# ----------------------------------------
+# Breakdown analytics
+# ----------------------------------------
+
+# Time zone the plant's days are counted in for the breakdown analytics
+# (date filters, daily summaries and rollups). Rebuild the rollups after
+# changing it.
+PLANT_TIME_ZONE = TIME_ZONE
+
+# Serve the breakdown dashboards from the daily rollup table. Backfill it with
+# `python manage.py rebuild_breakdown_rollups` before switching this on.
+BREAKDOWN_ROLLUPS_ENABLED = False
+
+# Result cache for the dashboard endpoints, invalidated by writes to
+# BreakdownLog and Machine. TTL is in seconds.
+MAINTENANCE_ANALYTICS_CACHE = {
+    'ALIAS': 'default',
+    'TTL': 30,
+}
+
+# Resolved auth tokens kept in memory per process (user_management/authentication.py).
+# Needs 'ALIAS' (default 'default') to be a cache shared by all processes,
+# which carries the versions that revoke them everywhere. With the
+# local-memory CACHES below it is off and tokens are read like
+# TokenAuthentication does.
+TOKEN_AUTH_CACHE = {
+    'TTL': 300,
+    'MAX_ENTRIES': 10000,
+}
+
+# Versions behind the ETag / Last-Modified headers of the reference-data
+# endpoints (core/versioning.py). 304s are only answered when ALIAS is a
+# cache all processes share; with the local-memory default every request
+# gets a full response.
+MODEL_VERSIONS = {
+    'ALIAS': 'default',
+}
+
+# Local-memory by default; point this at the file backend (or any shared
+# cache) when running several worker processes.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fasttracker',
+    }
+}
+
+
+# Push notifications are queued in maintenance.NotificationOutbox and sent by
+# `python manage.py deliver_notifications --loop`. Use
+# 'maintenance.notifications.LocalTransport' to keep them in memory instead.
+NOTIFICATIONS = {
+    'TRANSPORT': 'maintenance.notifications.FirebaseTransport',
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF_SECONDS': 30,
+    # Status changes on one line within this many seconds go out as one digest
+    'LINE_WINDOW_SECONDS': 30,
+    # A machine that was just notified about waits this long for the next one
+    'MACHINE_WINDOW_SECONDS': 120,
+    # topic: (notifications, per seconds)
+    'TOPIC_RATES': {
+        'mechanics': (20, 60),
+    },
+}
+
 # ----------------------------------------
 # FIREBASE CREDENTIALS for Push Notification
 # ------------------------------------------
 
 FIREBASE_CREDENTIALS = os.path.join(BASE_DIR, 'credentials', 'firebase_service_account.json')
+
+# Live floor board stream (maintenance/api/live.py, core/broadcast.py).
+# With several ASGI workers, point BACKEND at a broadcaster that relays
+# events between processes.
+LIVE_EVENTS = {
+    'BACKEND': 'core.broadcast.InProcessBroadcaster',
+    'QUEUE_SIZE': 256,
+    'KEEPALIVE_SECONDS': 15,
+}
@@ -0,0 +1,124 @@
+"""
+Company scoping for the API.
+
+Every factory's data lives in the same tables. A request made by a user
+whose employee record belongs to a company only sees that company's rows:
+
+    class MachineViewSet(CompanyScopedMixin, ModelViewSet):
+        queryset = Machine.objects.all()
+
+    class BreakdownLogViewSet(CompanyScopedMixin, ModelViewSet):
+        company_field = "machine__company"   # no company column of its own
+
+Superusers and users without an employee company are not scoped (the API
+has no default permission class yet, so anonymous requests keep seeing
+everything until one is set). Creates and updates of models with their own
+company column are pinned to the requester's company, and every related
+object a write points at (a breakdown's machine, a machine's line or
+mechanic, a line's floor) must belong to that company too.
+
+The tables are indexed with the company first, so a scoped query only reads
+its own company's slice of the index.
+"""
+from django.db import models
+from rest_framework.exceptions import ValidationError
+
+from company.models import Company
+
+
+# Models without a company column of their own: how to reach it
+RELATED_COMPANY_LOOKUPS = {
+    "production.line": "floor__company",
+    "maintenance.breakdownlog": "machine__company",
+}
+
+
+def company_id_of(obj):
+    """The id of the company obj belongs to, or None for shared rows (problem categories, ...)."""
+    if isinstance(obj, Company):
+        return obj.pk
+    if hasattr(obj, "company_id"):
+        return obj.company_id
+    lookup = RELATED_COMPANY_LOOKUPS.get(obj._meta.label_lower)
+    if lookup is None:
+        return None
+    return type(obj)._default_manager.filter(pk=obj.pk).values_list(lookup, flat=True).first()
+
+
+def user_company(user):
+    """The company the user is scoped to, or None when they see every company."""
+    if user is None or not user.is_authenticated or user.is_superuser:
+        return None
+    # Token authentication already loaded employee and company
+    employee = getattr(user, "employee", None)
+    return getattr(employee, "company", None)
+
+
+def request_company(request):
+    """The company the request is scoped to, or None when it sees every company."""
+    return user_company(getattr(request, "user", None))
+
+
+def request_company_id(request):
+    company = request_company(request)
+    return company.pk if company is not None else None
+
+
+def scope_queryset(queryset, request, company_field="company"):
+    company_id = request_company_id(request)
+    if company_id is None:
+        return queryset
+    return queryset.filter(**{company_field: company_id})
+
+
+class CompanyScopedMixin:
+    # Lookup from the viewset's model to its company
+    company_field = "company"
+
+    def get_company(self):
+        if not hasattr(self, "_company"):
+            self._company = request_company(self.request)
+        return self._company
+
+    def get_company_id(self):
+        company = self.get_company()
+        return company.pk if company is not None else None
+
+    def scope(self, queryset, company_field=None):
+        """Restrict any queryset (not just this viewset's) to the request's company."""
+        company_id = self.get_company_id()
+        if company_id is None:
+            return queryset
+        return queryset.filter(**{company_field or self.company_field: company_id})
+
+    def get_queryset(self):
+        return self.scope(super().get_queryset())
+
+    def perform_create(self, serializer):
+        self._save_scoped(serializer, super().perform_create)
+
+    def perform_update(self, serializer):
+        self._save_scoped(serializer, super().perform_update)
+
+    def _save_scoped(self, serializer, save):
+        company = self.get_company()
+        if company is None:
+            return save(serializer)
+        self._check_related(serializer.validated_data, company)
+        if self.company_field == "company":
+            serializer.save(company=company)
+        else:
+            save(serializer)
+
+    def _check_related(self, validated_data, company):
+        """Reject writes pointing at another company's rows, as if those did not exist."""
+        errors = {}
+        for name, value in validated_data.items():
+            if name == "company" and self.company_field == "company":
+                continue  # replaced by the requester's company
+            related = value if isinstance(value, (list, tuple)) else [value]
+            for obj in related:
+                if isinstance(obj, models.Model) and company_id_of(obj) not in (None, company.pk):
+                    errors[name] = [f'Invalid pk "{obj.pk}" - object does not exist.']
+        if errors:
+            raise ValidationError(errors)
@@ -0,0 +1,83 @@
+"""
+Per-model data versions for conditional GETs.
+
+Every registered model has a version token and a last-modified time in the
+cache. Saving or deleting a row of the model replaces both once the
+transaction commits. Readers never see a new version with the old rows that
+way. Views combine the versions of the models a response is built from into
+an ETag (see core/conditional.py), so they can answer If-None-Match without
+touching the tables.
+
+Writes that send no signals (queryset.update(), bulk_create(), raw SQL)
+have to call bump() themselves. When the cache loses a version a fresh one is
+created, which only costs the clients one full response.
+
+Versions in a local-memory cache are only bumped in the process that made
+the write, so the others would keep answering 304 for the old data. With
+one, shared() is False and conditional GETs are not answered (see
+core/conditional.py); set MODEL_VERSIONS["ALIAS"] to a cache every process
+shares to use them.
+"""
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+
+DEFAULTS = {
+    "ALIAS": "default",
+    "PREFIX": "model-version",
+}
+
+
+def _config():
+    return {**DEFAULTS, **getattr(settings, "MODEL_VERSIONS", {})}
+
+
+def _key(model):
+    return f"{_config()['PREFIX']}:{model._meta.label_lower}"
+
+
+def _new_version():
+    return (uuid.uuid4().hex, time.time())
+
+
+def shared():
+    """Whether every process sees the versions, see the module docstring."""
+    return not isinstance(caches[_config()["ALIAS"]], LocMemCache)
+
+
+def bump(*models):
+    """Give the models a new version."""
+    caches[_config()["ALIAS"]].set_many({_key(model): _new_version() for model in models}, None)
+
+
+def versions(models):
+    """(token, last_modified) for a set of models: a token that changes when
+    any of them changes, and the latest modification time as a timestamp."""
+    cache = caches[_config()["ALIAS"]]
+    keys = {model: _key(model) for model in models}
+    found = cache.get_many(keys.values())
+    for model, key in keys.items():
+        if key not in found:
+            # add() keeps a version another process created meanwhile
+            cache.add(key, _new_version(), None)
+            found[key] = cache.get(key) or _new_version()
+    ordered = [found[keys[model]] for model in sorted(models, key=lambda model: model._meta.label_lower)]
+    return "-".join(token for token, _ in ordered), max(modified for _, modified in ordered)
+
+
+def _bump_on_commit(sender, **kwargs):
+    if not kwargs.get("raw", False):
+        transaction.on_commit(lambda: bump(sender))
+
+
+def register(*models):
+    """Track the versions of models; call from the app's ready()."""
+    for model in models:
+        post_save.connect(_bump_on_commit, sender=model, dispatch_uid=f"model-version-save-{model._meta.label_lower}")
+        post_delete.connect(_bump_on_commit, sender=model, dispatch_uid=f"model-version-delete-{model._meta.label_lower}")
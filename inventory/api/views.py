@@ -1,25 +1,50 @@
 # views.py
-from rest_framework import viewsets
+from rest_framework import serializers, viewsets
 from rest_framework.views import APIView
 from rest_framework import status
 from ..models import MachinePart, PurchaseItem, PartsUsageRecord
 from .serializers import MachinePartSerializer, PurchaseItemSerializer, PartsUsageRecordSerializer
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from django.db.models import Sum, F
+from django.db.models import Sum, F, ExpressionWrapper, DecimalField
 from datetime import datetime
+from maintenance.models import BreakdownDailyRollup
+from django.utils import timezone
+from maintenance.rollups import rollups_enabled
+from maintenance.periods import parse_bound
+from core.exports import OUTPUTS, stream_export
+from core.pagination import PartsUsageCursorPagination
+from core.tenancy import CompanyScopedMixin, request_company
+from ..stock import InsufficientStock
+from ..usage import book_parts_usage
 
-class MachinePartViewSet(viewsets.ModelViewSet):
+class MachinePartViewSet(CompanyScopedMixin, viewsets.ModelViewSet):
     queryset = MachinePart.objects.all()
     serializer_class = MachinePartSerializer
 
-class PurchaseItemViewSet(viewsets.ModelViewSet):
+class PurchaseItemViewSet(CompanyScopedMixin, viewsets.ModelViewSet):
     queryset = PurchaseItem.objects.all()
     serializer_class = PurchaseItemSerializer
 
-class PartsUsageRecordViewSet(viewsets.ModelViewSet):
+class PartsUsageRecordViewSet(CompanyScopedMixin, viewsets.ModelViewSet):
     queryset = PartsUsageRecord.objects.all()
     serializer_class = PartsUsageRecordSerializer
+    pagination_class = PartsUsageCursorPagination  # opt-in: only with ?cursor= or ?page_size=
+
+    def perform_create(self, serializer):
+        self._booked(super().perform_create, serializer)
+
+    def perform_update(self, serializer):
+        self._booked(super().perform_update, serializer)
+
+    def _booked(self, save, serializer):
+        # Saving books the stock; a short part is a bad quantity, not a server error
+        try:
+            save(serializer)
+        except InsufficientStock as short:
+            raise serializers.ValidationError({"quantity_used": [
+                f"Not enough stock available: {short.requested} requested, {short.available or 0} in stock."
+            ]})
 
     @action(detail=False, methods=['get'])
     def total_cost(self, request):
@@ -37,36 +62,96 @@ class PartsUsageRecordViewSet(viewsets.ModelViewSet):
             return Response({"error": "Invalid date format. Use YYYY-MM-DD."}, status=400)
 
         # Filter PartsUsageRecord based on the breakdown's line and date range
-        parts_usage_records = PartsUsageRecord.objects.filter(
+        parts_usage_records = self.get_queryset().filter(
             breakdown__line=line,
             breakdown__breakdown_start__gte=startdate,
             breakdown__breakdown_start__lte=enddate
         )
 
-        # Calculate the total cost
-        total_cost = parts_usage_records.annotate(
+        total_cost = 0
+        if rollups_enabled():
+            # Whole days [startdate, enddate) come from the daily rollups; only
+            # breakdowns starting exactly at the (inclusive) end bound are raw.
+            total_cost = self.scope(BreakdownDailyRollup.objects.all()).filter(
+                line=line,
+                day__gte=startdate.date(),
+                day__lt=enddate.date()
+            ).aggregate(total_cost_sum=Sum('parts_cost'))['total_cost_sum'] or 0
+            parts_usage_records = parts_usage_records.filter(breakdown__breakdown_start__gte=enddate)
+
+        # Calculate the total cost, at the parts' current prices like the rollups
+        total_cost += parts_usage_records.annotate(
             total_cost=F('quantity_used') * F('part__price')
         ).aggregate(
             total_cost_sum=Sum('total_cost')
         )['total_cost_sum'] or 0
 
         return Response({"total_cost": total_cost})
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Stream parts usage as CSV or NDJSON (output=csv|ndjson), oldest first,
+        optionally filtered by start/end (usage date), line and part.
+        """
+        output = request.query_params.get('output', 'csv')
+        start = request.query_params.get('start', '')
+        end = request.query_params.get('end', '')
+        line = request.query_params.get('line', None)
+        part = request.query_params.get('part', None)
+
+        if output not in OUTPUTS:
+            return Response({"error": f"output must be one of {', '.join(OUTPUTS)}"}, status=400)
+        window_start = parse_bound(start) if start else None
+        window_end = parse_bound(end, end=True) if end else None
+        if (start and window_start is None) or (end and window_end is None):
+            return Response({"error": "start and end must be dates (YYYY-MM-DD) or ISO datetimes"}, status=400)
+
+        parts_usage_records = self.get_queryset().order_by('usage_date', 'id')
+        if window_start:
+            parts_usage_records = parts_usage_records.filter(usage_date__gte=window_start)
+        if window_end:
+            parts_usage_records = parts_usage_records.filter(usage_date__lt=window_end)
+        if line:
+            parts_usage_records = parts_usage_records.filter(breakdown__line=line)
+        if part:
+            parts_usage_records = parts_usage_records.filter(part=part)
+
+        return stream_export(
+            parts_usage_records.annotate(total_cost=ExpressionWrapper(
+                F('quantity_used') * F('part__price'),
+                output_field=DecimalField(max_digits=14, decimal_places=2),
+            )),
+            [
+                ('id', 'id'),
+                ('usage_date', 'usage_date'),
+                ('part', 'part__name'),
+                ('unit_cost', 'part__price'),
+                ('quantity_used', 'quantity_used'),
+                ('total_cost', 'total_cost'),
+                ('breakdown', 'breakdown_id'),
+                ('machine_id', 'breakdown__machine__machine_id'),
+                ('line', 'breakdown__line__name'),
+                ('floor', 'breakdown__line__floor__name'),
+                ('problem_category', 'breakdown__problem_category__name'),
+                ('mechanic', 'mechanic__name'),
+                ('remarks', 'remarks'),
+            ],
+            output,
+            f"parts-usage-{timezone.localdate():%Y%m%d}",
+        )
     
 class BulkCreatePartsUsageView(APIView):
     def post(self, request):
-        # Expecting a list of PartsUsageRecord objects in the request data
-        serializer = PartsUsageRecordSerializer(data=request.data, many=True)
-
-        if serializer.is_valid():
-            try:
-                # Save all valid records (model's save() method will handle validation)
-                saved_instances = serializer.save()
-                # Serialize the saved instances and return the response
-                response_serializer = PartsUsageRecordSerializer(saved_instances, many=True)
-                return Response(response_serializer.data, status=status.HTTP_201_CREATED)
-            except ValueError as e:
-                # Handle the case where the model's save() method raises a ValueError (e.g., insufficient stock)
-                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Return serializer errors if the data is invalid
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        """
+        Book a list of PartsUsageRecord objects in one go: all are saved or
+        none. Errors come back as one dict per record, as with a list
+        serializer, including the records whose part is short on stock.
+        """
+        if not isinstance(request.data, list):
+            return Response({"error": "Expected a list of parts usage records"}, status=status.HTTP_400_BAD_REQUEST)
+
+        records, errors = book_parts_usage(request.data, company=request_company(request))
+        if any(errors):
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        return Response(PartsUsageRecordSerializer(records, many=True).data, status=status.HTTP_201_CREATED)
@@ -0,0 +1,20 @@
+# Generated by Django 5.1.3 on 2026-10-18 15:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('company', '0001_initial'),
+        ('inventory', '0003_alter_partsusagerecord_mechanic'),
+        ('maintenance', '0003_breakdownlog_breakdown_start_index'),
+        ('user_management', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='partsusagerecord',
+            index=models.Index(fields=['usage_date'], name='inventory_p_usage_d_8c74e0_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.1.3 on 2026-10-18 15:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('company', '0001_initial'),
+        ('inventory', '0004_partsusagerecord_usage_date_index'),
+        ('maintenance', '0009_company_scoped_indexes'),
+        ('user_management', '0002_company_scoped_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='partsusagerecord',
+            index=models.Index(fields=['company', 'usage_date'], name='inventory_p_company_5225e5_idx'),
+        ),
+    ]
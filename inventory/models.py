@@ -1,7 +1,8 @@
-from django.db import models
+from django.db import models, transaction
 from company.models import Company
 from maintenance.models import BreakdownLog
 from user_management.models import Employee
+from . import stock
 
 class MachinePart(models.Model):
     name = models.CharField(max_length=255)
@@ -12,6 +13,13 @@ class MachinePart(models.Model):
     class Meta:
         unique_together = ("company", "name") 
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored price so a change reprices the parts cost rollups
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
     def __str__(self):
         return f"{self.name} Price: {self.price} Qty: {self.quantity}"
 
@@ -26,11 +34,20 @@ class PurchaseItem(models.Model):
     class Meta:
         unique_together = ("company", "invoice") 
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what is stored so a save only books the change in stock
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
     def save(self, *args, **kwargs):
-        """Automatically add purchased quantity to stock"""
-        super().save(*args, **kwargs)
-        self.part.quantity += self.quantity_purchased
-        self.part.save()
+        """Automatically add purchased quantity (or the change to it) to stock"""
+        stored = getattr(self, "_loaded_values", None) or {}
+        with transaction.atomic():
+            stock.move(stored.get("part_id"), stored.get("quantity_purchased", 0), self.part_id, self.quantity_purchased)
+            super().save(*args, **kwargs)
+        self._loaded_values = {"part_id": self.part_id, "quantity_purchased": self.quantity_purchased}
 
     def __str__(self):
         return f"{self.quantity_purchased} x {self.part.name}"
@@ -46,13 +63,27 @@ class PartsUsageRecord(models.Model):
     remarks = models.TextField(blank=True, null=True)  # Optional notes
     company = models.ForeignKey(Company, on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["usage_date"]),
+            # Company-scoped usage by date, see core/tenancy.py
+            models.Index(fields=["company", "usage_date"]),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what is stored so a save only books the change in stock
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
     def save(self, *args, **kwargs):
-        """Automatically deduct used quantity from stock"""
-        if self.quantity_used > self.part.quantity:
-            raise ValueError("Not enough stock available!")
-        super().save(*args, **kwargs)
-        self.part.quantity -= self.quantity_used
-        self.part.save()
+        """Automatically deduct used quantity (or the change to it) from stock; raises InsufficientStock"""
+        stored = getattr(self, "_loaded_values", None) or {}
+        with transaction.atomic():
+            stock.move(stored.get("part_id"), -stored.get("quantity_used", 0), self.part_id, -self.quantity_used)
+            super().save(*args, **kwargs)
+        self._loaded_values = {"part_id": self.part_id, "quantity_used": self.quantity_used, "breakdown_id": self.breakdown_id}
         
     def __str__(self):
         return f"Used {self.quantity_used} x {self.part.name} on {self.usage_date}"
\ No newline at end of file
@@ -0,0 +1,57 @@
+from decimal import Decimal
+from django.db.models.base import DEFERRED
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from maintenance.models import BreakdownLog
+from maintenance.rollups import part_price_changed, parts_cost_changed
+from .models import MachinePart, PartsUsageRecord
+
+
+def _cost(quantity, part):
+    return Decimal(quantity) * part.price
+
+
+@receiver(post_save, sender=PartsUsageRecord)
+def add_parts_cost_to_rollup(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    # What was stored before this save (see PartsUsageRecord.from_db)
+    stored = {} if created else (getattr(instance, '_loaded_values', None) or {})
+    old_breakdown_id, old_part_id = stored.get('breakdown_id'), stored.get('part_id')
+    old_quantity = stored.get('quantity_used') or 0
+
+    if (old_breakdown_id, old_part_id) == (instance.breakdown_id, instance.part_id):
+        parts_cost_changed(instance.breakdown, _cost(instance.quantity_used - old_quantity, instance.part))
+        return
+    if old_breakdown_id is not None and old_part_id is not None and old_quantity:
+        # Moved to another breakdown or part: take the old booking off where it was counted
+        old_breakdown = (
+            instance.breakdown if old_breakdown_id == instance.breakdown_id
+            else BreakdownLog.objects.get(pk=old_breakdown_id)
+        )
+        old_part = instance.part if old_part_id == instance.part_id else MachinePart.objects.get(pk=old_part_id)
+        parts_cost_changed(old_breakdown, -_cost(old_quantity, old_part))
+    parts_cost_changed(instance.breakdown, _cost(instance.quantity_used, instance.part))
+
+@receiver(post_delete, sender=PartsUsageRecord)
+def remove_parts_cost_from_rollup(sender, instance, **kwargs):
+    parts_cost_changed(instance.breakdown, -_cost(instance.quantity_used, instance.part))
+
+@receiver(pre_save, sender=MachinePart)
+def remember_price(sender, instance, raw=False, **kwargs):
+    # Fallback for instances that were not loaded from the database (or without their price)
+    stored = getattr(instance, '_loaded_values', None) or {}
+    if not raw and instance.pk and stored.get('price', DEFERRED) is DEFERRED:
+        instance._loaded_values = {
+            **stored, 'price': MachinePart.objects.filter(pk=instance.pk).values_list('price', flat=True).first(),
+        }
+
+@receiver(post_save, sender=MachinePart)
+def reprice_parts_cost_in_rollup(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and 'price' not in update_fields):
+        return
+    stored = getattr(instance, '_loaded_values', None) or {}
+    price = Decimal(str(instance.price))
+    instance._loaded_values = {**stored, 'price': price}
+    if not created and stored.get('price') is not None:
+        part_price_changed(instance.pk, price - stored['price'])
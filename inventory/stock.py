@@ -0,0 +1,104 @@
+"""
+Stock movements on MachinePart.quantity.
+
+Every movement is a single UPDATE of the quantity column relative to its
+current value, so concurrent purchases and repairs never overwrite each
+other's changes:
+
+    UPDATE inventory_machinepart SET quantity = quantity - n
+    WHERE id = ... AND quantity >= n
+
+The WHERE clause is the stock check. When it matches no row the part is
+short, and InsufficientStock is raised without anything having been
+written. Nothing is read first, so there is no window between the check and
+the write for another booking to slip into. consume_many() does the same
+for many parts in one statement.
+"""
+from functools import reduce
+from operator import or_
+
+from django.apps import apps
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Q, Value, When
+
+
+class InsufficientStock(ValueError):
+    """A part does not have the quantity a movement needs."""
+
+    def __init__(self, part_id, requested, available=None):
+        self.part_id = part_id
+        self.requested = requested
+        self.available = available
+        super().__init__(
+            f"Not enough stock available for part {part_id}: {requested} requested, {available} in stock"
+            if available is not None else f"Part {part_id} does not exist"
+        )
+
+
+def _parts():
+    return apps.get_model("inventory", "MachinePart").objects
+
+
+def receive(part_id, quantity):
+    """Add quantity to the part's stock."""
+    if quantity:
+        _parts().filter(pk=part_id).update(quantity=F("quantity") + quantity)
+
+
+def consume(part_id, quantity):
+    """Take quantity from the part's stock, or raise InsufficientStock."""
+    if not quantity:
+        return
+    if not _parts().filter(pk=part_id, quantity__gte=quantity).update(quantity=F("quantity") - quantity):
+        # Only read to explain the failure; nothing was written
+        available = _parts().filter(pk=part_id).values_list("quantity", flat=True).first()
+        raise InsufficientStock(part_id, quantity, available)
+
+
+def consume_many(quantities):
+    """
+    Take {part_id: quantity} from stock in one UPDATE, all or nothing.
+    Returns {} on success, or {part_id: available} for the parts that are
+    short (None for parts that do not exist), having written nothing.
+    """
+    quantities = {part_id: quantity for part_id, quantity in quantities.items() if quantity}
+    if not quantities:
+        return {}
+    parts = _parts()
+    with transaction.atomic():
+        updated = parts.filter(
+            reduce(or_, (Q(pk=part_id, quantity__gte=quantity) for part_id, quantity in quantities.items()))
+        ).update(quantity=F("quantity") - Case(
+            *(When(pk=part_id, then=Value(quantity)) for part_id, quantity in quantities.items()),
+            output_field=PositiveIntegerField(),
+        ))
+        if updated == len(quantities):
+            return {}
+        transaction.set_rollback(True)
+    available = dict(parts.filter(pk__in=quantities).values_list("pk", "quantity"))
+    return {
+        part_id: available.get(part_id)
+        for part_id, quantity in quantities.items()
+        if available.get(part_id) is None or available[part_id] < quantity
+    }
+
+
+def adjust(part_id, delta):
+    """Add a positive delta, take a negative one."""
+    if delta > 0:
+        receive(part_id, delta)
+    elif delta < 0:
+        consume(part_id, -delta)
+
+
+def move(old_part_id, old_quantity, new_part_id, new_quantity):
+    """
+    Rebook a movement of old_quantity on old_part_id as new_quantity on
+    new_part_id (positive quantities add stock). Only the difference is
+    applied when the part stays the same.
+    """
+    if old_part_id == new_part_id:
+        adjust(new_part_id, new_quantity - old_quantity)
+    else:
+        adjust(old_part_id, -old_quantity)
+        adjust(new_part_id, new_quantity)
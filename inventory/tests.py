@@ -1,3 +1,214 @@
-from django.test import TestCase
+import json
+import threading
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.db import close_old_connections, connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from company.models import Company
+from maintenance.models import BreakdownDailyRollup, BreakdownLog, Machine
+from maintenance.rollups import rebuild_rollups
+from user_management.models import Employee
+from .models import MachinePart, PartsUsageRecord, PurchaseItem
+from .stock import InsufficientStock
+
+
+def _rollup_parts_cost():
+    return sum(BreakdownDailyRollup.objects.values_list("parts_cost", flat=True))
+
+
+def _breakdown(company):
+    machine = Machine.objects.create(machine_id="M-1", company=company)
+    return BreakdownLog.objects.create(machine=machine, breakdown_start=timezone.now(), lost_time=timedelta(minutes=5))
+
+
+class StockMovementTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(name="Panacea")
+        cls.part = MachinePart.objects.create(name="Needle", price=2, quantity=10, company=cls.company)
+        cls.breakdown = _breakdown(cls.company)
+
+    def quantity(self):
+        return MachinePart.objects.values_list("quantity", flat=True).get(pk=self.part.pk)
+
+    def test_updates_book_only_the_change(self):
+        purchase = PurchaseItem.objects.create(invoice="INV-1", part=self.part, quantity_purchased=5, company=self.company)
+        self.assertEqual(self.quantity(), 15)
+        purchase = PurchaseItem.objects.get(pk=purchase.pk)
+        purchase.quantity_purchased = 3
+        purchase.save()
+        self.assertEqual(self.quantity(), 13)
+
+        usage = PartsUsageRecord.objects.create(part=self.part, quantity_used=4, breakdown=self.breakdown, company=self.company)
+        self.assertEqual(self.quantity(), 9)
+        usage.quantity_used = 6
+        usage.save()
+        self.assertEqual(self.quantity(), 7)
+
+    def test_insufficient_stock_writes_nothing(self):
+        with self.assertRaises(InsufficientStock) as raised:
+            PartsUsageRecord.objects.create(part=self.part, quantity_used=11, breakdown=self.breakdown, company=self.company)
+        self.assertEqual(raised.exception.available, 10)
+        self.assertEqual(self.quantity(), 10)
+        self.assertFalse(PartsUsageRecord.objects.exists())
+
+
+class PartsUsageApiTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(name="Panacea")
+        cls.part = MachinePart.objects.create(name="Needle", price=2, quantity=10, company=cls.company)
+        cls.breakdown = _breakdown(cls.company)
+
+    def test_short_stock_is_a_bad_request(self):
+        client = APIClient()
+        line = {"part": self.part.pk, "quantity_used": 11, "breakdown": self.breakdown.pk, "company": self.company.pk}
+        response = client.post("/api/inventory/partsusagerecords/", line, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("quantity_used", response.data)
+        self.assertFalse(PartsUsageRecord.objects.exists())
+
+        record = client.post("/api/inventory/partsusagerecords/", {**line, "quantity_used": 4}, format="json").data
+        response = client.patch(f"/api/inventory/partsusagerecords/{record['id']}/", {"quantity_used": 11}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("quantity_used", response.data)
+        self.assertEqual(MachinePart.objects.get(pk=self.part.pk).quantity, 6)
+
+
+class BulkPartsUsageTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(name="Panacea")
+        cls.needle = MachinePart.objects.create(name="Needle", price=2, quantity=500, company=cls.company)
+        cls.belt = MachinePart.objects.create(name="Belt", price=10, quantity=5, company=cls.company)
+        cls.breakdown = _breakdown(cls.company)
+
+    def book(self, lines):
+        return APIClient().post("/api/inventory/bulk-create-parts-usage/", lines, format="json")
+
+    def line(self, part, quantity):
+        return {"part": part.pk, "quantity_used": quantity, "breakdown": self.breakdown.pk, "company": self.company.pk}
+
+    def test_books_many_lines_in_a_few_queries(self):
+        lines = [self.line(self.needle, 2) for _ in range(199)] + [self.line(self.belt, 5)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.book(lines)
+        # Lookups, one stock UPDATE, the INSERT (batched by the backend) and
+        # the rollup write, instead of a fetch and save per line
+        self.assertLessEqual(len(queries), 15)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data), 200)
+        self.assertEqual(MachinePart.objects.get(pk=self.needle.pk).quantity, 500 - 398)
+        self.assertEqual(MachinePart.objects.get(pk=self.belt.pk).quantity, 0)
+        self.assertEqual(
+            sum(BreakdownDailyRollup.objects.values_list("parts_cost", flat=True)), 398 * 2 + 5 * 10,
+        )
+
+    def test_short_stock_is_reported_per_line_and_nothing_is_booked(self):
+        response = self.book([self.line(self.needle, 1), self.line(self.belt, 4), self.line(self.belt, 2)])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[0], {})
+        self.assertIn("quantity_used", response.data[1])
+        self.assertIn("quantity_used", response.data[2])
+        self.assertFalse(PartsUsageRecord.objects.exists())
+        self.assertEqual(MachinePart.objects.get(pk=self.needle.pk).quantity, 500)
+
+    def test_mechanics_of_another_company_are_refused(self):
+        own = Employee.objects.create(name="Rahim", company=self.company)
+        other = Employee.objects.create(name="Karim", company=Company.objects.create(name="Other"))
+        response = self.book([
+            {**self.line(self.needle, 1), "mechanic": own.pk}, {**self.line(self.needle, 1), "mechanic": other.pk},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[0], {})
+        self.assertEqual(response.data[1], {"mechanic": ["Employee belongs to another company."]})
+        self.assertFalse(PartsUsageRecord.objects.exists())
+
+
+class ConcurrentStockMovementTests(TransactionTestCase):
+
+    def test_parallel_bookings_lose_no_updates(self):
+        if connection.vendor == "sqlite" and connection.settings_dict["TEST"].get("NAME") is None:
+            self.skipTest("in-memory SQLite does not handle concurrent writers")
+        company = Company.objects.create(name="Panacea")
+        part = MachinePart.objects.create(name="Needle", price=2, quantity=50, company=company)
+        breakdown = _breakdown(company)
+        results = []
+
+        def book():
+            try:
+                PartsUsageRecord.objects.create(part=part, quantity_used=3, breakdown=breakdown, company=company)
+                results.append("booked")
+            except InsufficientStock:
+                results.append("short")
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=book) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # 50 in stock covers 16 bookings of 3; the other 4 must be refused
+        self.assertEqual(results.count("booked"), 16)
+        self.assertEqual(results.count("short"), 4)
+        self.assertEqual(MachinePart.objects.get(pk=part.pk).quantity, 2)
+        self.assertEqual(PartsUsageRecord.objects.count(), 16)
+
+
+class PartPriceTests(TestCase):
+
+    def test_rollups_follow_price_changes(self):
+        company = Company.objects.create(name="Panacea")
+        part = MachinePart.objects.create(name="Needle", price=2, quantity=50, company=company)
+        breakdown = _breakdown(company)
+        PartsUsageRecord.objects.create(part=part, quantity_used=4, breakdown=breakdown, company=company)
+        PartsUsageRecord.objects.create(part=part, quantity_used=6, breakdown=breakdown, company=company)
+
+        part = MachinePart.objects.get(pk=part.pk)
+        part.price = Decimal("3.50")
+        part.save()
+        # Stock movements do not touch the price
+        part.quantity = 45
+        part.save(update_fields=["quantity"])
+
+        self.assertEqual(_rollup_parts_cost(), Decimal("35.00"))
+        rebuild_rollups()
+        self.assertEqual(_rollup_parts_cost(), Decimal("35.00"))
+
+
+class PartsUsageExportTests(TestCase):
+
+    def test_ndjson_with_costs_and_names(self):
+        company = Company.objects.create(name="Panacea")
+        needle = MachinePart.objects.create(name="Needle", price=Decimal("2.50"), quantity=50, company=company)
+        belt = MachinePart.objects.create(name="Belt", price=10, quantity=5, company=company)
+        breakdown = _breakdown(company)
+        PartsUsageRecord.objects.create(part=needle, quantity_used=4, breakdown=breakdown, company=company)
+        PartsUsageRecord.objects.create(part=belt, quantity_used=1, breakdown=breakdown, company=company)
+
+        client = APIClient()
+        with self.assertNumQueries(1):
+            response = client.get("/api/inventory/partsusagerecords/export/", {"output": "ndjson", "part": needle.pk})
+            rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(
+            {name: rows[0][name] for name in ("part", "unit_cost", "quantity_used", "machine_id")},
+            {"part": "Needle", "unit_cost": "2.50", "quantity_used": 4, "machine_id": "M-1"},
+        )
+        self.assertEqual(Decimal(rows[0]["total_cost"]), 10)
+
+        response = client.get("/api/inventory/partsusagerecords/export/")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertTrue(lines[0].startswith("id,usage_date,part,unit_cost,quantity_used,total_cost"))
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(client.get("/api/inventory/partsusagerecords/export/", {"output": "pdf"}).status_code, 400)
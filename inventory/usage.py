@@ -0,0 +1,139 @@
+"""
+Bulk booking of the parts used on repairs.
+
+book_parts_usage() takes the records of one repair booking (often a few
+hundred lines) and writes them all or none:
+
+- every record is validated up front; parts, breakdowns, mechanics and
+  companies are each fetched with one in_bulk() query,
+- quantities are added up per part and taken from stock in one guarded
+  UPDATE (stock.consume_many), so parts short on stock are reported per
+  record without anything being written,
+- the records are inserted with bulk_create and their parts cost is added
+  to the daily rollups with one write per rollup key.
+
+A booking costs a handful of queries however many lines it has.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+
+from company.models import Company
+from maintenance.models import BreakdownLog
+from maintenance.rollups import parts_costs_added
+from user_management.models import Employee
+
+from . import stock
+from .models import MachinePart, PartsUsageRecord
+
+
+def _id(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return None
+
+
+def _ids(items, field):
+    return {_id(item.get(field)) for item in items if isinstance(item, dict)} - {None}
+
+
+def _validate(item, company, parts, breakdowns, mechanics, companies):
+    """(record, errors) for one item; record is None when there are errors."""
+    if not isinstance(item, dict):
+        return None, {"non_field_errors": ["Expected a dictionary of fields."]}
+    errors = {}
+
+    part = parts.get(_id(item.get("part")))
+    if part is None:
+        errors["part"] = ["This field is required." if item.get("part") in (None, "") else "Part not found."]
+
+    quantity = _id(item.get("quantity_used"))
+    if quantity is None:
+        errors["quantity_used"] = ["A non-negative whole number is required."]
+
+    breakdown = breakdowns.get(_id(item.get("breakdown")))
+    if breakdown is None:
+        errors["breakdown"] = ["This field is required." if item.get("breakdown") in (None, "") else "Breakdown not found."]
+
+    mechanic = None
+    if item.get("mechanic") not in (None, ""):
+        mechanic = mechanics.get(_id(item.get("mechanic")))
+        if mechanic is None:
+            errors["mechanic"] = ["Employee not found."]
+
+    if company is None:
+        company = companies.get(_id(item.get("company")))
+        if company is None:
+            errors["company"] = ["This field is required." if item.get("company") in (None, "") else "Company not found."]
+    if part is not None and company is not None and part.company_id != company.pk:
+        errors["part"] = ["Part belongs to another company."]
+    if mechanic is not None and company is not None and mechanic.company_id != company.pk:
+        errors["mechanic"] = ["Employee belongs to another company."]
+
+    remarks = item.get("remarks")
+    if remarks is not None and not isinstance(remarks, str):
+        errors["remarks"] = ["Not a valid string."]
+
+    if errors:
+        return None, errors
+    return PartsUsageRecord(
+        part=part, quantity_used=quantity, breakdown=breakdown, mechanic=mechanic,
+        remarks=remarks, company=company,
+    ), {}
+
+
+def book_parts_usage(items, company=None):
+    """
+    Validate and save a list of parts usage records (dicts of part,
+    quantity_used, breakdown, mechanic, remarks and company). A company
+    given here (see core/tenancy.py) replaces the records' own and limits
+    the breakdowns to its machines. Returns (records, errors): errors has
+    one dict per item, empty for valid ones, and nothing is saved unless
+    all are.
+    """
+    breakdowns = BreakdownLog.objects.all()
+    if company is not None:
+        breakdowns = breakdowns.filter(machine__company=company)
+    parts = MachinePart.objects.in_bulk(_ids(items, "part"))
+    breakdowns = breakdowns.in_bulk(_ids(items, "breakdown"))
+    mechanic_ids = _ids(items, "mechanic")
+    mechanics = Employee.objects.in_bulk(mechanic_ids) if mechanic_ids else {}
+    companies = Company.objects.in_bulk(_ids(items, "company")) if company is None else {}
+
+    records, errors = [], []
+    for item in items:
+        record, item_errors = _validate(item, company, parts, breakdowns, mechanics, companies)
+        records.append(record)
+        errors.append(item_errors)
+    if any(errors):
+        return [], errors
+
+    quantities = {}
+    for record in records:
+        quantities[record.part_id] = quantities.get(record.part_id, 0) + record.quantity_used
+
+    with transaction.atomic():
+        short = stock.consume_many(quantities)
+        if short:
+            for record, item_errors in zip(records, errors):
+                if record.part_id in short:
+                    item_errors["quantity_used"] = [
+                        f"Not enough stock available: {quantities[record.part_id]} booked in total, "
+                        f"{short[record.part_id] or 0} in stock."
+                    ]
+            return [], errors
+
+        PartsUsageRecord.objects.bulk_create(records)
+        costs = {}
+        for record in records:
+            # Later saves of these instances only book their own changes
+            record._loaded_values = {
+                "part_id": record.part_id, "quantity_used": record.quantity_used, "breakdown_id": record.breakdown_id,
+            }
+            costs[record.breakdown] = costs.get(record.breakdown, Decimal("0")) + record.quantity_used * record.part.price
+        parts_costs_added(costs)
+    return records, errors
@@ -1,7 +1,9 @@
 from django.contrib import admin
 from django import forms
-from .models import  BreakdownLog, Machine, Type, Brand, Category, Supplier, ProblemCategory
+from .models import  BreakdownLog, Machine, Type, Brand, Category, Supplier, ProblemCategory, NotificationOutbox
 from django.shortcuts import redirect
+from django.utils import timezone
+from .transitions import transition_machines
 
 class MachineAdminForm(forms.ModelForm):
     class Meta:
@@ -30,20 +32,29 @@ class MachineAdmin(admin.ModelAdmin):
     # Enable the ability to add machines in the list view (useful for bulk actions)
     actions = ['mark_active', 'mark_inactive', 'mark_maintenance', 'mark_broken']
 
+    # Bulk transitions stamp the breakdown/repair times, log repaired
+    # breakdowns and send one notification (see maintenance/transitions.py)
+    def _transition(self, request, queryset, status):
+        machines, breakdown_logs = transition_machines(queryset, status)
+        message = f"{len(machines)} machine(s) marked as {status}."
+        if breakdown_logs:
+            message += f" {len(breakdown_logs)} breakdown log(s) recorded."
+        self.message_user(request, message)
+
     def mark_active(self, request, queryset):
-        queryset.update(status='active')
+        self._transition(request, queryset, 'active')
     mark_active.short_description = "Mark selected machines as Active"
 
     def mark_inactive(self, request, queryset):
-        queryset.update(status='inactive')
+        self._transition(request, queryset, 'inactive')
     mark_inactive.short_description = "Mark selected machines as Inactive"
 
     def mark_maintenance(self, request, queryset):
-        queryset.update(status='maintenance')
+        self._transition(request, queryset, 'maintenance')
     mark_maintenance.short_description = "Mark selected machines as Under Maintenance"
 
     def mark_broken(self, request, queryset):
-        queryset.update(status='broken')
+        self._transition(request, queryset, 'broken')
     mark_broken.short_description = "Mark selected machines as Broken"
 
     # def response_add(self, request, obj, post_url_continue=None):
@@ -112,5 +123,19 @@ admin.site.register(Supplier, SupplierAdmin)
 admin.site.register(Machine, MachineAdmin)
 admin.site.register(ProblemCategory, ProblemCategoryAdmin)
 
+
+class NotificationOutboxAdmin(admin.ModelAdmin):
+    list_display = ('title', 'topic', 'status', 'attempts', 'available_at', 'sent_at', 'last_error')
+    list_filter = ('status', 'topic')
+    search_fields = ('coalesce_key', 'title')
+    ordering = ('-created_at',)
+    actions = ['retry_now']
+
+    def retry_now(self, request, queryset):
+        queryset.exclude(status='sent').update(status='pending', available_at=timezone.now(), claimed_until=None)
+    retry_now.short_description = "Retry selected notifications now"
+
+admin.site.register(NotificationOutbox, NotificationOutboxAdmin)
+
 # admin.site.register(Mechanic)
 # admin.site.register(Machine)
\ No newline at end of file
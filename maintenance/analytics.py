@@ -0,0 +1,310 @@
+"""
+Aggregation engine behind the breakdown dashboards.
+
+Every summary on the total-lost-time dashboard is derived from a single
+grouped pass over the filtered breakdown logs. The database groups on the
+finest grain the dashboard needs (machine, problem, line, mechanic, day) and
+the per-dimension summaries are fanned out from those rows in Python, so the
+endpoint costs one scan of BreakdownLog instead of one per summary.
+
+The same grain is what BreakdownDailyRollup stores, so when the rollups are
+enabled (see rollups.py) the grouped rows are read from them instead and the
+cost of a request no longer grows with the breakdown history.
+
+Rows carry ids only; type, problem and line names come from the reference
+registry (see references.py), so those tables are never joined.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db.models import Count, Sum, Q, F, ExpressionWrapper, DurationField
+from django.db.models.functions import TruncDate
+
+from .models import BreakdownDailyRollup, BreakdownLog
+from .periods import plant_timezone, ranges_filter
+from .references import references
+from .rollups import rollups_enabled, split_range
+
+
+RESPONDED = Q(repairing_start__isnull=False)
+
+GROUP_FIELDS = (
+    "machine__id",
+    "machine__machine_id",
+    "machine__status",
+    "machine__type_id",
+    "problem_category_id",
+    "line_id",
+    "mechanic_id",
+    "day",
+)
+
+
+def format_duration(value):
+    """Render a timedelta the way the dashboard expects, "0:00:00" when empty."""
+    return str(value) if value else "0:00:00"
+
+
+def breakdown_groups(breakdown_queryset, extra_fields=()):
+    """
+    Group the filtered breakdown logs on the dashboard grain, plus any
+    extra_fields the caller has annotated (e.g. a comparison period).
+
+    "Responded" columns only cover logs with a repairing_start, which is what
+    the response-time figures (overall and per mechanic) are computed from.
+    """
+    respond_time = ExpressionWrapper(
+        F("repairing_start") - F("breakdown_start"),
+        output_field=DurationField()
+    )
+    return (
+        breakdown_queryset
+        .annotate(day=TruncDate("breakdown_start", tzinfo=plant_timezone()))
+        .values(*GROUP_FIELDS, *extra_fields)
+        .annotate(
+            breakdowns_count=Count("id"),
+            total_lost_time=Sum("lost_time"),
+            responded_count=Count("id", filter=RESPONDED),
+            responded_lost_time=Sum("lost_time", filter=RESPONDED),
+            total_response_time=Sum(respond_time, filter=RESPONDED),
+        )
+        .order_by()
+    )
+
+
+def rollup_groups(rollup_queryset, extra_fields=()):
+    """breakdown_groups() read from the daily rollups instead of the raw logs."""
+    return (
+        rollup_queryset
+        .values(*GROUP_FIELDS, *extra_fields)
+        .annotate(
+            breakdowns_count=Sum("breakdown_count"),
+            total_lost_time=Sum("lost_time"),
+            responded_count=Sum("response_count"),
+            responded_lost_time=Sum("response_lost_time"),
+            total_response_time=Sum("response_time"),
+        )
+        .filter(breakdowns_count__gt=0)
+        .order_by()
+    )
+
+
+def monitoring_groups(machine_ids, since, until=None):
+    """
+    Breakdown count and lost time per (machine, day, problem) for the window.
+
+    Whole days come from the rollups when they are enabled; the partial days
+    at the edges of the window (or the whole window otherwise) from the logs.
+    """
+    raw_ranges = [(since, until)]
+    rows = []
+    if rollups_enabled():
+        first_day, last_day, raw_ranges = split_range(since, until)
+        if first_day is not None:
+            rows.extend(
+                BreakdownDailyRollup.objects
+                .filter(machine_id__in=machine_ids, day__gte=first_day, day__lt=last_day)
+                .values("machine_id", "day", "problem_category_id")
+                .annotate(breakdowns_count=Sum("breakdown_count"), total_lost_time=Sum("lost_time"))
+                .filter(breakdowns_count__gt=0)
+                .order_by()
+            )
+    rows.extend(
+        BreakdownLog.objects
+        .filter(ranges_filter(raw_ranges), machine_id__in=machine_ids)
+        .annotate(day=TruncDate("breakdown_start", tzinfo=plant_timezone()))
+        .values("machine_id", "day", "problem_category_id")
+        .annotate(breakdowns_count=Count("id"), total_lost_time=Sum("lost_time"))
+        .order_by()
+    )
+    return rows
+
+
+def machine_status_counts(machine_queryset):
+    """Machine totals per status in one conditional aggregate."""
+    return machine_queryset.aggregate(
+        total_machine_count=Count("id"),
+        total_active_machines=Count("id", filter=Q(status="active")),
+        total_repairing_machines=Count("id", filter=Q(status="maintenance")),
+        total_idle_machines=Count("id", filter=Q(status="inactive")),
+    )
+
+
+def _bucket():
+    return {"breakdowns_count": 0, "lost_time": timedelta()}
+
+
+def summarize_breakdowns(rows):
+    """
+    Fan grouped rows (see breakdown_groups) out into the dashboard summaries.
+    """
+    total_lost_time = timedelta()
+    responded_count = 0
+    response_time = timedelta()
+
+    by_machine = defaultdict(_bucket)
+    by_type = defaultdict(_bucket)
+    type_machines = defaultdict(set)
+    by_problem = defaultdict(_bucket)
+    by_line = defaultdict(_bucket)
+    by_day = defaultdict(_bucket)
+    by_mechanic = {}
+
+    for row in rows:
+        count = row["breakdowns_count"]
+        lost_time = row["total_lost_time"] or timedelta()
+        total_lost_time += lost_time
+
+        type_name = references.name("type", row["machine__type_id"])
+        machine_key = (row["machine__id"], row["machine__machine_id"], row["machine__status"], type_name)
+        type_key = (row["machine__type_id"], type_name)
+        problem_key = (row["problem_category_id"], references.name("problem_category", row["problem_category_id"]))
+        line_key = (row["line_id"], references.name("line", row["line_id"]))
+
+        for summary, key in (
+            (by_machine, machine_key),
+            (by_type, type_key),
+            (by_problem, problem_key),
+            (by_line, line_key),
+            (by_day, row["day"]),
+        ):
+            summary[key]["breakdowns_count"] += count
+            summary[key]["lost_time"] += lost_time
+        type_machines[type_key].add(row["machine__id"])
+
+        # Mechanic figures (and the overall response time) only count logs
+        # that have a repairing_start.
+        if row["responded_count"]:
+            responded_count += row["responded_count"]
+            response_time += row["total_response_time"] or timedelta()
+            mechanic = by_mechanic.setdefault(row["mechanic_id"], {
+                "breakdowns_count": 0,
+                "lost_time": timedelta(),
+                "response_time": timedelta(),
+            })
+            mechanic["breakdowns_count"] += row["responded_count"]
+            mechanic["lost_time"] += row["responded_lost_time"] or timedelta()
+            mechanic["response_time"] += row["total_response_time"] or timedelta()
+
+    avg_time_to_respond = response_time / responded_count if responded_count else None
+
+    return {
+        "total_lost_time": format_duration(total_lost_time),
+        "avg_time_to_respond": format_duration(avg_time_to_respond),
+        "summary_by_machine_id": [
+            {
+                "id": machine_pk,
+                "machine_id": machine_id,
+                "status": status,
+                "type": type_name if type_name else None,
+                "breakdowns_count": item["breakdowns_count"],
+                "lost_time": format_duration(item["lost_time"]),
+            }
+            for (machine_pk, machine_id, status, type_name), item in by_machine.items()
+        ],
+        "summary_by_type": [
+            {
+                "type": type_name if type_name else None,
+                "machine_count": len(type_machines[(type_pk, type_name)] - {None}),
+                "breakdowns_count": item["breakdowns_count"],
+                "lost_time": format_duration(item["lost_time"]),
+            }
+            for (type_pk, type_name), item in by_type.items()
+        ],
+        "summary_by_problem": [
+            {
+                "problem": problem_name if problem_name else None,
+                "breakdowns_count": item["breakdowns_count"],
+                "lost_time": format_duration(item["lost_time"]),
+            }
+            for (problem_pk, problem_name), item in by_problem.items()
+        ],
+        "summary_by_line": [
+            {
+                "id": line_pk,
+                "line": line_name if line_name else None,
+                "breakdowns_count": item["breakdowns_count"],
+                "lost_time": format_duration(item["lost_time"]),
+            }
+            for (line_pk, line_name), item in by_line.items()
+        ],
+        "summary_by_day": [
+            {
+                "date": str(day),
+                "breakdowns_count": item["breakdowns_count"],
+                "lost_time": format_duration(item["lost_time"]),
+            }
+            for day, item in sorted(by_day.items())
+        ],
+        "summary_by_mechanic": [
+            {
+                "id": mechanic_pk,
+                "avg_time_to_respond": format_duration(item["response_time"] / item["breakdowns_count"]),
+                "breakdowns_count": item["breakdowns_count"],
+                "lost_time": format_duration(item["lost_time"]),
+            }
+            for mechanic_pk, item in by_mechanic.items()
+        ],
+    }
+
+
+# Working time the monitoring figures are measured against: 7 days x 10 hours
+MONITORING_WEEK_MINUTES = 7 * 10 * 60
+
+
+def monitoring_summaries(machines, since):
+    """
+    Last-week monitoring figures for many machines from one grouped pass.
+
+    Names come from the reference registry, so machines need nothing
+    selected. Returns a dict keyed by machine pk.
+    """
+    daily_lost_time = defaultdict(lambda: defaultdict(timedelta))
+    reasons_lost_time = defaultdict(lambda: defaultdict(timedelta))
+    breakdowns_count = defaultdict(int)
+    for row in monitoring_groups([machine.pk for machine in machines], since):
+        daily_lost_time[row["machine_id"]][row["day"]] += row["total_lost_time"]
+        problem_name = references.name("problem_category", row["problem_category_id"])
+        reasons_lost_time[row["machine_id"]][problem_name] += row["total_lost_time"]
+        breakdowns_count[row["machine_id"]] += row["breakdowns_count"]
+
+    summaries = {}
+    for machine in machines:
+        daily = daily_lost_time[machine.pk]
+        count = breakdowns_count[machine.pk]
+        total_lost_time = sum(daily.values(), timedelta())
+        utilization = 1 - ((total_lost_time.total_seconds() / 60) / MONITORING_WEEK_MINUTES)
+        mtbf = timedelta(minutes=(MONITORING_WEEK_MINUTES / count)) if count > 1 else None
+
+        line = references.get("line", machine.line_id)
+        summaries[machine.pk] = {
+            "id": machine.id,
+            "machine_id": machine.machine_id,
+            "model_number": machine.model_number,
+            "serial_no": machine.serial_no,
+            "purchase_date": machine.purchase_date,
+            "last_breakdown_start": machine.last_breakdown_start,
+            "status": machine.status,
+            "category": references.name("category", machine.category_id),
+            "type": references.name("type", machine.type_id),
+            "brand": references.name("brand", machine.brand_id),
+            "line": line["name"] if line else None,
+            "floor": references.name("floor", line["floor_id"]) if line else None,
+            "supplier": references.name("supplier", machine.supplier_id),
+            "total-lost-time-last-week": format_duration(total_lost_time),
+            "utilization-last-week": utilization,
+            "breakdowns-count-last-week": count,
+            "MTBF-last-week": format_duration(mtbf),
+            "breakdowns-last-week": [
+                {"date": day, "lost-time": str(lost_time)}
+                for day, lost_time in sorted(daily.items())
+            ],
+            "lost-time-reasons-last-week": [
+                {"problem-category": problem_category, "lost-time": str(lost_time)}
+                for problem_category, lost_time in sorted(
+                    reasons_lost_time[machine.pk].items(),
+                    key=lambda reason: (reason[0] is None, reason[0] or ""),
+                )
+            ],
+        }
+    return summaries
@@ -0,0 +1,116 @@
+"""
+Live floor board stream: Server-Sent Events instead of polling.
+
+GET /api/maintenance/live/?company=1&floor=2&line=3,4 (every filter
+optional, comma separated) keeps the connection open and sends:
+
+- one "snapshot" event with the current status of the matching machines,
+- a "machine_status" event for every status change,
+- a "breakdown" event for every breakdown logged,
+- a comment line every LIVE_EVENTS["KEEPALIVE_SECONDS"] while idle.
+
+Browsers reconnect by themselves (EventSource) and get a fresh snapshot.
+The view is async and needs the ASGI application (core/asgi.py, e.g.
+`uvicorn core.asgi:application`); an idle board then costs an open socket
+rather than a worker thread. Clients authenticate with their API token
+(Authorization: Token ...) or the session. A user with an employee company
+only sees that company (core/tenancy.py); asking for another one is refused.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework.exceptions import AuthenticationFailed
+
+from core.broadcast import config, get_broadcaster
+from core.tenancy import user_company
+from user_management.authentication import CachedTokenAuthentication
+from ..live import matches
+from ..models import Machine
+
+
+def _own_company_id(request):
+    """The company of the token (or else session) user; raises AuthenticationFailed for a bad token."""
+    # A plain Django view: DRF's authentication does not run by itself
+    authenticated = CachedTokenAuthentication().authenticate(request)
+    company = user_company(authenticated[0] if authenticated else request.user)
+    return company.pk if company is not None else None
+
+
+def _ids(value):
+    return {int(part) for part in value.split(",") if part.strip()}
+
+
+def _message(event_type, data):
+    return f"event: {event_type}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+def _snapshot(companies, floors, lines):
+    machines = Machine.objects.all()
+    if companies:
+        machines = machines.filter(company_id__in=companies)
+    if floors:
+        machines = machines.filter(line__floor_id__in=floors)
+    if lines:
+        machines = machines.filter(line_id__in=lines)
+    return list(
+        machines.order_by("machine_id").values(
+            "id", "machine_id", "status", "last_problem", "last_breakdown_start", "last_repairing_start",
+            "company_id", "line_id", "line__name", "line__floor_id",
+        )
+    )
+
+
+async def _stream(subscription, snapshot):
+    broadcaster = get_broadcaster()
+    keepalive = config()["KEEPALIVE_SECONDS"]
+    try:
+        yield "retry: 5000\n\n"
+        yield _message("snapshot", snapshot)
+        while True:
+            event = await subscription.get(timeout=keepalive)
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                yield _message(event["type"], event)
+    finally:
+        # Runs when the client disconnects and the response is cancelled
+        broadcaster.unsubscribe(subscription)
+
+
+async def machine_events(request):
+    if request.method != "GET":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({"error": "The live stream is only served by the ASGI application"}, status=501)
+    try:
+        companies = _ids(request.GET.get("company", ""))
+        floors = _ids(request.GET.get("floor", ""))
+        lines = _ids(request.GET.get("line", ""))
+    except ValueError:
+        return JsonResponse({"error": "company, floor and line must be comma separated ids"}, status=400)
+    try:
+        # Token and request.user lookups run queries
+        own_company_id = await sync_to_async(_own_company_id)(request)
+    except AuthenticationFailed as exc:
+        return JsonResponse({"error": str(exc.detail)}, status=401)
+    if own_company_id is not None:
+        if companies - {own_company_id}:
+            return JsonResponse({"error": "Company not found"}, status=403)
+        companies = {own_company_id}
+
+    # Subscribe before taking the snapshot so no change falls in between
+    subscription = get_broadcaster().subscribe(matches(companies, floors, lines))
+    try:
+        snapshot = await sync_to_async(_snapshot)(companies, floors, lines)
+    except BaseException:
+        get_broadcaster().unsubscribe(subscription)
+        raise
+
+    response = StreamingHttpResponse(_stream(subscription, snapshot), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Tell nginx not to buffer the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
@@ -1,5 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from .live import machine_events
 from .views import BreakdownLogViewSet,  MachineViewSet, MachinePaginationViewSet, TypeViewSet, SupplierViewSet, CategoryViewSet, BrandViewSet, ProblemCategoryViewSet, ProblemCategoryTypeViewSet
 
 router = DefaultRouter()
@@ -15,5 +16,6 @@ router.register(r'problem-category', ProblemCategoryViewSet, basename='problem-c
 router.register(r'problem-category-type', ProblemCategoryTypeViewSet, basename='problem-category-type')
 
 urlpatterns = [
+    path('live/', machine_events, name='machine-live'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
@@ -1,22 +1,43 @@
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
-from ..models import BreakdownLog, Machine, Type, Brand, Category, Supplier, ProblemCategory, ProblemCategoryType
+from ..models import BreakdownLog, BreakdownDailyRollup, Machine, Type, Brand, Category, Supplier, ProblemCategory, ProblemCategoryType
 from .serializers import BreakdownLogSerializer, MachineSerializer, TypeSerializers, BrandSerializers, CategorySerializers, SupplierSerializers, ProblemCategorySerializers, ProblemCategoryTypeSerializer
 from rest_framework.exceptions import ValidationError
 from django_filters.rest_framework import DjangoFilterBackend
-from ..filters import MachineFilter
+from ..filters import MachineFilter, MachineSearchFilter
 from rest_framework import filters
 from rest_framework.pagination import PageNumberPagination
 from permissions.base_permissions import HasGroupPermission
+from company.models import Company
 from rest_framework.exceptions import NotFound
-from django.db.models import Sum, Count, Avg, F, ExpressionWrapper, DurationField
+from django.db.models import Sum, Count, Avg, F, ExpressionWrapper, DurationField, Case, When, Value, CharField
 from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 from django.utils import timezone
 from django.utils.dateparse import parse_date
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from django.db.models.functions import TruncDate
 from datetime import timedelta
 from collections import defaultdict
 from rest_framework.exceptions import PermissionDenied
+from ..analytics import breakdown_groups, rollup_groups, monitoring_summaries, machine_status_counts, summarize_breakdowns
+from ..rollups import rollups_enabled
+from ..periods import parse_bound, previous_window, days_filter, plant_day, is_day_boundary
+from ..reliability import GRANULARITIES, reliability_report
+from ..search import search_machines
+from ..notifications import stats as notification_stats
+from ..transitions import transition_machines
+from ..timeline import time_in_state
+from ..references import references
+from ..problems import problem_tree
+from ..hierarchy import changes_since, full_document
+from ..imports import ImportFileError, import_machines
+from .. import cache as analytics_cache
+from core.exports import OUTPUTS, stream_export
+from core.conditional import ConditionalGetMixin
+from core.tenancy import CompanyScopedMixin
+from core.pagination import BreakdownLogCursorPagination, MachineCursorPagination
 
 class MachinePagination(PageNumberPagination):
     page_size = 10  # Number of items per page
@@ -24,21 +45,202 @@ class MachinePagination(PageNumberPagination):
     max_page_size = 100  # Maximum number of items per page
 
 
-class MachineViewSet(ModelViewSet):
+class MachineViewSet(CompanyScopedMixin, ModelViewSet):
     queryset = Machine.objects.all()
     serializer_class = MachineSerializer
-    filter_backends = (DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter)
+    filter_backends = (DjangoFilterBackend, MachineSearchFilter, filters.OrderingFilter)
     filterset_class = MachineFilter
     ordering_fields = '__all__'  # Allows ordering on all fields
     ordering = ['id']  
+    pagination_class = MachineCursorPagination  # opt-in: only with ?cursor= or ?page_size=
     # permission_classes = [HasGroupPermission]
-    search_fields = [
-        'machine_id', 'category__name', 'type__name', 'brand__name', 
-        'model_number', 'serial_no', 'line__name', 'sequence', 'supplier__name', 
-        'purchase_date', 'last_breakdown_start', 'last_repairing_start', 
-        'mechanic__name', 'operator__name', 'last_problem', 'status', 
-        'company__name', 'line__floor__name'
-    ]
+    # ?search= matches the machine search documents (fields in maintenance/search.py)
+
+    @action(detail=False, methods=["get"], url_path="search")
+    def search(self, request):
+        """
+        Search-as-you-type: machines whose search document contains every
+        word of ?q=, as compact rows, at most ?limit= (default 20, max 100).
+        """
+        query = request.query_params.get("q", "")
+        try:
+            limit = min(max(int(request.query_params.get("limit", 20)), 1), 100)
+        except ValueError:
+            return Response({"error": "limit must be a number"}, status=400)
+        if not query.strip():
+            return Response([])
+
+        machines = (
+            search_machines(self.get_queryset(), query)
+            .order_by("machine_id")
+            .values("id", "machine_id", "model_number", "status", "line_id")[:limit]
+        )
+        results = []
+        for machine in machines:
+            line = references.get("line", machine["line_id"])
+            results.append({
+                "id": machine["id"],
+                "machine_id": machine["machine_id"],
+                "model_number": machine["model_number"],
+                "status": machine["status"],
+                "line": line["name"] if line else None,
+                "floor": references.name("floor", line["floor_id"]) if line else None,
+            })
+        return Response(results)
+
+    @action(detail=False, methods=["post"], url_path="bulk-transition")
+    def bulk_transition(self, request):
+        """
+        Move many machines to one status in a single statement, e.g. a whole
+        floor at shift change. Body: {"status": "active", "machine_ids": [...],
+        "line": [...], "floor": [...], "last_problem": "..."}; at least one
+        selector is required. Machines already in the status are skipped.
+        """
+        new_status = request.data.get("status")
+        machine_id_list = request.data.get("machine_ids") or []
+        line_no_list = request.data.get("line") or []
+        floor_list = request.data.get("floor") or []
+        last_problem = request.data.get("last_problem")
+
+        if new_status not in dict(Machine.STATUS_CHOICES):
+            return Response({"error": f"status must be one of {', '.join(dict(Machine.STATUS_CHOICES))}"}, status=400)
+        if not all(isinstance(value, list) for value in (machine_id_list, line_no_list, floor_list)):
+            return Response({"error": "machine_ids, line and floor must be lists"}, status=400)
+        if not (machine_id_list or line_no_list or floor_list):
+            return Response({"error": "machine_ids, line or floor is required"}, status=400)
+
+        machine_queryset = self.get_queryset()
+        if machine_id_list:
+            machine_queryset = machine_queryset.filter(machine_id__in=machine_id_list)
+        if line_no_list:
+            machine_queryset = machine_queryset.filter(line__id__in=line_no_list)
+        if floor_list:
+            machine_queryset = machine_queryset.filter(line__floor__id__in=floor_list)
+
+        machines, breakdown_logs = transition_machines(machine_queryset, new_status, last_problem=last_problem)
+        return Response({
+            "status": new_status,
+            "changed": len(machines),
+            "machine_ids": [machine.machine_id for machine in machines],
+            "breakdown_logs": [log.pk for log in breakdown_logs],
+        })
+
+    @action(detail=False, methods=["get"], url_path="status-timeline")
+    def status_timeline(self, request):
+        """
+        Hours and share of the window each machine, line and floor spent
+        active, inactive, under maintenance, broken (or unknown, before its
+        history starts). Defaults to the last 30 days of every machine; a
+        single ?machine_id= also lists the intervals.
+        """
+        machine_ids = request.query_params.get("machine_id", "")   # e.g., "M-1,M-2"
+        line_nos = request.query_params.get("line", "")             # e.g., "3,4"
+        floors = request.query_params.get("floor", "")              # e.g., "1"
+        start = request.query_params.get("start", "")               # e.g., "2025-01-01" or an ISO datetime
+        end = request.query_params.get("end", "")                   # e.g., "2025-01-31" (a date end is inclusive)
+
+        machine_id_list = [m.strip() for m in machine_ids.split(",") if m.strip()]
+        line_no_list = [l.strip() for l in line_nos.split(",") if l.strip()]
+        floor_list = [f.strip() for f in floors.split(",") if f.strip()]
+
+        window_end = parse_bound(end, end=True) if end else timezone.now()
+        window_start = parse_bound(start) if start else (window_end - timedelta(days=30) if window_end else None)
+        if window_start is None or window_end is None:
+            return Response({"error": "start and end must be dates (YYYY-MM-DD) or ISO datetimes"}, status=400)
+        if window_start >= window_end:
+            return Response({"error": "start must be before end"}, status=400)
+
+        machine_queryset = self.get_queryset()
+        if machine_id_list:
+            machine_queryset = machine_queryset.filter(machine_id__in=machine_id_list)
+        if line_no_list:
+            machine_queryset = machine_queryset.filter(line__id__in=line_no_list)
+        if floor_list:
+            machine_queryset = machine_queryset.filter(line__floor__id__in=floor_list)
+        with_events = len(machine_id_list) == 1
+
+        compute = lambda: time_in_state(machine_queryset, window_start, window_end, with_events=with_events)
+        if not end or window_end > timezone.now():
+            # A window still running never repeats, so there is nothing to cache
+            return Response(compute())
+
+        response_data = analytics_cache.get_or_compute(
+            "status-timeline",
+            {
+                "machine_id": sorted(machine_id_list),
+                "line": sorted(line_no_list),
+                "floor": sorted(floor_list),
+                "start": window_start.isoformat(),
+                "end": window_end.isoformat(),
+            },
+            analytics_cache.scopes_for(floors=floor_list, lines=line_no_list),
+            compute,
+            company_id=self.get_company_id(),
+        )
+        return Response(response_data)
+
+    @action(detail=False, methods=["post"], url_path="import", parser_classes=[MultiPartParser])
+    def import_machines(self, request):
+        """
+        Create or update machines from an uploaded .csv or .xlsx sheet (form
+        field "file"), one row per machine keyed on machine_id. Names are
+        resolved as described in maintenance/imports.py. ?company= picks the
+        company (defaults to the user's); ?dry_run=true only validates.
+        Returns the counts and a per-row error report.
+        """
+        upload = request.FILES.get("file")
+        if upload is None:
+            return Response({"error": "file is required"}, status=400)
+
+        company_id = request.query_params.get("company") or request.data.get("company")
+        if company_id:
+            companies = self.scope(Company.objects.all(), "pk")
+            company = companies.filter(pk=company_id).first() if str(company_id).isdigit() else None
+            if company is None:
+                return Response({"error": "Company not found"}, status=400)
+        else:
+            company = self.get_company()
+            if company is None:
+                return Response({"error": "company is required"}, status=400)
+
+        dry_run = str(request.query_params.get("dry_run", "")).lower() in ("1", "true", "yes")
+        try:
+            report = import_machines(upload, upload.name, company, dry_run=dry_run)
+        except ImportFileError as exc:
+            return Response({"error": str(exc)}, status=400)
+        return Response(report)
+
+    @action(detail=False, methods=["get"], url_path="plant-hierarchy")
+    def plant_hierarchy(self, request):
+        """
+        Floors, lines and machines of ?company= (comma list, default all, or
+        the user's own company) as one nested document with a version. Pass that version back as
+        ?since= to get only what changed (see maintenance/hierarchy.py).
+        """
+        companies = request.query_params.get("company", "")   # e.g., "1"
+        since = request.query_params.get("since", "")         # version of the last response
+        try:
+            company_ids = [int(c) for c in companies.split(",") if c.strip()]
+            since = int(since) if since else None
+        except ValueError:
+            return Response({"error": "company and since must be numbers"}, status=400)
+        own_company_id = self.get_company_id()
+        if own_company_id is not None:
+            company_ids = [own_company_id]
+
+        if since is None:
+            return Response(full_document(company_ids))
+        return Response(changes_since(since, company_ids))
+
+    @action(detail=False, methods=["get"], url_path="reference-stats")
+    def reference_stats(self, request):
+        """Hit ratio and table sizes of this process's reference registry."""
+        return Response(references.stats())
+
+    @action(detail=False, methods=["get"], url_path="notification-stats")
+    def notification_stats(self, request):
+        """Queued, suppressed (coalesced), delivered, rate-limited and failed notification counters."""
+        return Response(notification_stats())
 
     # def get_ordering(self):
     #     ordering = self.request.query_params.get('ordering', None)
@@ -50,28 +252,24 @@ class MachineViewSet(ModelViewSet):
     #         return [ordering]
     #     return super().get_ordering()
     
-class MachinePaginationViewSet(ModelViewSet):
+class MachinePaginationViewSet(CompanyScopedMixin, ModelViewSet):
     queryset = Machine.objects.all()
     serializer_class = MachineSerializer
-    filter_backends = (DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter)
+    filter_backends = (DjangoFilterBackend, MachineSearchFilter, filters.OrderingFilter)
     filterset_class = MachineFilter
     ordering_fields = '__all__'  # Allows ordering on all fields
     ordering = ['id']  
     pagination_class = MachinePagination
     # permission_classes = [HasGroupPermission]
-    search_fields = [
-        'machine_id', 'category__name', 'type__name', 'brand__name', 
-        'model_number', 'serial_no', 'line__name', 'sequence', 'supplier__name', 
-        'purchase_date', 'last_breakdown_start', 'last_repairing_start', 
-        'mechanic__name', 'operator__name', 'last_problem', 'status', 
-        'company__name', 'line__floor__name'
-    ]
+    # ?search= matches the machine search documents (fields in maintenance/search.py)
 
 
     
-class BreakdownLogViewSet(ModelViewSet):
+class BreakdownLogViewSet(CompanyScopedMixin, ModelViewSet):
     queryset = BreakdownLog.objects.all()
+    company_field = "machine__company"
     serializer_class = BreakdownLogSerializer
+    pagination_class = BreakdownLogCursorPagination  # opt-in: only with ?cursor= or ?page_size=
     # permission_classes = [HasGroupPermission]
 
     @action(detail=False, methods=["get"], url_path="total-lost-time-per-location")
@@ -80,12 +278,54 @@ class BreakdownLogViewSet(ModelViewSet):
         floors = request.query_params.get("floor", "")  # e.g., "1,2"
         line_nos = request.query_params.get("line", "")  # e.g., "3"
         dates = request.query_params.get("date", "")     # e.g., "2025-02-05,2025-02-06"
+        start = request.query_params.get("start", "")    # e.g., "2025-02-01" or an ISO datetime
+        end = request.query_params.get("end", "")        # e.g., "2025-02-28" (a date end is inclusive)
+        compare = request.query_params.get("compare", "")  # "previous_period"
 
         floor_list = [f.strip() for f in floors.split(",") if f.strip()] if floors else []
         line_no_list = [l.strip() for l in line_nos.split(",") if l.strip()] if line_nos else []
         date_list = [d.strip() for d in dates.split(",") if d.strip()] if dates else []
 
-        breakdown_queryset = self.get_queryset()
+        window_start = parse_bound(start) if start else None
+        window_end = parse_bound(end, end=True) if end else None
+        if (start and window_start is None) or (end and window_end is None):
+            return Response({"error": "start and end must be dates (YYYY-MM-DD) or ISO datetimes"}, status=400)
+        if window_start and window_end and window_start >= window_end:
+            return Response({"error": "start must be before end"}, status=400)
+        if compare and compare != "previous_period":
+            return Response({"error": "compare only supports 'previous_period'"}, status=400)
+        if compare and not (window_start and window_end):
+            return Response({"error": "compare=previous_period requires start and end"}, status=400)
+        if compare and date_list:
+            return Response({"error": "compare=previous_period cannot be combined with date"}, status=400)
+
+        response_data = analytics_cache.get_or_compute(
+            "total-lost-time",
+            {
+                "floor": sorted(floor_list),
+                "line": sorted(line_no_list),
+                "date": sorted(date_list),
+                "start": window_start.isoformat() if window_start else None,
+                "end": window_end.isoformat() if window_end else None,
+                "compare": compare,
+            },
+            analytics_cache.scopes_for(floors=floor_list, lines=line_no_list),
+            lambda: self._total_lost_time_data(floor_list, line_no_list, date_list, window_start, window_end, bool(compare)),
+            company_id=self.get_company_id(),
+        )
+        # Echo the filters in the order this request gave them
+        response_data = {**response_data, "floors": floor_list, "line_nos": line_no_list, "dates": date_list}
+
+        return Response(response_data)
+
+    def _total_lost_time_data(self, floor_list, line_no_list, date_list, window_start=None, window_end=None, compare=False):
+        # Date filters are whole days, so the daily rollups can answer them when
+        # they are enabled and any start/end falls on a day boundary; otherwise
+        # group the raw logs.
+        use_rollups = rollups_enabled() and all(
+            is_day_boundary(bound) for bound in (window_start, window_end) if bound is not None
+        )
+        breakdown_queryset = self.scope(BreakdownDailyRollup.objects.all(), "company") if use_rollups else self.get_queryset()
 
         if floor_list:
             breakdown_queryset = breakdown_queryset.filter(line__floor__id__in=floor_list)
@@ -99,189 +339,86 @@ class BreakdownLogViewSet(ModelViewSet):
                 if parsed_date:
                     parsed_dates.append(parsed_date)
             if parsed_dates:
-                breakdown_queryset = breakdown_queryset.filter(breakdown_start__date__in=parsed_dates)
-
-        # Calculate total lost time (stringified)
-        total_lost_time = breakdown_queryset.aggregate(total=Sum("lost_time"))["total"]
-        formatted_total_lost_time = str(total_lost_time) if total_lost_time else "0:00:00"
+                if use_rollups:
+                    breakdown_queryset = breakdown_queryset.filter(day__in=parsed_dates)
+                else:
+                    breakdown_queryset = breakdown_queryset.filter(days_filter(parsed_dates))
+
+        # With compare=previous_period both windows are read in the same
+        # grouped query and told apart by a "period" column.
+        scan_start = previous_window(window_start, window_end)[0] if compare else window_start
+        period_fields = ()
+        if use_rollups:
+            if scan_start:
+                breakdown_queryset = breakdown_queryset.filter(day__gte=plant_day(scan_start))
+            if window_end:
+                breakdown_queryset = breakdown_queryset.filter(day__lt=plant_day(window_end))
+            if compare:
+                breakdown_queryset = breakdown_queryset.annotate(period=Case(
+                    When(day__lt=plant_day(window_start), then=Value("previous")),
+                    default=Value("current"),
+                    output_field=CharField(),
+                ))
+                period_fields = ("period",)
+        else:
+            if scan_start:
+                breakdown_queryset = breakdown_queryset.filter(breakdown_start__gte=scan_start)
+            if window_end:
+                breakdown_queryset = breakdown_queryset.filter(breakdown_start__lt=window_end)
+            if compare:
+                breakdown_queryset = breakdown_queryset.annotate(period=Case(
+                    When(breakdown_start__lt=window_start, then=Value("previous")),
+                    default=Value("current"),
+                    output_field=CharField(),
+                ))
+                period_fields = ("period",)
 
         # Machines (filtered by floor/line but NOT date)
-        machine_queryset = Machine.objects.all()
+        machine_queryset = self.scope(Machine.objects.all(), "company")
         if floor_list:
             machine_queryset = machine_queryset.filter(line__floor__id__in=floor_list)
         if line_no_list:
             machine_queryset = machine_queryset.filter(line__id__in=line_no_list)
 
-        total_machine_count = machine_queryset.count()
-        total_active_machines = machine_queryset.filter(status="active").count()
-        total_repairing_machines = machine_queryset.filter(status="maintenance").count()
-        total_idle_machines = machine_queryset.filter(status="inactive").count()
-
-        # overall avg_time_to_respond for the filtered BreakdownLogs
-        # here, "time to respond" = (repairing_start - breakdown_start) and I exclude records with no repairing_start.
-        respond_stats = (
-            breakdown_queryset
-            .exclude(repairing_start__isnull=True)
-            .annotate(
-                respond_time=ExpressionWrapper(
-                    F('repairing_start') - F('breakdown_start'),
-                    output_field=DurationField()
-                )
-            )
-            .aggregate(avg_time=Avg('respond_time'))
-        )
-        overall_avg_respond_time = respond_stats["avg_time"]
-        formatted_avg_time_to_respond = str(overall_avg_respond_time) if overall_avg_respond_time else "0:00:00"
-
-        # Summaries
-
-        # summary by Machine (group by machine)
-        summary_by_machine_qs = (
-            breakdown_queryset
-            .values(
-                "machine__id",
-                "machine__machine_id",
-                "machine__status",
-                "machine__type__name",
-            )
-            .annotate(
-                breakdowns_count=Count("id"),
-                lost_time=Sum("lost_time")
-            )
-        )
-        summary_by_machine_id = []
-        for item in summary_by_machine_qs:
-            summary_by_machine_id.append({
-                "id": item["machine__id"],
-                "machine_id": item["machine__machine_id"],
-                "status": item["machine__status"],
-                "type": item["machine__type__name"] if item["machine__type__name"] else None,
-                "breakdowns_count": item["breakdowns_count"],
-                "lost_time": str(item["lost_time"]) if item["lost_time"] else "0:00:00",
-            })
-
-        # Summary by Type (group by machine type)
-        # Also count distinct machines of that type (in the *filtered breakdowns*)
-        summary_by_type_qs = (
-            breakdown_queryset
-            .values("machine__type__id", "machine__type__name")
-            .annotate(
-                machine_count=Count("machine__id", distinct=True),
-                breakdowns_count=Count("id"),
-                lost_time=Sum("lost_time"),
-            )
-        )
-        summary_by_type = []
-        for item in summary_by_type_qs:
-            summary_by_type.append({
-                "type": item["machine__type__name"] if item["machine__type__name"] else None,
-                "machine_count": item["machine_count"],
-                "breakdowns_count": item["breakdowns_count"],
-                "lost_time": str(item["lost_time"]) if item["lost_time"] else "0:00:00"
-            })
-
-        # Summary by Problem (group by problem_category)
-        summary_by_problem_qs = (
-            breakdown_queryset
-            .values("problem_category__id", "problem_category__name")
-            .annotate(
-                breakdowns_count=Count("id"),
-                lost_time=Sum("lost_time")
-            )
-        )
-        summary_by_problem = []
-        for item in summary_by_problem_qs:
-            summary_by_problem.append({
-                "problem": item["problem_category__name"] if item["problem_category__name"] else None,
-                "breakdowns_count": item["breakdowns_count"],
-                "lost_time": str(item["lost_time"]) if item["lost_time"] else "0:00:00"
-            })
-
-        # Summary by Line (group by line)
-        summary_by_line_qs = (
-            breakdown_queryset
-            .values("line__id", "line__name")
-            .annotate(
-                breakdowns_count=Count("id"),
-                lost_time=Sum("lost_time")
-            )
-        )
-        summary_by_line = []
-        for item in summary_by_line_qs:
-            summary_by_line.append({
-                "id": item["line__id"],
-                "line": item["line__name"] if item["line__name"] else None,
-                "breakdowns_count": item["breakdowns_count"],
-                "lost_time": str(item["lost_time"]) if item["lost_time"] else "0:00:00"
-            })
-
-        # Summary by Day (group by date of breakdown_start)
-        #    Use TruncDate to group by the date portion
-        summary_by_day_qs = (
-            breakdown_queryset
-            .annotate(date_only=TruncDate("breakdown_start"))
-            .values("date_only")
-            .annotate(
-                breakdowns_count=Count("id"),
-                lost_time=Sum("lost_time")
-            )
-        )
-        summary_by_day = []
-        for item in summary_by_day_qs:
-            summary_by_day.append({
-                "date": str(item["date_only"]),  # e.g., "2025-02-05"
-                "breakdowns_count": item["breakdowns_count"],
-                "lost_time": str(item["lost_time"]) if item["lost_time"] else "0:00:00"
-            })
-
-        # Summary by Mechanic (group by mechanic)
-        # Also include average time to respond per mechanic
-        summary_by_mechanic_qs = (
-            breakdown_queryset
-            # exclude logs that have no repairing_start so we can compute a response time
-            .exclude(repairing_start__isnull=True)
-            .annotate(
-                respond_time=ExpressionWrapper(
-                    F("repairing_start") - F("breakdown_start"),
-                    output_field=DurationField()
-                )
-            )
-            .values("mechanic__id")
-            .annotate(
-                breakdowns_count=Count("id"),
-                lost_time=Sum("lost_time"),
-                avg_time_to_respond=Avg("respond_time")
-            )
-        )
-        summary_by_mechanic = []
-        for item in summary_by_mechanic_qs:
-            summary_by_mechanic.append({
-                "id": item["mechanic__id"],
-                "avg_time_to_respond": str(item["avg_time_to_respond"]) if item["avg_time_to_respond"] else "0:00:00",
-                "breakdowns_count": item["breakdowns_count"],
-                "lost_time": str(item["lost_time"]) if item["lost_time"] else "0:00:00"
-            })
+        # One conditional aggregate for the machine counts and one grouped
+        # pass over the breakdowns; every summary is fanned out from the latter.
+        machine_counts = machine_status_counts(machine_queryset)
+        if use_rollups:
+            grouped = list(rollup_groups(breakdown_queryset, period_fields))
+        else:
+            grouped = list(breakdown_groups(breakdown_queryset, period_fields))
+        summaries = summarize_breakdowns(row for row in grouped if row.get("period", "current") == "current")
 
         response_data = {
             "floors": floor_list,
             "line_nos": line_no_list,
             "dates": date_list,
-            "total_lost_time": formatted_total_lost_time,
-            "total_machine_count": total_machine_count,
-            "total_active_machines": total_active_machines,
-            "total_repairing_machines": total_repairing_machines,
-            "total_idle_machines": total_idle_machines,       
-            "avg_time_to_respond": formatted_avg_time_to_respond,
-
-            "summary_by_machine_id": summary_by_machine_id,
-            "summary_by_type": summary_by_type,
-            "summary_by_problem": summary_by_problem,
-            "summary_by_line": summary_by_line,
-            "summary_by_day": summary_by_day,
-            "summary_by_mechanic": summary_by_mechanic,
+            "total_lost_time": summaries["total_lost_time"],
+            "total_machine_count": machine_counts["total_machine_count"],
+            "total_active_machines": machine_counts["total_active_machines"],
+            "total_repairing_machines": machine_counts["total_repairing_machines"],
+            "total_idle_machines": machine_counts["total_idle_machines"],
+            "avg_time_to_respond": summaries["avg_time_to_respond"],
+
+            "summary_by_machine_id": summaries["summary_by_machine_id"],
+            "summary_by_type": summaries["summary_by_type"],
+            "summary_by_problem": summaries["summary_by_problem"],
+            "summary_by_line": summaries["summary_by_line"],
+            "summary_by_day": summaries["summary_by_day"],
+            "summary_by_mechanic": summaries["summary_by_mechanic"],
         }
+        if window_start or window_end:
+            response_data["start"] = window_start
+            response_data["end"] = window_end
+        if compare:
+            previous_start, previous_end = previous_window(window_start, window_end)
+            response_data["previous_period"] = {
+                "start": previous_start,
+                "end": previous_end,
+                **summarize_breakdowns(row for row in grouped if row["period"] == "previous"),
+            }
 
-        return Response(response_data)
+        return response_data
 
     """
     @action(detail=False, methods=["get"], url_path="total-lost-time-per-location")
@@ -446,126 +583,241 @@ class BreakdownLogViewSet(ModelViewSet):
             return Response({"error": "Machine ID is required"}, status=400)
 
         # Retrieve the machine object based on the provided machine_id
-        machine = Machine.objects.filter(machine_id=machine_id).first()
+        # Related names come from the reference registry, no joins needed
+        machine = self.scope(Machine.objects.all(), "company").filter(machine_id=machine_id).first()
         if not machine:
             return Response({"error": "Machine not found"}, status=404)
 
-        # Get the breakdowns for the specified machine in the last week
-        one_week_ago = timezone.now() - timedelta(weeks=1)
-        breakdowns_last_week = BreakdownLog.objects.filter(
-            machine=machine, breakdown_start__gte=one_week_ago
+        response_data = analytics_cache.get_or_compute(
+            "machines-monitoring",
+            {"machine_id": machine_id},
+            analytics_cache.scopes_for(machines=[machine.pk]),
+            lambda: self._machine_monitoring_data(machine),
+            company_id=self.get_company_id(),
         )
 
-        # Group lost time by day
-        daily_lost_time = defaultdict(timedelta)  # Initialize with timedelta values
-        for breakdown in breakdowns_last_week:
-            breakdown_date = breakdown.breakdown_start.date()  # Extract date
-            daily_lost_time[breakdown_date] += breakdown.lost_time  # Add lost time
-
-        # Format daily lost time into a list of dictionaries
-        daily_lost_time_list = [
-            {"date": day, "lost-time": str(lost_time)}
-            for day, lost_time in sorted(daily_lost_time.items())
-        ]
-
-        # Additional Calculations (existing logic remains the same)
-        total_lost_time_last_week = breakdowns_last_week.aggregate(
-            total_lost_time=Sum("lost_time")
-        )["total_lost_time"]
+        return Response(response_data)
 
-        breakdowns_count_last_week = breakdowns_last_week.count()
-        total_active_time_last_week = sum(
-            breakdown.lost_time.total_seconds() for breakdown in breakdowns_last_week
+    def _machine_monitoring_data(self, machine):
+        one_week_ago = timezone.now() - timedelta(weeks=1)
+        return monitoring_summaries([machine], one_week_ago)[machine.pk]
+
+    @action(detail=False, methods=["get"], url_path="machines-monitoring-batch")
+    def machine_monitoring_batch(self, request):
+        """
+        machines-monitoring for many machines at once, selected by machine_id
+        (comma list), line and/or floor ids. Returns a dict keyed by machine_id.
+        """
+        machine_ids = request.query_params.get("machine_id", "")  # e.g., "M-1,M-2"
+        line_nos = request.query_params.get("line", "")            # e.g., "3,4"
+        floors = request.query_params.get("floor", "")             # e.g., "1"
+
+        machine_id_list = [m.strip() for m in machine_ids.split(",") if m.strip()]
+        line_no_list = [l.strip() for l in line_nos.split(",") if l.strip()]
+        floor_list = [f.strip() for f in floors.split(",") if f.strip()]
+        if not (machine_id_list or line_no_list or floor_list):
+            return Response({"error": "machine_id, line or floor is required"}, status=400)
+
+        machine_queryset = self.scope(Machine.objects.all(), "company")
+        if machine_id_list:
+            machine_queryset = machine_queryset.filter(machine_id__in=machine_id_list)
+        if line_no_list:
+            machine_queryset = machine_queryset.filter(line__id__in=line_no_list)
+        if floor_list:
+            machine_queryset = machine_queryset.filter(line__floor__id__in=floor_list)
+        machines = list(machine_queryset.order_by("id"))
+
+        response_data = analytics_cache.get_or_compute(
+            "machines-monitoring-batch",
+            {"machine_id": sorted(machine_id_list), "line": sorted(line_no_list), "floor": sorted(floor_list)},
+            analytics_cache.scopes_for(
+                floors=floor_list, lines=line_no_list, machines=[machine.pk for machine in machines]
+            ),
+            lambda: self._machine_monitoring_batch_data(machines),
+            company_id=self.get_company_id(),
         )
-        total_week_minutes = 7 * 10 * 60  # 1 week in seconds
-        utilization_last_week = 1 - ((total_active_time_last_week / 60) / total_week_minutes) if total_week_minutes > 0 else 0
 
-        mtbf_last_week = (
-            timedelta(minutes=(total_week_minutes / breakdowns_count_last_week))
-            if breakdowns_count_last_week > 1
-            else None
-        )
+        return Response(response_data)
 
-        formatted_total_lost_time_last_week = str(total_lost_time_last_week) if total_lost_time_last_week else "0:00:00"
-        formatted_mtbf_last_week = str(mtbf_last_week) if mtbf_last_week else "0:00:00"
+    def _machine_monitoring_batch_data(self, machines):
+        one_week_ago = timezone.now() - timedelta(weeks=1)
+        summaries = monitoring_summaries(machines, one_week_ago)
+        return {machine.machine_id: summaries[machine.pk] for machine in machines}
+
+    @action(detail=False, methods=["get"], url_path="reliability")
+    def reliability(self, request):
+        """
+        MTBF, MTTR, availability and failure rate per machine and fleet-wide,
+        optionally bucketed by day, week or month. Defaults to the last 30 days
+        of every machine.
+        """
+        machine_ids = request.query_params.get("machine_id", "")   # e.g., "M-1,M-2"
+        line_nos = request.query_params.get("line", "")             # e.g., "3,4"
+        floors = request.query_params.get("floor", "")              # e.g., "1"
+        start = request.query_params.get("start", "")               # e.g., "2025-01-01" or an ISO datetime
+        end = request.query_params.get("end", "")                   # e.g., "2025-12-31" (a date end is inclusive)
+        granularity = request.query_params.get("granularity", "window")  # window, day, week or month
+        hours_per_day = request.query_params.get("hours_per_day", "")    # operating hours, e.g. "10"
+
+        machine_id_list = [m.strip() for m in machine_ids.split(",") if m.strip()]
+        line_no_list = [l.strip() for l in line_nos.split(",") if l.strip()]
+        floor_list = [f.strip() for f in floors.split(",") if f.strip()]
+
+        window_end = parse_bound(end, end=True) if end else timezone.now()
+        window_start = parse_bound(start) if start else (window_end - timedelta(days=30) if window_end else None)
+        if window_start is None or window_end is None:
+            return Response({"error": "start and end must be dates (YYYY-MM-DD) or ISO datetimes"}, status=400)
+        if window_start >= window_end:
+            return Response({"error": "start must be before end"}, status=400)
+        if granularity not in GRANULARITIES:
+            return Response({"error": f"granularity must be one of {', '.join(GRANULARITIES)}"}, status=400)
+        try:
+            hours = float(hours_per_day) if hours_per_day else None
+        except ValueError:
+            hours = -1
+        if hours is not None and not 0 < hours <= 24:
+            return Response({"error": "hours_per_day must be a number between 0 and 24"}, status=400)
+
+        machine_queryset = self.scope(Machine.objects.all(), "company")
+        if machine_id_list:
+            machine_queryset = machine_queryset.filter(machine_id__in=machine_id_list)
+        if line_no_list:
+            machine_queryset = machine_queryset.filter(line__id__in=line_no_list)
+        if floor_list:
+            machine_queryset = machine_queryset.filter(line__floor__id__in=floor_list)
 
-        response_data = {
-            "id": machine.id,
-            "machine_id": machine.machine_id,
-            "model_number": machine.model_number,
-            "serial_no": machine.serial_no,
-            "purchase_date": machine.purchase_date,
-            "last_breakdown_start": machine.last_breakdown_start,
-            "status": machine.status,
-            "category": machine.category.name if machine.category else None,
-            "type": machine.type.name if machine.type else None,
-            "brand": machine.brand.name if machine.brand else None,
-            "line": machine.line.name if machine.line else None,
-            "floor": machine.line.floor.name if machine.line.floor else None,
-            "supplier": machine.supplier.name if machine.supplier else None,
-            "total-lost-time-last-week": formatted_total_lost_time_last_week,
-            "utilization-last-week": utilization_last_week,
-            "breakdowns-count-last-week": breakdowns_count_last_week,
-            "MTBF-last-week": formatted_mtbf_last_week,
-            "breakdowns-last-week": daily_lost_time_list,  # Add daily lost time
-            # "breakdowns-last-week": [
-            #     {
-            #         "breakdown-start": breakdown.breakdown_start,
-            #         "lost-time": str(breakdown.lost_time),
-            #     }
-            #     for breakdown in breakdowns_last_week
-            # ],
-            "lost-time-reasons-last-week": [
-                {
-                    "problem-category": reason["problem_category__name"],
-                    "lost-time": str(reason["total_lost_time"]),
-                }
-                for reason in breakdowns_last_week.values("problem_category__name")
-                .annotate(total_lost_time=Sum("lost_time"))
-                .order_by("problem_category__name")
-            ],
-            
-        }
+        compute = lambda: reliability_report(machine_queryset, window_start, window_end, granularity, hours)
+        if not end:
+            # A window ending now never repeats, so there is nothing to cache
+            return Response(compute())
 
-        return Response(response_data)
+        response_data = analytics_cache.get_or_compute(
+            "reliability",
+            {
+                "machine_id": sorted(machine_id_list),
+                "line": sorted(line_no_list),
+                "floor": sorted(floor_list),
+                "start": window_start.isoformat(),
+                "end": window_end.isoformat(),
+                "granularity": granularity,
+                "hours_per_day": hours,
+            },
+            # Per-machine scopes would mean one version key per machine of the
+            # fleet, so unfiltered and machine_id requests use the plant scope
+            analytics_cache.scopes_for(floors=floor_list, lines=line_no_list),
+            compute,
+            company_id=self.get_company_id(),
+        )
 
+        return Response(response_data)
 
+    @action(detail=False, methods=["get"], url_path="export")
+    def export(self, request):
+        """
+        Stream breakdown logs as CSV or NDJSON (output=csv|ndjson; "format" is
+        taken by DRF), oldest first, optionally filtered by start/end, line,
+        floor and machine_id.
+        """
+        output = request.query_params.get("output", "csv")
+        start = request.query_params.get("start", "")    # e.g., "2025-02-01" or an ISO datetime
+        end = request.query_params.get("end", "")        # e.g., "2025-02-28" (a date end is inclusive)
+        line_nos = request.query_params.get("line", "")
+        floors = request.query_params.get("floor", "")
+        machine_ids = request.query_params.get("machine_id", "")
+
+        if output not in OUTPUTS:
+            return Response({"error": f"output must be one of {', '.join(OUTPUTS)}"}, status=400)
+        window_start = parse_bound(start) if start else None
+        window_end = parse_bound(end, end=True) if end else None
+        if (start and window_start is None) or (end and window_end is None):
+            return Response({"error": "start and end must be dates (YYYY-MM-DD) or ISO datetimes"}, status=400)
+
+        breakdown_queryset = self.get_queryset().order_by("breakdown_start", "id")
+        if window_start:
+            breakdown_queryset = breakdown_queryset.filter(breakdown_start__gte=window_start)
+        if window_end:
+            breakdown_queryset = breakdown_queryset.filter(breakdown_start__lt=window_end)
+        if line_nos:
+            breakdown_queryset = breakdown_queryset.filter(line__id__in=[l.strip() for l in line_nos.split(",") if l.strip()])
+        if floors:
+            breakdown_queryset = breakdown_queryset.filter(line__floor__id__in=[f.strip() for f in floors.split(",") if f.strip()])
+        if machine_ids:
+            breakdown_queryset = breakdown_queryset.filter(machine__machine_id__in=[m.strip() for m in machine_ids.split(",") if m.strip()])
+
+        return stream_export(
+            breakdown_queryset,
+            [
+                ("id", "id"),
+                ("machine_id", "machine__machine_id"),
+                ("line", "line__name"),
+                ("floor", "line__floor__name"),
+                ("mechanic", "mechanic__name"),
+                ("operator", "operator__name"),
+                ("problem_category", "problem_category__name"),
+                ("breakdown_start", "breakdown_start"),
+                ("repairing_start", "repairing_start"),
+                ("lost_time", "lost_time"),
+                ("comments", "comments"),
+            ],
+            output,
+            f"breakdown-logs-{timezone.localdate():%Y%m%d}",
+        )
 
+    @action(detail=False, methods=["get"], url_path="analytics-cache-stats")
+    def analytics_cache_stats(self, request):
+        return Response(analytics_cache.stats())
 
     # def get_permissions(self):
     #     if self.action in ['list', 'retrieve', 'create', 'update', 'partial_update', 'destroy']:
     #         return [IsAdmin()]  # Adjust as needed   
     #     return super().get_permissions()
 
-class TypeViewSet(ModelViewSet):
+class TypeViewSet(CompanyScopedMixin, ConditionalGetMixin, ModelViewSet):
     queryset = Type.objects.all()
     serializer_class = TypeSerializers
     # permission_classes = [HasGroupPermission]
 
-class BrandViewSet(ModelViewSet):
+class BrandViewSet(CompanyScopedMixin, ConditionalGetMixin, ModelViewSet):
     queryset = Brand.objects.all()
     serializer_class = BrandSerializers
     # permission_classes = [HasGroupPermission]
 
-class SupplierViewSet(ModelViewSet):
+class SupplierViewSet(CompanyScopedMixin, ConditionalGetMixin, ModelViewSet):
     queryset = Supplier.objects.all()
     serializer_class = SupplierSerializers
     # permission_classes = [HasGroupPermission]
 
 
 
-class CategoryViewSet(ModelViewSet):
+class CategoryViewSet(CompanyScopedMixin, ConditionalGetMixin, ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializers
     # permission_classes = [HasGroupPermission]
 
-class ProblemCategoryViewSet(ModelViewSet):
+class ProblemCategoryViewSet(ConditionalGetMixin, ModelViewSet):
     queryset = ProblemCategory.objects.all()
     serializer_class = ProblemCategorySerializers
     # permission_classes = [HasGroupPermission]
 
-class ProblemCategoryTypeViewSet(ModelViewSet):
-    queryset = ProblemCategoryType.objects.all()
+class ProblemCategoryTypeViewSet(ConditionalGetMixin, ModelViewSet):
+    # categories are nested: prefetched in one query, and part of the ETag
+    queryset = ProblemCategoryType.objects.prefetch_related("categories")
     serializer_class = ProblemCategoryTypeSerializer
+    etag_models = (ProblemCategoryType, ProblemCategory)
     # permission_classes = [HasGroupPermission]
 
+    @action(detail=False, methods=["get"], url_path="tree")
+    def tree(self, request):
+        """
+        Every type with its categories, severity and usage counts (all time
+        and recent), most used first. Cached; see maintenance/problems.py.
+        """
+        tree, tag = problem_tree()
+        etag = quote_etag(tag)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = Response(tree)
+        response["ETag"] = etag
+        response["Cache-Control"] = "no-cache"
+        return response
+
@@ -17,3 +17,8 @@ class MaintenanceConfig(AppConfig):
             else:
                 raise FileNotFoundError("Firebase credentials file not found.")
         from . import signals
+        from core import versioning
+        from .models import Brand, Category, Type, Supplier, ProblemCategory, ProblemCategoryType
+        versioning.register(Brand, Category, Type, Supplier, ProblemCategory, ProblemCategoryType)
+        from .references import references
+        references.connect()
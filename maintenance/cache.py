@@ -0,0 +1,145 @@
+"""
+Result cache for the maintenance analytics endpoints.
+
+Entries are keyed by the normalized filters plus the current version of every
+scope (the whole plant, a floor, a line or a machine) the filters touch.
+Writes to BreakdownLog and Machine bump the versions of the scopes they
+affect (see maintenance/signals.py), so a stale entry is never read again and
+simply ages out with the TTL. Only the plain cache API is used, so the
+local-memory and file backends work; with several worker processes use a
+backend they share (the file backend, for instance) so that every worker
+sees the version bumps.
+"""
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from production.models import Line
+
+
+DEFAULTS = {
+    "ALIAS": "default",
+    "TTL": 30,
+    "PREFIX": "maintenance-analytics",
+}
+
+PLANT = ("all", "*")
+
+
+def _config():
+    return {**DEFAULTS, **getattr(settings, "MAINTENANCE_ANALYTICS_CACHE", {})}
+
+
+def _cache():
+    return caches[_config()["ALIAS"]]
+
+
+def _key(*parts):
+    return ":".join([_config()["PREFIX"], *map(str, parts)])
+
+
+def _incr(key):
+    cache = _cache()
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between add() and incr()
+        cache.set(key, 1, None)
+
+
+def _versions(scopes):
+    cache = _cache()
+    keys = [_key("version", scope, ident) for scope, ident in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Seed from the clock rather than 0 so a version key that was
+            # evicted can never come back with a value an old entry used.
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def scopes_for(floors=(), lines=(), machines=()):
+    """The version scopes a filter set depends on; the whole plant when unfiltered."""
+    scopes = [("floor", floor) for floor in floors]
+    scopes += [("line", line) for line in lines]
+    scopes += [("machine", machine) for machine in machines]
+    return sorted(set(scopes)) or [PLANT]
+
+
+def location_scopes(line_ids):
+    """Line and floor scopes for a set of line ids (None and unknown ids are skipped)."""
+    line_ids = {line_id for line_id in line_ids if isinstance(line_id, int)}
+    if not line_ids:
+        return []
+    floor_ids = Line.objects.filter(pk__in=line_ids).values_list("floor_id", flat=True)
+    return [("line", line_id) for line_id in line_ids] + [("floor", floor_id) for floor_id in set(floor_ids)]
+
+
+def breakdown_scopes(log):
+    """Scopes a BreakdownLog write touches, before and after the change."""
+    stored = getattr(log, "_loaded_values", None) or {}
+    machines = {log.machine_id, stored.get("machine_id")}
+    return (
+        [PLANT]
+        + location_scopes({log.line_id, stored.get("line_id")})
+        + [("machine", machine_id) for machine_id in machines if isinstance(machine_id, int)]
+    )
+
+
+def machine_scopes(machine):
+    """Scopes a Machine write touches, including the line it moved away from."""
+    return (
+        [PLANT, ("machine", machine.pk)]
+        + location_scopes({machine.line_id, getattr(machine, "_old_line_id", None)})
+    )
+
+
+def get_or_compute(endpoint, filters, scopes, compute, company_id=None):
+    """
+    Return the cached result for endpoint/filters, computing and storing it on
+    a miss. filters must already be normalized (sorted lists, stripped values).
+    company_id is the company the request is scoped to (see core/tenancy.py);
+    each company gets its own entries.
+    """
+    fingerprint = json.dumps(
+        [endpoint, company_id, filters, list(zip(scopes, _versions(scopes)))],
+        sort_keys=True, default=str,
+    )
+    key = _key("result", endpoint, hashlib.md5(fingerprint.encode()).hexdigest())
+
+    cache = _cache()
+    result = cache.get(key)
+    if result is not None:
+        _incr(_key("stats", "hits"))
+        return result
+
+    _incr(_key("stats", "misses"))
+    result = compute()
+    cache.set(key, result, _config()["TTL"])
+    return result
+
+
+def bump(scopes):
+    """Invalidate every cached result depending on any of the given scopes."""
+    for scope, ident in set(scopes):
+        if ident is not None:
+            _incr(_key("version", scope, ident))
+
+
+def stats():
+    cache = _cache()
+    counts = cache.get_many([_key("stats", "hits"), _key("stats", "misses")])
+    hits = counts.get(_key("stats", "hits"), 0)
+    misses = counts.get(_key("stats", "misses"), 0)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": hits / total if total else 0,
+    }
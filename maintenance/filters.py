@@ -1,5 +1,16 @@
 import django_filters
+from rest_framework import filters
 from .models import Machine
+from .search import search_machines
+
+
+class MachineSearchFilter(filters.SearchFilter):
+    """?search= matched against the machine search documents instead of icontains on every search field."""
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, "")
+        return search_machines(queryset, query) if query.strip() else queryset
+
 
 class MachineFilter(django_filters.FilterSet):
     machine_id = django_filters.CharFilter(lookup_expr='icontains', label='Machine ID')
@@ -14,8 +25,12 @@ class MachineFilter(django_filters.FilterSet):
     purchase_date = django_filters.DateFilter(lookup_expr='exact', label='Purchase Date')
     last_breakdown_start = django_filters.DateTimeFilter(lookup_expr='exact', label='Last Breakdown Start')
     status = django_filters.ChoiceFilter(choices=Machine.STATUS_CHOICES, label='Status')
+    q = django_filters.CharFilter(method='filter_search', label='Search')
 
     class Meta:
         model = Machine
         fields = ['machine_id', 'category', 'type', 'brand', 'model_number', 'serial_no', 
-                  'supplier', 'purchase_date', 'last_breakdown_start', 'status']
\ No newline at end of file
+                  'supplier', 'purchase_date', 'last_breakdown_start', 'status']
+
+    def filter_search(self, queryset, name, value):
+        return search_machines(queryset, value)
@@ -0,0 +1,202 @@
+"""
+Plant hierarchy for the floor plan: company -> floor -> line -> machine.
+
+full_document() nests every floor, line (in natural name order: Line 2
+before Line 10) and machine (by sequence) with status, current mechanic and
+how long an open breakdown has been running. It is built from five queries
+however large the plant is.
+
+Every save or delete of a floor, line or machine is journaled in
+PlantChange under its company, and the journal id is the hierarchy version.
+changes_since(N) returns only the floors, lines and machines of the
+requested companies journaled after version N as flat rows, plus the ids
+that no longer exist, so a redraw fetches deltas. When N is older than the
+pruned journal, the full document is returned instead.
+
+A version must not be handed out while a smaller journal id can still
+commit, or the client would never ask for it. Journal rows are therefore
+written once the change has committed (a long import adds its rows at the
+end, with fresh ids), and the version returned only covers rows older than
+OVERLAP_SECONDS, the most a journal insert is expected to take to commit.
+Younger rows are sent anyway and sent again in the next delta; rows are
+applied by id, so that is harmless. A process that dies between a commit
+and its journal insert loses the entry; those objects are redrawn with the
+next full document.
+"""
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from company.models import Company
+from production.models import Floor, Line
+
+from .models import Machine, PlantChange
+
+
+DEFAULTS = {
+    "ALIAS": "default",
+    "OVERLAP_SECONDS": 10,
+    "RETENTION_HOURS": 24,
+}
+
+FLOOR_FIELDS = ("id", "name", "company_id")
+LINE_FIELDS = ("id", "name", "operation_type", "floor_id")
+MACHINE_FIELDS = (
+    "id", "machine_id", "sequence", "status", "last_problem", "last_breakdown_start",
+    "mechanic_id", "mechanic__name", "line_id", "company_id",
+)
+OPEN_STATUSES = ("broken", "maintenance")
+
+
+def _config():
+    return {**DEFAULTS, **getattr(settings, "PLANT_HIERARCHY", {})}
+
+
+def journal(kind, changes):
+    """Record, once committed, that the floors, lines or machines of (id, company id) changes changed."""
+    changes = [(pk, company_id) for pk, company_id in changes if pk is not None]
+    if changes:
+        transaction.on_commit(lambda: PlantChange.objects.bulk_create([
+            PlantChange(kind=kind, object_id=pk, company_id=company_id) for pk, company_id in changes
+        ]))
+
+
+def prune():
+    """Drop journal rows older than RETENTION_HOURS, keeping the latest so the version never goes back."""
+    cutoff = timezone.now() - timedelta(hours=_config()["RETENTION_HOURS"])
+    latest = PlantChange.objects.aggregate(latest=Max("id"))["latest"]
+    return PlantChange.objects.filter(created_at__lt=cutoff).exclude(pk=latest).delete()[0]
+
+
+def _natural_key(name):
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", name or "")]
+
+
+def _floor(row):
+    return {"id": row["id"], "name": row["name"], "company": row["company_id"]}
+
+
+def _line(row):
+    return {"id": row["id"], "name": row["name"], "operation_type": row["operation_type"], "floor": row["floor_id"]}
+
+
+def _machine(row, now):
+    open_since = row["last_breakdown_start"] if row["status"] in OPEN_STATUSES else None
+    return {
+        "id": row["id"],
+        "machine_id": row["machine_id"],
+        "sequence": row["sequence"],
+        "status": row["status"],
+        "last_problem": row["last_problem"],
+        "mechanic": {"id": row["mechanic_id"], "name": row["mechanic__name"]} if row["mechanic_id"] else None,
+        "line": row["line_id"],
+        "company": row["company_id"],
+        "breakdown_start": open_since,
+        "open_breakdown_seconds": int((now - open_since).total_seconds()) if open_since else None,
+    }
+
+
+def _machine_order(machine):
+    return (machine["sequence"] is None, machine["sequence"] or 0, machine["machine_id"])
+
+
+def _querysets(company_ids):
+    companies = Company.objects.all()
+    floors = Floor.objects.all()
+    lines = Line.objects.all()
+    machines = Machine.objects.all()
+    if company_ids:
+        companies = companies.filter(pk__in=company_ids)
+        floors = floors.filter(company_id__in=company_ids)
+        lines = lines.filter(floor__company_id__in=company_ids)
+        machines = machines.filter(company_id__in=company_ids)
+    return companies, floors, lines, machines
+
+
+def current_version(now=None):
+    """The latest journal id that no smaller, still uncommitted id can follow (see the module docstring)."""
+    settled = (now or timezone.now()) - timedelta(seconds=_config()["OVERLAP_SECONDS"])
+    return PlantChange.objects.filter(created_at__lte=settled).aggregate(version=Max("id"))["version"] or 0
+
+
+def full_document(company_ids=None):
+    # Read the version first: anything changed meanwhile is in the next delta
+    version = current_version()
+    if caches[_config()["ALIAS"]].add("plant-hierarchy:pruned", True, 3600):
+        prune()
+    now = timezone.now()
+    companies, floors, lines, machines = _querysets(company_ids)
+
+    lines_by_floor = {}
+    machines_by_line = {}
+    unassigned = {}
+    for row in lines.order_by().values(*LINE_FIELDS):
+        lines_by_floor.setdefault(row["floor_id"], []).append(_line(row))
+    for row in machines.order_by().values(*MACHINE_FIELDS):
+        machine = _machine(row, now)
+        if row["line_id"] is None:
+            unassigned.setdefault(row["company_id"], []).append(machine)
+        else:
+            machines_by_line.setdefault(row["line_id"], []).append(machine)
+
+    floors_by_company = {}
+    for row in floors.order_by("id").values(*FLOOR_FIELDS):
+        floor = _floor(row)
+        floor["lines"] = sorted(lines_by_floor.get(row["id"], []), key=lambda line: (_natural_key(line["name"]), line["id"]))
+        for line in floor["lines"]:
+            line["machines"] = sorted(machines_by_line.get(line["id"], []), key=_machine_order)
+        floors_by_company.setdefault(row["company_id"], []).append(floor)
+
+    return {
+        "version": version,
+        "full": True,
+        "companies": [
+            {
+                "id": company["id"],
+                "name": company["name"],
+                "floors": floors_by_company.get(company["id"], []),
+                "unassigned_machines": sorted(unassigned.get(company["id"], []), key=_machine_order),
+            }
+            for company in companies.order_by("id").values("id", "name")
+        ],
+    }
+
+
+def changes_since(since, company_ids=None):
+    """The delta after version since, or the full document when the journal no longer reaches back that far."""
+    bounds = PlantChange.objects.aggregate(oldest=Min("id"), latest=Max("id"))
+    if bounds["latest"] is None or since > bounds["latest"] or since < bounds["oldest"] - 1:
+        return full_document(company_ids)
+
+    now = timezone.now()
+    version = max(since, current_version(now))
+    changes = PlantChange.objects.filter(pk__gt=since)
+    if company_ids:
+        changes = changes.filter(company_id__in=company_ids)
+    changed = {"floor": set(), "line": set(), "machine": set()}
+    for kind, object_id in changes.values_list("kind", "object_id"):
+        changed[kind].add(object_id)
+
+    _, floors, lines, machines = _querysets(company_ids)
+    floor_rows = list(floors.filter(pk__in=changed["floor"]).values(*FLOOR_FIELDS)) if changed["floor"] else []
+    line_rows = list(lines.filter(pk__in=changed["line"]).values(*LINE_FIELDS)) if changed["line"] else []
+    machine_rows = list(machines.filter(pk__in=changed["machine"]).values(*MACHINE_FIELDS)) if changed["machine"] else []
+
+    return {
+        "version": version,
+        "full": False,
+        "floors": [_floor(row) for row in floor_rows],
+        "lines": [_line(row) for row in line_rows],
+        "machines": sorted((_machine(row, now) for row in machine_rows), key=_machine_order),
+        # Journaled under the requested companies but gone from them
+        "deleted": {
+            "floors": sorted(changed["floor"] - {row["id"] for row in floor_rows}),
+            "lines": sorted(changed["line"] - {row["id"] for row in line_rows}),
+            "machines": sorted(changed["machine"] - {row["id"] for row in machine_rows}),
+        },
+    }
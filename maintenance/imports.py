@@ -0,0 +1,357 @@
+"""
+Bulk machine import from a CSV or XLSX sheet.
+
+The sheet names things the way people do: category, type, brand and supplier
+by name, the line by floor and line name, mechanic and operator by employee
+id. Every name is resolved against dictionaries built with one query per
+model at the start of the import, and category, type, brand and supplier
+names the company does not have yet are created with one bulk_create each.
+Rows are then written in chunks: one query finds the machines of the chunk
+that already exist (matched on machine_id), new ones go in with bulk_create
+and existing ones with bulk_update of the columns present in the sheet.
+
+Rows that do not validate are skipped and reported with their sheet row
+number; the rest are imported. Status is only set on new machines, status
+changes of existing machines go through the bulk-transition endpoint so
+that they are logged and notified.
+"""
+import csv
+import io
+from datetime import date, datetime
+
+from django.db import transaction
+from django.db.backends.base.operations import BaseDatabaseOperations
+from django.utils.dateparse import parse_date
+
+from core import versioning
+from production.models import Line
+from user_management.models import Employee
+
+from .models import Brand, Category, Machine, Supplier, Type
+from .references import references
+from . import search
+from . import timeline
+from . import hierarchy
+from . import cache as analytics_cache
+
+
+CHUNK_SIZE = 1000
+
+# Sheet column -> Machine field for the plain value columns
+VALUE_COLUMNS = {
+    "model_number": "model_number",
+    "serial_no": "serial_no",
+    "sequence": "sequence",
+    "purchase_date": "purchase_date",
+    "status": "status",
+}
+
+# Sheet column -> model created on the fly when a name is missing
+REFERENCE_COLUMNS = {
+    "category": Category,
+    "type": Type,
+    "brand": Brand,
+    "supplier": Supplier,
+}
+
+EMPLOYEE_COLUMNS = ("mechanic", "operator")
+
+COLUMNS = ("machine_id", *VALUE_COLUMNS, *REFERENCE_COLUMNS, "floor", "line", *EMPLOYEE_COLUMNS)
+
+STATUSES = {status for status, _ in Machine.STATUS_CHOICES}
+
+MACHINE_ID_LENGTH = Machine._meta.get_field("machine_id").max_length
+
+# sequence is a SmallIntegerField
+SEQUENCE_RANGE = BaseDatabaseOperations.integer_field_ranges["SmallIntegerField"]
+
+
+class ImportFileError(ValueError):
+    """The file itself cannot be read as a machine sheet."""
+
+
+def _header(value):
+    return str(value or "").strip().lower().replace(" ", "_")
+
+
+def _cell(value):
+    """Normalize a cell to None, a date or a stripped string."""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    # Spreadsheets hand whole numbers back as floats (101.0)
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    value = str(value).strip()
+    return value or None
+
+
+def read_sheet(file, filename):
+    """
+    Read an uploaded .csv or .xlsx file. Returns (header, rows), rows being
+    [(row_number, row)] with each row a dict keyed by the normalized header.
+    """
+    name = (filename or "").lower()
+    if name.endswith(".xlsx"):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise ImportFileError("XLSX import requires the openpyxl package; upload a CSV file instead")
+        try:
+            sheet = load_workbook(file, read_only=True, data_only=True).active
+        except Exception as exc:
+            raise ImportFileError(f"Cannot read the workbook: {exc}")
+        rows = sheet.iter_rows(values_only=True)
+    elif name.endswith(".csv"):
+        data = file.read()
+        if isinstance(data, bytes):
+            try:
+                data = data.decode("utf-8-sig")
+            except UnicodeDecodeError:
+                raise ImportFileError("CSV files must be UTF-8 encoded")
+        rows = csv.reader(io.StringIO(data))
+    else:
+        raise ImportFileError("Upload a .csv or .xlsx file")
+
+    header = [_header(value) for value in next(rows, [])]
+    if "machine_id" not in header:
+        raise ImportFileError("The first row must be a header with a machine_id column")
+    unknown = [column for column in header if column and column not in COLUMNS]
+    if unknown:
+        raise ImportFileError(f"Unknown columns: {', '.join(unknown)}. Expected: {', '.join(COLUMNS)}")
+
+    sheet_rows = []
+    for row_number, values in enumerate(rows, start=2):
+        row = {column: _cell(value) for column, value in zip(header, values) if column}
+        if any(value is not None for value in row.values()):
+            sheet_rows.append((row_number, row))
+    return header, sheet_rows
+
+
+class Lookups:
+    """Name -> id dictionaries for one company, built once per import."""
+
+    def __init__(self, company):
+        self.references = {
+            column: {
+                name.casefold(): pk
+                for pk, name in model.objects.filter(company=company).values_list("pk", "name")
+            }
+            for column, model in REFERENCE_COLUMNS.items()
+        }
+        self.lines = {}
+        self.line_names = {}
+        for pk, name, floor_name in Line.objects.filter(floor__company=company).values_list("pk", "name", "floor__name"):
+            self.lines[(floor_name.casefold(), name.casefold())] = pk
+            self.line_names.setdefault(name.casefold(), set()).add(pk)
+        self.employees = dict(
+            Employee.objects.filter(company=company, employee_id__isnull=False).values_list("employee_id", "pk")
+        )
+
+    def line(self, floor_name, line_name):
+        """(line_id, error)"""
+        if floor_name is not None:
+            line_id = self.lines.get((floor_name.casefold(), line_name.casefold()))
+            if line_id is None:
+                return None, f"line '{line_name}' not found on floor '{floor_name}'"
+            return line_id, None
+        line_ids = self.line_names.get(line_name.casefold(), set())
+        if not line_ids:
+            return None, f"line '{line_name}' not found"
+        if len(line_ids) > 1:
+            return None, f"line '{line_name}' exists on several floors; add a floor column"
+        return next(iter(line_ids)), None
+
+
+def _validate(row, lookups):
+    """Machine field values for a row, or the list of what is wrong with it."""
+    values, errors = {}, []
+
+    for column, field_name in VALUE_COLUMNS.items():
+        if column not in row:
+            continue
+        value = row[column]
+        if value is None:
+            values[field_name] = "active" if column == "status" else None
+        elif column == "sequence":
+            try:
+                values[field_name] = int(value)
+            except ValueError:
+                errors.append(f"sequence must be a whole number, got '{value}'")
+            else:
+                if not SEQUENCE_RANGE[0] <= values[field_name] <= SEQUENCE_RANGE[1]:
+                    errors.append(f"sequence must be between {SEQUENCE_RANGE[0]} and {SEQUENCE_RANGE[1]}, got '{value}'")
+        elif column == "purchase_date":
+            try:
+                parsed = value if isinstance(value, date) else parse_date(value)
+            except ValueError:
+                parsed = None
+            if parsed is None:
+                errors.append(f"purchase_date must be a date (YYYY-MM-DD), got '{value}'")
+            values[field_name] = parsed
+        elif column == "status":
+            status = str(value).lower()
+            if status not in STATUSES:
+                errors.append(f"status must be one of {', '.join(sorted(STATUSES))}, got '{value}'")
+            values[field_name] = status
+        else:
+            values[field_name] = str(value)
+            max_length = Machine._meta.get_field(field_name).max_length
+            if len(values[field_name]) > max_length:
+                errors.append(f"{column} is longer than {max_length} characters")
+
+    for column in REFERENCE_COLUMNS:
+        if column not in row:
+            continue
+        name = row[column]
+        if name is not None and len(str(name)) > REFERENCE_COLUMNS[column]._meta.get_field("name").max_length:
+            errors.append(f"{column} name '{name}' is too long")
+        # Resolved to an id once the missing names have been created
+        values[column] = None if name is None else str(name)
+
+    if "line" in row:
+        values["line_id"] = None
+        if row["line"] is not None:
+            values["line_id"], error = lookups.line(row.get("floor"), str(row["line"]))
+            if error:
+                errors.append(error)
+
+    for column in EMPLOYEE_COLUMNS:
+        if column not in row:
+            continue
+        values[f"{column}_id"] = None
+        if row[column] is not None:
+            values[f"{column}_id"] = lookups.employees.get(str(row[column]))
+            if values[f"{column}_id"] is None:
+                errors.append(f"{column} with employee id '{row[column]}' not found")
+
+    return values, errors
+
+
+def _missing_references(valid_rows, lookups):
+    """{column: [name, ...]} of the category, type, brand and supplier names the company does not have yet."""
+    missing = {}
+    for column in REFERENCE_COLUMNS:
+        names = {}
+        for _, values in valid_rows:
+            name = values.get(column)
+            if name is not None and name.casefold() not in lookups.references[column]:
+                names.setdefault(name.casefold(), name)
+        if names:
+            missing[column] = sorted(names.values())
+    return missing
+
+
+def _create_references(company, missing, lookups):
+    for column, names in missing.items():
+        model = REFERENCE_COLUMNS[column]
+        for obj in model.objects.bulk_create([model(name=name, company=company) for name in names]):
+            lookups.references[column][obj.name.casefold()] = obj.pk
+        # bulk_create sends no signals
+        transaction.on_commit(lambda model=model, column=column: _references_changed(model, column))
+
+
+def _references_changed(model, column):
+    """New version for ETags and the reference registries of other processes, then reload this one's."""
+    versioning.bump(model)
+    references.clear(column)
+
+
+def _update_fields(header):
+    """Machine fields written on existing machines: those of the columns in the sheet, except status."""
+    fields = [field_name for column, field_name in VALUE_COLUMNS.items() if column != "status" and column in header]
+    fields += [f"{column}_id" for column in (*REFERENCE_COLUMNS, "line", *EMPLOYEE_COLUMNS) if column in header]
+    return fields
+
+
+def import_machines(file, filename, company, dry_run=False):
+    """
+    Create or update the machines of a sheet for company. Returns a report:
+    counts, the references created and [{"row", "machine_id", "errors"}] for
+    every row that was skipped. With dry_run nothing is written.
+    """
+    header, sheet_rows = read_sheet(file, filename)
+    lookups = Lookups(company)
+
+    report = {"rows": len(sheet_rows), "created": 0, "updated": 0, "created_references": {}, "errors": []}
+    valid_rows = []
+    seen = {}
+    for row_number, row in sheet_rows:
+        machine_id = row.get("machine_id")
+        values, errors = _validate(row, lookups)
+        if machine_id is None:
+            errors.insert(0, "machine_id is required")
+        elif len(machine_id) > MACHINE_ID_LENGTH:
+            errors.insert(0, f"machine_id is longer than {MACHINE_ID_LENGTH} characters")
+        elif machine_id in seen:
+            errors.insert(0, f"machine_id already used on row {seen[machine_id]}")
+        else:
+            seen[machine_id] = row_number
+        if errors:
+            report["errors"].append({"row": row_number, "machine_id": machine_id, "errors": errors})
+        else:
+            valid_rows.append((row_number, {"machine_id": machine_id, **values}))
+
+    # Columns left out of the sheet keep their current values on update
+    update_fields = _update_fields(header)
+
+    with transaction.atomic():
+        report["created_references"] = _missing_references(valid_rows, lookups)
+        if not dry_run:
+            _create_references(company, report["created_references"], lookups)
+
+        scopes = [analytics_cache.PLANT]
+        line_ids = set()
+        for start in range(0, len(valid_rows), CHUNK_SIZE):
+            chunk = valid_rows[start:start + CHUNK_SIZE]
+            existing = {
+                machine.machine_id: machine
+                for machine in Machine.objects.filter(machine_id__in=[values["machine_id"] for _, values in chunk])
+                .only("pk", "machine_id", "company_id", "line_id")
+            }
+            to_create, to_update = [], []
+            for row_number, values in chunk:
+                for column in REFERENCE_COLUMNS:
+                    if column in values:
+                        name = values.pop(column)
+                        values[f"{column}_id"] = None if name is None else lookups.references[column].get(name.casefold())
+                machine = existing.get(values["machine_id"])
+                if machine is None:
+                    to_create.append(Machine(company=company, **values))
+                elif machine.company_id != company.pk:
+                    report["errors"].append({
+                        "row": row_number, "machine_id": values["machine_id"],
+                        "errors": ["machine_id belongs to another company"],
+                    })
+                else:
+                    line_ids.add(machine.line_id)
+                    scopes.append(("machine", machine.pk))
+                    for field_name in update_fields:
+                        setattr(machine, field_name, values[field_name])
+                    to_update.append(machine)
+                line_ids.add(values.get("line_id"))
+
+            if not dry_run:
+                Machine.objects.bulk_create(to_create)
+                timeline.record(to_create)
+                if to_update and update_fields:
+                    Machine.objects.bulk_update(to_update, update_fields)
+                # bulk writes send no signals
+                hierarchy.journal("machine", [(machine.pk, machine.company_id) for machine in to_create + to_update])
+                search.refresh_documents(Machine.objects.filter(
+                    machine_id__in=[machine.machine_id for machine in to_create + to_update]
+                ))
+            report["created"] += len(to_create)
+            report["updated"] += len(to_update)
+
+        if not dry_run and (report["created"] or report["updated"]):
+            transaction.on_commit(lambda: analytics_cache.bump(
+                scopes + analytics_cache.location_scopes(line_ids - {None})
+            ))
+
+    report["errors"].sort(key=lambda error: error["row"])
+    report["imported"] = report["created"] + report["updated"]
+    return report
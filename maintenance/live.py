@@ -0,0 +1,71 @@
+"""
+Events for the live floor board stream (GET /api/maintenance/live/).
+
+The same signals that queue push notifications build these events: a
+machine changing status and a breakdown being logged. They are published
+to core.broadcast once the transaction commits, so a rolled back change is
+never shown, and every connected board receives the ones matching its
+company, floor and line filter.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from core.broadcast import publish
+from .references import references
+
+
+def _location(company_id, line_id):
+    line = references.get("line", line_id)
+    return {
+        "company": company_id,
+        "floor": line["floor_id"] if line else None,
+        "line": line_id,
+        "line_name": line["name"] if line else None,
+    }
+
+
+def status_event(machine, old_status, new_status):
+    return {
+        "type": "machine_status",
+        "machine": machine.pk,
+        "machine_id": machine.machine_id,
+        **_location(machine.company_id, machine.line_id),
+        "old_status": old_status,
+        "new_status": new_status,
+        "last_problem": machine.last_problem,
+        "timestamp": timezone.now(),
+    }
+
+
+def breakdown_event(log):
+    machine = log.machine
+    return {
+        "type": "breakdown",
+        "id": log.pk,
+        "machine": log.machine_id,
+        "machine_id": machine.machine_id if machine else None,
+        **_location(machine.company_id if machine else None, log.line_id),
+        "problem_category": log.problem_category_id,
+        "breakdown_start": log.breakdown_start,
+        "lost_time": log.lost_time.total_seconds() if log.lost_time is not None else None,
+        "timestamp": timezone.now(),
+    }
+
+
+def publish_on_commit(events):
+    def send():
+        for event in events:
+            publish(event)
+    if events:
+        transaction.on_commit(send)
+
+
+def matches(companies=(), floors=(), lines=()):
+    """Filter for core.broadcast subscriptions; an empty set matches everything."""
+    def match(event):
+        return (
+            (not companies or event.get("company") in companies)
+            and (not floors or event.get("floor") in floors)
+            and (not lines or event.get("line") in lines)
+        )
+    return match
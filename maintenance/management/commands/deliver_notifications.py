@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from maintenance.notifications import deliver_pending, stats as notification_stats
+
+
+class Command(BaseCommand):
+    help = "Deliver queued push notifications from the notification outbox."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100, help="Notifications per send_each call (max 500).")
+        parser.add_argument("--workers", type=int, default=4, help="Batches sent in parallel.")
+        parser.add_argument("--limit", type=int, default=1000, help="Notifications claimed per round.")
+        parser.add_argument("--loop", action="store_true", help="Keep polling instead of exiting when the outbox is empty.")
+        parser.add_argument("--interval", type=float, default=2, help="Seconds to wait between polls with --loop.")
+        parser.add_argument("--stats", action="store_true", help="Print the queued/suppressed/delivered counters after each round.")
+
+    def handle(self, *args, **options):
+        while True:
+            sent, retried, failed = deliver_pending(
+                limit=options["limit"], batch_size=options["batch_size"], workers=options["workers"],
+            )
+            if sent or retried or failed:
+                self.stdout.write(f"Sent {sent}, will retry {retried}, failed {failed}.")
+            if options["stats"]:
+                self.stdout.write(", ".join(f"{name}: {count}" for name, count in notification_stats().items()))
+            if not options["loop"]:
+                break
+            # Go straight on while there is a backlog
+            if sent + retried + failed < options["limit"]:
+                time.sleep(options["interval"])
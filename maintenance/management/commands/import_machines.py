@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from company.models import Company
+from maintenance.imports import ImportFileError, import_machines
+
+
+class Command(BaseCommand):
+    help = "Create or update machines from a .csv or .xlsx sheet (see maintenance/imports.py for the columns)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="The .csv or .xlsx file to import.")
+        parser.add_argument("--company", type=int, required=True, help="Id of the company the machines belong to.")
+        parser.add_argument("--dry-run", action="store_true", help="Validate the sheet without writing anything.")
+
+    def handle(self, *args, **options):
+        company = Company.objects.filter(pk=options["company"]).first()
+        if company is None:
+            raise CommandError(f"Company {options['company']} not found")
+
+        try:
+            with open(options["path"], "rb") as file:
+                report = import_machines(file, options["path"], company, dry_run=options["dry_run"])
+        except OSError as exc:
+            raise CommandError(f"Cannot open {options['path']}: {exc}")
+        except ImportFileError as exc:
+            raise CommandError(str(exc))
+
+        for error in report["errors"]:
+            self.stderr.write(f"Row {error['row']} ({error['machine_id']}): {'; '.join(error['errors'])}")
+        for column, names in report["created_references"].items():
+            self.stdout.write(f"New {column}: {', '.join(names)}")
+        verb = "Would import" if options["dry_run"] else "Imported"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {report['imported']} of {report['rows']} rows "
+            f"({report['created']} created, {report['updated']} updated, {len(report['errors'])} skipped)."
+        ))
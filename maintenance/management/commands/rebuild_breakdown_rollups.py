@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from maintenance.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Backfill or repair the daily breakdown rollups from the raw breakdown logs."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", help="First day to rebuild (YYYY-MM-DD). Defaults to the first log.")
+        parser.add_argument("--end", help="Day to stop before (YYYY-MM-DD). Defaults to after the last log.")
+
+    def handle(self, *args, **options):
+        start = self._parse(options["start"], "--start")
+        end = self._parse(options["end"], "--end")
+        if start and end and start >= end:
+            raise CommandError("--start must be before --end")
+
+        written = rebuild_rollups(start=start, end=end)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} breakdown rollup rows."))
+
+    def _parse(self, value, option):
+        if not value:
+            return None
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f"{option} must be a date in YYYY-MM-DD format")
+        return day
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from maintenance.search import rebuild_documents
+
+
+class Command(BaseCommand):
+    help = "Rebuild the machine search documents, e.g. after bulk imports or raw SQL updates."
+
+    def handle(self, *args, **options):
+        written = rebuild_documents()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} machine search documents."))
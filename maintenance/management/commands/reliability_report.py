@@ -0,0 +1,47 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from datetime import timedelta
+
+from maintenance.models import Machine
+from maintenance.periods import parse_bound
+from maintenance.reliability import GRANULARITIES, reliability_report
+
+
+class Command(BaseCommand):
+    help = "Print MTBF, MTTR, availability and failure rate per machine and fleet-wide as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", help="Window start (YYYY-MM-DD or ISO datetime). Defaults to 30 days before --end.")
+        parser.add_argument("--end", help="Window end (a YYYY-MM-DD end is inclusive). Defaults to now.")
+        parser.add_argument("--granularity", choices=GRANULARITIES, default="window")
+        parser.add_argument("--line", action="append", default=[], help="Only machines on this line id (repeatable).")
+        parser.add_argument("--floor", action="append", default=[], help="Only machines on this floor id (repeatable).")
+        parser.add_argument("--hours-per-day", type=float, help="Operating hours per day. Defaults to round the clock.")
+        parser.add_argument("--fleet-only", action="store_true", help="Leave out the per-machine figures.")
+
+    def handle(self, *args, **options):
+        end = parse_bound(options["end"], end=True) if options["end"] else timezone.now()
+        if end is None:
+            raise CommandError("--end must be a date (YYYY-MM-DD) or an ISO datetime")
+        start = parse_bound(options["start"]) if options["start"] else end - timedelta(days=30)
+        if start is None:
+            raise CommandError("--start must be a date (YYYY-MM-DD) or an ISO datetime")
+        if start >= end:
+            raise CommandError("--start must be before --end")
+        hours_per_day = options["hours_per_day"]
+        if hours_per_day is not None and not 0 < hours_per_day <= 24:
+            raise CommandError("--hours-per-day must be between 0 and 24")
+
+        machines = Machine.objects.all()
+        if options["line"]:
+            machines = machines.filter(line__id__in=options["line"])
+        if options["floor"]:
+            machines = machines.filter(line__floor__id__in=options["floor"])
+
+        report = reliability_report(machines, start, end, options["granularity"], hours_per_day)
+        if options["fleet_only"]:
+            del report["machines"]
+        self.stdout.write(json.dumps(report, cls=DjangoJSONEncoder, indent=2))
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.3 on 2026-10-18 15:17
+
+import datetime
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('company', '0001_initial'),
+        ('maintenance', '0001_initial'),
+        ('production', '0001_initial'),
+        ('user_management', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BreakdownDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('breakdown_count', models.IntegerField(default=0)),
+                ('lost_time', models.DurationField(default=datetime.timedelta)),
+                ('response_count', models.IntegerField(default=0)),
+                ('response_lost_time', models.DurationField(default=datetime.timedelta)),
+                ('response_time', models.DurationField(default=datetime.timedelta)),
+                ('parts_cost', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('company', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='company.company')),
+                ('line', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='production.line')),
+                ('machine', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='maintenance.machine')),
+                ('mechanic', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='user_management.employee')),
+                ('problem_category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='maintenance.problemcategory')),
+            ],
+            options={
+                'verbose_name': 'Breakdown Daily Rollup',
+                'verbose_name_plural': 'Breakdown Daily Rollups',
+                'indexes': [models.Index(fields=['company', 'day'], name='maintenance_company_8fb4dc_idx'), models.Index(fields=['line', 'day'], name='maintenance_line_id_5b49b8_idx'), models.Index(fields=['machine', 'day'], name='maintenance_machine_e5637f_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.3 on 2026-10-18 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maintenance', '0002_breakdowndailyrollup'),
+        ('production', '0001_initial'),
+        ('user_management', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='breakdownlog',
+            index=models.Index(fields=['breakdown_start'], name='maintenance_breakdo_740619_idx'),
+        ),
+    ]
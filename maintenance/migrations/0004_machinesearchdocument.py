@@ -0,0 +1,65 @@
+# Generated by Django 5.1.3 on 2026-10-18 15:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Frozen copy of maintenance.search.SEARCH_FIELDS at the time of this migration
+SEARCH_FIELDS = (
+    "machine_id", "model_number", "serial_no", "sequence", "status", "last_problem", "purchase_date",
+    "category__name", "type__name", "brand__name", "supplier__name", "line__name", "line__floor__name",
+    "mechanic__name", "operator__name", "company__name",
+)
+
+
+def create_trigram_index(apps, schema_editor):
+    # Trigram GIN index for LIKE '%term%' on PostgreSQL; other databases scan the column
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS maintenance_machinesearch_document_trgm "
+        "ON maintenance_machinesearchdocument USING gin (document gin_trgm_ops)"
+    )
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS maintenance_machinesearch_document_trgm")
+
+
+def backfill_documents(apps, schema_editor):
+    Machine = apps.get_model("maintenance", "Machine")
+    MachineSearchDocument = apps.get_model("maintenance", "MachineSearchDocument")
+    documents = [
+        MachineSearchDocument(machine_id=values["pk"], document=" ".join(
+            str(values[field]) for field in SEARCH_FIELDS if values[field] not in (None, "")
+        ).lower())
+        for values in Machine.objects.values("pk", *SEARCH_FIELDS).iterator(chunk_size=1000)
+    ]
+    MachineSearchDocument.objects.bulk_create(documents, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maintenance', '0003_breakdownlog_breakdown_start_index'),
+        ('company', '0001_initial'),
+        ('production', '0001_initial'),
+        ('user_management', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MachineSearchDocument',
+            fields=[
+                ('machine', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='maintenance.machine')),
+                ('document', models.TextField()),
+            ],
+            options={
+                'verbose_name': 'Machine Search Document',
+                'verbose_name_plural': 'Machine Search Documents',
+            },
+        ),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+        migrations.RunPython(backfill_documents, migrations.RunPython.noop),
+    ]
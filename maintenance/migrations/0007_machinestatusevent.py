@@ -0,0 +1,46 @@
+# Generated by Django 5.1.3 on 2026-10-18 15:37
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def record_current_states(apps, schema_editor):
+    # History starts here: every machine's current status and line as its first event
+    Machine = apps.get_model("maintenance", "Machine")
+    MachineStatusEvent = apps.get_model("maintenance", "MachineStatusEvent")
+    now = django.utils.timezone.now()
+    MachineStatusEvent.objects.bulk_create(
+        (
+            MachineStatusEvent(machine_id=pk, status=status, line_id=line_id, timestamp=now)
+            for pk, status, line_id in Machine.objects.values_list("pk", "status", "line_id").iterator(chunk_size=1000)
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maintenance', '0006_notification_coalescing'),
+        ('production', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MachineStatusEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('active', 'Active'), ('inactive', 'Inactive'), ('maintenance', 'Under Maintenance'), ('broken', 'Broken')], max_length=50)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('line', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='production.line')),
+                ('machine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_events', to='maintenance.machine')),
+            ],
+            options={
+                'verbose_name': 'Machine Status Event',
+                'verbose_name_plural': 'Machine Status Events',
+                'indexes': [models.Index(fields=['machine', 'timestamp'], name='maintenance_machine_062de0_idx'), models.Index(fields=['timestamp'], name='maintenance_timesta_916e36_idx')],
+            },
+        ),
+        migrations.RunPython(record_current_states, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.3 on 2026-10-18 15:44
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maintenance', '0007_machinestatusevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlantChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('floor', 'Floor'), ('line', 'Line'), ('machine', 'Machine')], max_length=10)),
+                ('object_id', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Plant Change',
+                'verbose_name_plural': 'Plant Changes',
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.3 on 2026-10-18 15:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('company', '0001_initial'),
+        ('maintenance', '0008_plantchange'),
+        ('production', '0001_initial'),
+        ('user_management', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='breakdownlog',
+            index=models.Index(fields=['machine', 'breakdown_start'], name='maintenance_machine_8426e0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='breakdownlog',
+            index=models.Index(fields=['line', 'breakdown_start'], name='maintenance_line_id_dfa73a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='machine',
+            index=models.Index(fields=['company', 'id'], name='maintenance_company_be59df_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='machine',
+            index=models.Index(fields=['company', 'status'], name='maintenance_company_dce062_idx'),
+        ),
+    ]
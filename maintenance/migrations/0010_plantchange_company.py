@@ -0,0 +1,24 @@
+# Generated by Django 5.1.3 on 2026-10-18 16:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('company', '0001_initial'),
+        ('maintenance', '0009_company_scoped_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plantchange',
+            name='company',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='company.company'),
+        ),
+        migrations.AddIndex(
+            model_name='plantchange',
+            index=models.Index(fields=['company', 'id'], name='maintenance_company_9e5463_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.3 on 2026-10-18 16:21
+
+from django.db import migrations, models
+
+
+def count_merged_changes(apps, schema_editor):
+    # Rows queued before this migration record their merged changes only in events
+    NotificationOutbox = apps.get_model("maintenance", "NotificationOutbox")
+    rows = []
+    for notification in NotificationOutbox.objects.only("events").iterator(chunk_size=1000):
+        if not notification.events:
+            continue
+        notification.changes = sum(entry.get("changes", 1) for entry in notification.events) or 1
+        rows.append(notification)
+    NotificationOutbox.objects.bulk_update(rows, ["changes"], batch_size=1000)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maintenance', '0010_plantchange_company'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationoutbox',
+            name='changes',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='notificationoutbox',
+            name='deferrals',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='notificationoutbox',
+            index=models.Index(fields=['topic', 'sent_at'], name='maintenance_topic_154472_idx'),
+        ),
+        migrations.RunPython(count_merged_changes, migrations.RunPython.noop),
+    ]
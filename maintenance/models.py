@@ -1,4 +1,6 @@
+from datetime import timedelta
 from django.db import models
+from django.utils import timezone
 from user_management.models import Employee
 from company.models import Company
 from production.models import Line
@@ -55,9 +57,43 @@ class Machine(models.Model):
     status = models.CharField(max_length=50, choices=STATUS_CHOICES, default='active')
     company = models.ForeignKey(Company, on_delete=models.CASCADE)
 
+    # Loaded values remembered so saves can tell what changed without a query
+    TRACKED_FIELDS = ("status", "line_id", "mechanic_id")
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def stored_values(self, names=TRACKED_FIELDS):
+        """The values of the named fields as last loaded or saved, or None when they are not all known."""
+        values = getattr(self, "_loaded_values", None) or {}
+        if any(values.get(name, models.DEFERRED) is models.DEFERRED for name in names):
+            return None
+        return values
+
+    def remember_stored_values(self, update_fields=None):
+        """Remember the values just saved: every loaded field, or only update_fields."""
+        names = {field.attname for field in self._meta.concrete_fields}
+        if update_fields is not None:
+            names &= {self._meta.get_field(name).attname for name in update_fields}
+        # Deferred fields stay unknown rather than being loaded here
+        self._loaded_values = {
+            **(getattr(self, "_loaded_values", None) or {}),
+            **{name: self.__dict__[name] for name in names if name in self.__dict__},
+        }
+
     def __str__(self):
         return f"{self.category} ({self.model_number})"
 
+    class Meta:
+        indexes = [
+            # Company-scoped lists (ordered by id) and status counts, see core/tenancy.py
+            models.Index(fields=["company", "id"]),
+            models.Index(fields=["company", "status"]),
+        ]
+
 
 class ProblemCategoryType(models.Model):
     """Main categories of problems."""
@@ -96,10 +132,180 @@ class BreakdownLog(models.Model):
     lost_time = models.DurationField()
     comments = models.TextField(blank=True, null=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what is stored so the rollups can subtract it on update/delete
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
     def __str__(self):
         return f"Breakdown for {self.machine.category} on {self.breakdown_start}"
 
     class Meta:
         verbose_name = "Breakdown Log"
         verbose_name_plural = "Breakdown Logs"
-        ordering = ["-breakdown_start"]
\ No newline at end of file
+        ordering = ["-breakdown_start"]
+        indexes = [
+            models.Index(fields=["breakdown_start"]),
+            # No company column: company-scoped queries go through the
+            # company's machines (or lines) and read their logs by time
+            models.Index(fields=["machine", "breakdown_start"]),
+            models.Index(fields=["line", "breakdown_start"]),
+        ]
+
+
+class BreakdownDailyRollup(models.Model):
+    """
+    Daily totals of BreakdownLog per (company, day, line, machine, problem, mechanic).
+    Kept up to date by the BreakdownLog signals; repaired with the
+    rebuild_breakdown_rollups management command.
+    """
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, null=True, blank=True)
+    day = models.DateField()
+    line = models.ForeignKey(Line, on_delete=models.SET_NULL, blank=True, null=True)
+    machine = models.ForeignKey(Machine, on_delete=models.CASCADE, blank=True, null=True)
+    problem_category = models.ForeignKey(ProblemCategory, on_delete=models.CASCADE, blank=True, null=True)
+    mechanic = models.ForeignKey(Employee, on_delete=models.SET_NULL, blank=True, null=True)
+    breakdown_count = models.IntegerField(default=0)
+    lost_time = models.DurationField(default=timedelta)
+    # Logs with a repairing_start, which the response-time figures are based on
+    response_count = models.IntegerField(default=0)
+    response_lost_time = models.DurationField(default=timedelta)
+    response_time = models.DurationField(default=timedelta)
+    # Parts booked against the breakdowns, at the parts' current prices
+    parts_cost = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.day} machine {self.machine_id}: {self.breakdown_count} breakdowns"
+
+    class Meta:
+        verbose_name = "Breakdown Daily Rollup"
+        verbose_name_plural = "Breakdown Daily Rollups"
+        indexes = [
+            models.Index(fields=["company", "day"]),
+            models.Index(fields=["line", "day"]),
+            models.Index(fields=["machine", "day"]),
+        ]
+
+class MachineSearchDocument(models.Model):
+    """
+    Lower-cased text of a machine and the names of everything it points at,
+    so machine search is one indexed column instead of a many-way join.
+    Kept in sync by maintenance/signals.py; rebuilt with the
+    rebuild_machine_search management command.
+    """
+    machine = models.OneToOneField(Machine, on_delete=models.CASCADE, primary_key=True, related_name="search_document")
+    document = models.TextField()
+
+    def __str__(self):
+        return f"Search document for {self.machine_id}"
+
+    class Meta:
+        verbose_name = "Machine Search Document"
+        verbose_name_plural = "Machine Search Documents"
+
+
+class NotificationOutbox(models.Model):
+    """
+    Push notifications waiting to be delivered. Rows are written in the same
+    transaction as the change they announce and sent by the
+    deliver_notifications management command (see maintenance/notifications.py).
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    topic = models.CharField(max_length=255, blank=True, null=True)
+    title = models.TextField()
+    body = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    # Not delivered before this time: the end of the debounce window when
+    # queued, later on retries and when the topic is over its rate
+    available_at = models.DateTimeField(default=timezone.now)
+    # Set while a worker is sending the row
+    claimed_until = models.DateTimeField(blank=True, null=True)
+    # Status changes merged into this notification, e.g. "line:4" for every
+    # machine of line 4 within the debounce window
+    coalesce_key = models.CharField(max_length=100, blank=True, null=True)
+    events = models.JSONField(default=list, blank=True)
+    # Status changes (or plain notifications) this row stands for, and how
+    # often a topic rate held it back; stats() adds these up
+    changes = models.PositiveIntegerField(default=1)
+    deferrals = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.title} -> {self.topic} ({self.status})"
+
+    class Meta:
+        verbose_name = "Notification Outbox"
+        verbose_name_plural = "Notification Outbox"
+        indexes = [
+            models.Index(fields=["status", "available_at"]),
+            models.Index(fields=["coalesce_key", "status"]),
+            # Rows sent in a topic's current rate period
+            models.Index(fields=["topic", "sent_at"]),
+        ]
+
+
+class MachineStatusEvent(models.Model):
+    """
+    Append-only log of machine states: one row every time a machine gets a
+    status (created, status change) or moves to another line, holding the
+    status and line it has from timestamp on. Written by
+    maintenance/signals.py; maintenance/timeline.py turns it into time spent
+    in each state.
+    """
+    machine = models.ForeignKey(Machine, on_delete=models.CASCADE, related_name="status_events")
+    status = models.CharField(max_length=50, choices=Machine.STATUS_CHOICES)
+    line = models.ForeignKey(Line, on_delete=models.SET_NULL, blank=True, null=True, related_name="+")
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.machine_id} {self.status} at {self.timestamp}"
+
+    class Meta:
+        verbose_name = "Machine Status Event"
+        verbose_name_plural = "Machine Status Events"
+        indexes = [
+            # The state of a machine at a given time, and its events in a window
+            models.Index(fields=["machine", "timestamp"]),
+            # Fleet-wide windows
+            models.Index(fields=["timestamp"]),
+        ]
+
+
+class PlantChange(models.Model):
+    """
+    Journal of floor, line and machine changes behind the plant hierarchy
+    endpoint. The id is the hierarchy version: a client that has version N
+    asks for the objects journaled after N (see maintenance/hierarchy.py).
+    Old rows are pruned.
+    """
+    KIND_CHOICES = [
+        ('floor', 'Floor'),
+        ('line', 'Line'),
+        ('machine', 'Machine'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    # The object's company, so a company's deltas only name its own objects
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, blank=True, null=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id} changed (version {self.pk})"
+
+    class Meta:
+        verbose_name = "Plant Change"
+        verbose_name_plural = "Plant Changes"
+        indexes = [
+            models.Index(fields=["company", "id"]),
+        ]
@@ -0,0 +1,436 @@
+"""
+Transactional outbox for push notifications.
+
+Signal handlers call enqueue() / enqueue_status_change(), which only write
+a NotificationOutbox row in the current transaction, so saving a machine
+never waits on Firebase. The deliver_notifications management command
+claims due rows, sends them in batches through the configured transport
+from a thread pool, and records the outcome: delivered rows are marked
+sent, failed ones are retried with exponential backoff until MAX_ATTEMPTS.
+
+Status changes are coalesced before they are sent:
+
+- A line's first change opens a LINE_WINDOW_SECONDS debounce window; changes
+  of other machines on the line within it join the same notification, which
+  becomes a digest ("Line 4: 3 machines broken").
+- Repeated changes of one machine merge into its entry (active -> broken ->
+  active is one entry with three changes), and after a machine has been
+  notified about, its next notification waits MACHINE_WINDOW_SECONDS.
+- TOPIC_RATES caps how many notifications each topic gets per period; the
+  rest wait for the next period.
+
+The web processes that queue notifications and the deliver_notifications
+process that sends them share nothing but the database, so the per-machine
+window, the topic rates and the counters of stats() are all read from the
+outbox rows (sent_at, status, events, changes and deferrals).
+
+The transport is set in settings.NOTIFICATIONS["TRANSPORT"]:
+FirebaseTransport sends with messaging.send_each, LocalTransport keeps the
+messages in memory for tests and local development.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import NotificationOutbox
+from .references import references
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "TRANSPORT": "maintenance.notifications.FirebaseTransport",
+    # Sent to topic-less notifications; without one they fail straight away
+    "DEFAULT_TOPIC": None,
+    "MAX_ATTEMPTS": 5,
+    "BACKOFF_SECONDS": 30,
+    "MAX_BACKOFF_SECONDS": 3600,
+    # How long a claimed row is hidden from other workers while it is sent
+    "CLAIM_SECONDS": 300,
+    "LINE_WINDOW_SECONDS": 30,
+    "MACHINE_WINDOW_SECONDS": 120,
+    # topic: (notifications, per seconds)
+    "TOPIC_RATES": {},
+}
+
+# FCM accepts at most 500 messages per send_each call
+MAX_BATCH = 500
+
+def _config():
+    return {**DEFAULTS, **getattr(settings, "NOTIFICATIONS", {})}
+
+
+def stats():
+    """Queued, suppressed (merged), delivered, rate-limited, failed and pending counts over the outbox."""
+    counts = NotificationOutbox.objects.aggregate(
+        queued=Sum("changes", default=0),
+        notifications=Count("id"),
+        delivered=Count("id", filter=Q(status="sent")),
+        rate_limited=Sum("deferrals", default=0),
+        failed=Count("id", filter=Q(status="failed")),
+        pending=Count("id", filter=Q(status="pending")),
+    )
+    return {
+        "queued": counts["queued"],
+        "suppressed": counts["queued"] - counts["notifications"],
+        "delivered": counts["delivered"],
+        "rate_limited": counts["rate_limited"],
+        "failed": counts["failed"],
+        "pending": counts["pending"],
+    }
+
+
+class FirebaseTransport:
+
+    def send(self, notifications):
+        """Send the notifications; returns one error message (or None on success) per notification."""
+        from firebase_admin import messaging
+
+        messages = [
+            messaging.Message(
+                notification=messaging.Notification(title=notification.title, body=notification.body),
+                topic=notification.topic,
+            )
+            for notification in notifications
+        ]
+        response = messaging.send_each(messages)
+        return [None if result.success else str(result.exception) for result in response.responses]
+
+
+class LocalTransport:
+    """Keeps sent notifications in LocalTransport.sent instead of delivering them."""
+    sent = []
+
+    def send(self, notifications):
+        LocalTransport.sent.extend(
+            {"topic": notification.topic, "title": notification.title, "body": notification.body}
+            for notification in notifications
+        )
+        return [None] * len(notifications)
+
+
+def get_transport():
+    return import_string(_config()["TRANSPORT"])()
+
+
+def enqueue(title, body, topic=None):
+    """Queue a notification as is, without coalescing."""
+    return NotificationOutbox.objects.create(title=title, body=body, topic=topic or _config()["DEFAULT_TOPIC"])
+
+
+# ----------------------------------------
+# Machine status changes
+# ----------------------------------------
+
+def status_event(machine, old_status, new_status):
+    line = references.get("line", machine.line_id)
+    return {
+        "machine": machine.pk,
+        "machine_id": machine.machine_id,
+        "model_number": machine.model_number,
+        "last_problem": machine.last_problem,
+        "line": line["name"] if line else None,
+        "floor": references.name("floor", line["floor_id"]) if line else None,
+        "operation_type": line["operation_type"] if line else None,
+        "old_status": old_status,
+        "new_status": new_status,
+        "changes": 1,
+    }
+
+
+def _merge(events, event):
+    for entry in events:
+        if entry["machine"] == event["machine"]:
+            # Keep where the machine started, take everything else from the latest change
+            entry.update({**event, "old_status": entry["old_status"], "changes": entry["changes"] + 1})
+            return
+    events.append(event)
+
+
+def _is_breakdown(entry):
+    return entry["old_status"] == "active" and entry["new_status"] == "broken"
+
+
+def _machine_message(entry):
+    machine_id = entry["machine_id"]
+    model_number = entry["model_number"]
+    old_status = entry["old_status"]
+    new_status = entry["new_status"]
+    line_name = entry["line"] or 'Unknown line'
+    operation_type = entry["operation_type"] or 'operation'
+    floor_no = entry["floor"] or 'Unknown Floor'
+    last_problem = entry["last_problem"] or 'Unknown Problem'
+
+    if _is_breakdown(entry):
+        topic_name = "mechanics"
+        title = f"🚨 A machine is broken down with {last_problem} in Floor: {floor_no}, Line: {line_name}, Operation: {operation_type}."
+        body = (
+            f"🔧 **Urgent Action Required**\n\n"
+            f"📌 **Machine Details:**\n"
+            f"    - ID: {machine_id}\n"
+            f"    - Model: {model_number}\n"
+            f"    - Status: ❌ Broken (was Active)\n"
+            f"    - Issue: {last_problem}\n\n"
+            f"📍 **Location Details:**\n"
+            f"    - Floor: {floor_no}\n"
+            f"    - Line: {line_name}\n"
+            f"    - Operation Type: {operation_type}\n\n"
+            "🚨 Immediate inspection and resolution are required to avoid further delays."
+        )
+    else:
+        title = f"Machine {machine_id} Status Updated"
+        topic_name = None
+        body = (
+            f"Machine {machine_id} ({model_number}) status changed from {old_status} to {new_status}.\n"
+            f"Location details:\n"
+            f"  - Operation: {operation_type}\n"
+            f"  - Line: {line_name}\n"
+            f"  - Floor: {floor_no}\n\n"
+            "Please check the machine's current condition and ensure it's functioning as expected."
+        )
+    if entry["changes"] > 1:
+        body = f"Status changed {entry['changes']} times, now {new_status}.\n\n" + body
+    return title, body, topic_name
+
+
+def render(events):
+    """(title, body, topic) for the status changes merged into one notification."""
+    if len(events) == 1:
+        return _machine_message(events[0])
+
+    by_status = {}
+    for entry in events:
+        by_status.setdefault(entry["new_status"], []).append(entry)
+    # Breakdowns lead the digest
+    statuses = sorted(by_status, key=lambda status: status != "broken")
+    summary = ", ".join(
+        f"{len(by_status[status])} machine{'s' if len(by_status[status]) > 1 else ''} {status}"
+        for status in statuses
+    )
+    lines_and_floors = {(entry["line"], entry["floor"]) for entry in events}
+    floors = {floor for _, floor in lines_and_floors}
+    if len(lines_and_floors) == 1:
+        location = f"Line {events[0]['line'] or 'Unknown line'}"
+        where = f"📍 Floor: {events[0]['floor'] or 'Unknown Floor'}, Line: {events[0]['line'] or 'Unknown line'}"
+    elif len(floors) == 1:
+        location = f"Floor {events[0]['floor'] or 'Unknown Floor'}"
+        where = f"📍 Floor: {events[0]['floor'] or 'Unknown Floor'}"
+    else:
+        location = "Machines"
+        where = "📍 Several floors"
+    lines = []
+    for entry in events:
+        change = f"{entry['old_status']} -> {entry['new_status']}"
+        if entry["changes"] > 1:
+            change += f" ({entry['changes']} changes)"
+        if entry["new_status"] == "broken":
+            change += f", issue: {entry['last_problem'] or 'Unknown Problem'}"
+        if len(lines_and_floors) > 1:
+            change += f" (Line {entry['line'] or 'Unknown line'})"
+        lines.append(f"  - {entry['machine_id']}: {change}")
+
+    title = f"{location}: {summary}"
+    body = where + "\n" + "\n".join(lines)
+    topic_name = "mechanics" if any(_is_breakdown(entry) for entry in events) else None
+    return title, body, topic_name
+
+
+def _machine_not_before(machine_pk, key, now):
+    """
+    When a machine may next be notified about, given when it last was: the
+    latest row sent within the window, under the machine's coalescing key or
+    from a bulk transition, that has an entry for it.
+    """
+    window = timedelta(seconds=_config()["MACHINE_WINDOW_SECONDS"])
+    recent = (
+        NotificationOutbox.objects
+        .filter(status="sent", sent_at__gt=now - window)
+        .filter(Q(coalesce_key=key) | Q(coalesce_key__isnull=True))
+        .order_by("-sent_at")
+        .values_list("sent_at", "events")
+    )
+    for sent_at, events in recent:
+        if any(entry["machine"] == machine_pk for entry in events):
+            return sent_at + window
+    return None
+
+
+def enqueue_status_change(machine, old_status, new_status):
+    """Queue a status change, merging it into a notification still in its debounce window."""
+    config = _config()
+    now = timezone.now()
+    event = status_event(machine, old_status, new_status)
+    key = f"line:{machine.line_id}" if machine.line_id else f"machine:{machine.pk}"
+    machine_not_before = _machine_not_before(machine.pk, key, now)
+
+    with transaction.atomic():
+        notification = (
+            NotificationOutbox.objects
+            .select_for_update()
+            .filter(coalesce_key=key, status="pending", attempts=0, available_at__gt=now)
+            .filter(Q(claimed_until__isnull=True) | Q(claimed_until__lt=now))
+            .order_by("-id")
+            .first()
+        )
+        if notification is None:
+            notification = NotificationOutbox(
+                coalesce_key=key,
+                events=[],
+                changes=0,
+                available_at=now + timedelta(seconds=config["LINE_WINDOW_SECONDS"]),
+            )
+        # The line window is shared; only a recently notified machine pushes it back
+        if machine_not_before and machine_not_before > notification.available_at:
+            notification.available_at = machine_not_before
+
+        _merge(notification.events, event)
+        notification.changes += 1
+        title, body, topic = render(notification.events)
+        notification.title = title
+        notification.body = body
+        notification.topic = topic or config["DEFAULT_TOPIC"]
+        notification.save()
+    return notification
+
+
+def enqueue_status_changes(changes):
+    """
+    Queue one notification for a bulk transition, changes being
+    (machine, old_status, new_status). It is sent right away, outside the
+    debounce windows, and does not merge with anything else.
+    """
+    if not changes:
+        return None
+    events = []
+    for machine, old_status, new_status in changes:
+        _merge(events, status_event(machine, old_status, new_status))
+    title, body, topic = render(events)
+    return NotificationOutbox.objects.create(
+        title=title, body=body, topic=topic or _config()["DEFAULT_TOPIC"], events=events, changes=len(changes),
+    )
+
+
+# ----------------------------------------
+# Delivery
+# ----------------------------------------
+
+def backoff(attempts):
+    config = _config()
+    return timedelta(seconds=min(config["BACKOFF_SECONDS"] * 2 ** (attempts - 1), config["MAX_BACKOFF_SECONDS"]))
+
+
+def claim(limit):
+    """Take up to limit due notifications, hiding them from other workers while they are sent."""
+    now = timezone.now()
+    with transaction.atomic():
+        notifications = list(
+            NotificationOutbox.objects
+            .filter(status="pending", available_at__lte=now)
+            .filter(Q(claimed_until__isnull=True) | Q(claimed_until__lt=now))
+            .order_by("available_at", "id")
+            .select_for_update(skip_locked=True)[:limit]
+        )
+        NotificationOutbox.objects.filter(pk__in=[n.pk for n in notifications]).update(
+            claimed_until=now + timedelta(seconds=_config()["CLAIM_SECONDS"])
+        )
+    return notifications
+
+
+def rate_limit(notifications, now):
+    """
+    Split notifications into those their topic's rate allows now and those
+    that have to wait, with the start of the topic's next period for each.
+    """
+    rates = _config()["TOPIC_RATES"]
+    allowed, deferred = [], []
+    by_topic = {}
+    for notification in notifications:
+        by_topic.setdefault(notification.topic, []).append(notification)
+
+    for topic, group in by_topic.items():
+        if topic not in rates:
+            allowed += group
+            continue
+        limit, seconds = rates[topic]
+        period = int(now.timestamp() // seconds)
+        # Counted from the rows already sent, so several delivery processes
+        # share the rate (each may still send one claim's worth over it)
+        used = NotificationOutbox.objects.filter(
+            topic=topic, status="sent", sent_at__gte=datetime.fromtimestamp(period * seconds, tz=dt_timezone.utc),
+        ).count()
+        room = max(0, limit - used)
+        allowed += group[:room]
+        next_period = datetime.fromtimestamp((period + 1) * seconds, tz=dt_timezone.utc)
+        deferred += [(notification, next_period) for notification in group[room:]]
+    return allowed, deferred
+
+
+def _send_batch(transport, batch):
+    try:
+        return transport.send(batch)
+    except Exception as exc:  # the whole batch failed, e.g. the network is down
+        logger.warning("Notification batch of %s failed: %s", len(batch), exc)
+        return [str(exc) or exc.__class__.__name__] * len(batch)
+
+
+def deliver_pending(limit=500, batch_size=100, workers=4, transport=None):
+    """
+    Deliver up to limit due notifications in batches of batch_size on a pool
+    of worker threads. Returns (sent, retried, failed) counts; notifications
+    held back by a topic rate are not counted.
+    """
+    transport = transport or get_transport()
+    config = _config()
+    notifications = claim(limit)
+    if not notifications:
+        return 0, 0, 0
+
+    now = timezone.now()
+    # Notifications that have nowhere to go are not worth retrying
+    undeliverable = [n for n in notifications if not n.topic]
+    deliverable, deferred = rate_limit([n for n in notifications if n.topic], now)
+    for notification, next_period in deferred:
+        notification.available_at = next_period
+        notification.claimed_until = None
+        notification.deferrals += 1
+
+    batch_size = max(1, min(batch_size, MAX_BATCH))
+    batches = [deliverable[i:i + batch_size] for i in range(0, len(deliverable), batch_size)]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(pool.map(lambda batch: _send_batch(transport, batch), batches))
+
+    now = timezone.now()
+    sent = retried = failed = 0
+    outcomes = [(n, "no topic to send to") for n in undeliverable]
+    outcomes += [
+        (notification, error)
+        for batch, errors in zip(batches, results)
+        for notification, error in zip(batch, errors)
+    ]
+    for notification, error in outcomes:
+        notification.attempts += 1
+        notification.claimed_until = None
+        if error is None:
+            notification.status = "sent"
+            notification.sent_at = now
+            notification.last_error = None
+            sent += 1
+        elif notification.topic and notification.attempts < config["MAX_ATTEMPTS"]:
+            notification.available_at = now + backoff(notification.attempts)
+            notification.last_error = error
+            retried += 1
+        else:
+            notification.status = "failed"
+            notification.last_error = error
+            failed += 1
+    NotificationOutbox.objects.bulk_update(
+        [notification for notification, _ in outcomes] + [notification for notification, _ in deferred],
+        ["status", "attempts", "available_at", "claimed_until", "sent_at", "last_error", "deferrals"],
+    )
+    return sent, retried, failed
@@ -0,0 +1,76 @@
+"""
+The problem category tree the breakdown report form is built from.
+
+problem_tree() returns every ProblemCategoryType with its categories nested,
+each with its severity and how often it has been used in breakdown logs,
+most used first. It costs two queries: the types, and the categories with
+their usage counted in the same grouped query.
+
+The tree is cached under the current versions of the two models (see
+core/versioning.py), so adding or renaming a category shows up on the next
+request. Usage counts are refreshed when the entry expires after TTL seconds.
+"""
+import hashlib
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from core import versioning
+
+from .models import ProblemCategory, ProblemCategoryType
+
+
+DEFAULTS = {
+    "ALIAS": "default",
+    "TTL": 300,
+    # Window of the recent_usage_count figure
+    "RECENT_DAYS": 30,
+}
+
+
+def _config():
+    return {**DEFAULTS, **getattr(settings, "PROBLEM_TREE", {})}
+
+
+def build_tree():
+    recent_since = timezone.now() - timedelta(days=_config()["RECENT_DAYS"])
+    categories = (
+        ProblemCategory.objects
+        .annotate(
+            usage_count=Count("breakdown_logs"),
+            recent_usage_count=Count("breakdown_logs", filter=Q(breakdown_logs__breakdown_start__gte=recent_since)),
+        )
+        .order_by("-usage_count", "name")
+        .values("id", "name", "description", "severity", "category_type", "usage_count", "recent_usage_count")
+    )
+    by_type = {}
+    for category in categories:
+        by_type.setdefault(category["category_type"], []).append(category)
+
+    tree = []
+    for problem_type in ProblemCategoryType.objects.order_by("name").values("id", "name", "description"):
+        type_categories = by_type.get(problem_type["id"], [])
+        tree.append({
+            **problem_type,
+            "usage_count": sum(category["usage_count"] for category in type_categories),
+            "categories": type_categories,
+        })
+    tree.sort(key=lambda problem_type: (-problem_type["usage_count"], problem_type["name"]))
+    return tree
+
+
+def problem_tree():
+    """(tree, etag): the cached tree and a tag that changes whenever it is rebuilt."""
+    config = _config()
+    cache = caches[config["ALIAS"]]
+    token, _ = versioning.versions([ProblemCategoryType, ProblemCategory])
+    key = f"problem-tree:{token}"
+    cached = cache.get(key)
+    if cached is None:
+        cached = (build_tree(), hashlib.sha1(f"{token}|{time.time()}".encode()).hexdigest())
+        cache.set(key, cached, config["TTL"])
+    return cached
@@ -0,0 +1,169 @@
+"""
+Process-local registry of the small reference tables.
+
+Brand, Type, Category, Supplier, ProblemCategory, Line and Floor change a
+few times a month but their names are needed on every dashboard,
+monitoring payload and notification. Each table is loaded whole, once, into
+an id -> row dict, so resolving a name is a dict lookup instead of a join or
+a lazy foreign key query:
+
+    from .references import references
+    references.name("type", type_id)
+    references.get("line", line_id)["floor_id"]
+
+A table is reloaded when its version (core/versioning.py) has changed. The
+version is checked at most every REFRESH_SECONDS. Saves and deletes in this
+process clear the table straight away.
+
+Other processes only see a change through the version, and only when the
+versions are shared (versioning.shared()). Otherwise a table is reloaded
+every REFRESH_SECONDS. A lookup of an id the table does not have also
+reloads it, at most once per REFRESH_SECONDS, so a row created in another
+process is found straight away.
+"""
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+
+from core import versioning
+
+
+DEFAULTS = {
+    "REFRESH_SECONDS": 5,
+}
+
+# Table name -> (model label, fields kept per row)
+TABLES = {
+    "brand": ("maintenance.Brand", ("name", "company_id")),
+    "type": ("maintenance.Type", ("name", "company_id")),
+    "category": ("maintenance.Category", ("name", "company_id")),
+    "supplier": ("maintenance.Supplier", ("name", "company_id")),
+    "problem_category": ("maintenance.ProblemCategory", ("name", "severity", "category_type_id")),
+    "line": ("production.Line", ("name", "operation_type", "floor_id")),
+    "floor": ("production.Floor", ("name", "company_id")),
+}
+
+
+def _config():
+    return {**DEFAULTS, **getattr(settings, "REFERENCE_REGISTRY", {})}
+
+
+class _Table:
+    def __init__(self, label, fields):
+        self.label = label
+        self.fields = fields
+        self.rows = None
+        self.token = None
+        self.checked_at = 0
+        self.missed_at = None
+
+    @property
+    def model(self):
+        return apps.get_model(self.label)
+
+    def load(self, token):
+        self.rows = {
+            row.pop("pk"): row
+            for row in self.model.objects.order_by().values("pk", *self.fields)
+        }
+        self.token = token
+        self.checked_at = time.monotonic()
+
+
+class ReferenceRegistry:
+    def __init__(self, tables):
+        self._tables = {name: _Table(label, fields) for name, (label, fields) in tables.items()}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._reloads = 0
+
+    def _rows(self, name):
+        """(rows, loaded): loaded is True when the table had to be read from the database."""
+        table = self._tables[name]
+        if table.rows is not None and time.monotonic() - table.checked_at < _config()["REFRESH_SECONDS"]:
+            return table.rows, False
+        with self._lock:
+            token, _ = versioning.versions([table.model])
+            if table.rows is None or token != table.token or not versioning.shared():
+                table.load(token)
+                self._reloads += 1
+                return table.rows, True
+            table.checked_at = time.monotonic()
+            return table.rows, False
+
+    def _reload_missing(self, name):
+        """(rows, loaded) after a lookup missed: reloaded unless that was done less than REFRESH_SECONDS ago."""
+        table = self._tables[name]
+        with self._lock:
+            now = time.monotonic()
+            if table.missed_at is not None and now - table.missed_at < _config()["REFRESH_SECONDS"]:
+                return table.rows, False
+            token, _ = versioning.versions([table.model])
+            table.load(token)
+            table.missed_at = now
+            self._reloads += 1
+            return table.rows, True
+
+    def get(self, name, pk):
+        """The row of the table with this id as a dict, or None."""
+        if pk is None:
+            return None
+        rows, loaded = self._rows(name)
+        row = rows.get(pk)
+        if row is None and not loaded:
+            rows, loaded = self._reload_missing(name)
+            row = rows.get(pk)
+        # A miss is a lookup the loaded table could not answer by itself
+        if row is None or loaded:
+            self._misses += 1
+        else:
+            self._hits += 1
+        return row
+
+    def name(self, name, pk):
+        row = self.get(name, pk)
+        return row["name"] if row else None
+
+    def names(self, name):
+        """{id: name} of the whole table."""
+        rows, _ = self._rows(name)
+        return {pk: row["name"] for pk, row in rows.items()}
+
+    def clear(self, name=None):
+        with self._lock:
+            for table_name, table in self._tables.items():
+                if name is None or table_name == name:
+                    table.rows = None
+                    table.missed_at = None
+
+    def warm(self):
+        for name in self._tables:
+            self._rows(name)
+
+    def stats(self):
+        lookups = self._hits + self._misses
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_ratio": round(self._hits / lookups, 4) if lookups else None,
+            "reloads": self._reloads,
+            "tables": {
+                name: len(table.rows) if table.rows is not None else None
+                for name, table in self._tables.items()
+            },
+        }
+
+    def connect(self):
+        """Clear a table when one of its rows is saved or deleted in this process."""
+        for name, table in self._tables.items():
+            def clear(sender, name=name, **kwargs):
+                self.clear(name)
+            post_save.connect(clear, sender=table.label, weak=False, dispatch_uid=f"references-save-{name}")
+            post_delete.connect(clear, sender=table.label, weak=False, dispatch_uid=f"references-delete-{name}")
+
+
+references = ReferenceRegistry(TABLES)
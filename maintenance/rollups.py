@@ -0,0 +1,312 @@
+"""
+Incremental maintenance of BreakdownDailyRollup.
+
+Each BreakdownLog contributes one breakdown (plus its lost and response time)
+to the rollup row for its (company, day, line, machine, problem, mechanic)
+key. Writes apply signed deltas to that row, and reads always Sum() over the
+rollup rows, so a key that ends up duplicated by two racing first writes
+never skews the totals.
+
+Parts cost is quantity used times the part's current price, as the raw
+PartsUsageRecord queries compute it, so a change of a part's price is
+applied to every rollup row its usage is counted in (part_price_changed).
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q, Sum, Count, ExpressionWrapper, DurationField, DecimalField
+from django.db.models.base import DEFERRED
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import BreakdownDailyRollup, BreakdownLog, Machine
+from .periods import plant_day, plant_timezone, day_start
+
+
+KEY_FIELDS = ("company_id", "day", "line_id", "machine_id", "problem_category_id", "mechanic_id")
+
+TRACKED_FIELDS = (
+    "machine_id",
+    "line_id",
+    "problem_category_id",
+    "mechanic_id",
+    "breakdown_start",
+    "repairing_start",
+    "lost_time",
+)
+
+
+def rollups_enabled():
+    """Analytics read from the rollups only once they have been backfilled."""
+    return getattr(settings, "BREAKDOWN_ROLLUPS_ENABLED", False)
+
+
+def split_range(start, end=None):
+    """
+    Split [start, end) into the whole plant days that can be read from the rollups
+    and the partial-day edges that have to come from the raw logs.
+
+    Returns (first_day, last_day, edges); rollup days are first_day <= day < last_day
+    and edges is a list of (start, end) datetime ranges, end None meaning open.
+    When end is None the window is open-ended and everything from the start
+    of today onwards is read raw.
+    """
+    first_day = plant_day(start)
+    if day_start(first_day) < start:
+        first_day += timedelta(days=1)
+    last_day = plant_day(end if end is not None else timezone.now())
+
+    if first_day >= last_day:
+        return None, None, [(start, end)]
+
+    edges = []
+    if start < day_start(first_day):
+        edges.append((start, day_start(first_day)))
+    if end is None or day_start(last_day) < end:
+        edges.append((day_start(last_day), end))
+    return first_day, last_day, edges
+
+
+def _stored_values(log):
+    values = getattr(log, "_loaded_values", None)
+    if not values or any(values.get(name, DEFERRED) is DEFERRED for name in TRACKED_FIELDS):
+        return None
+    return {name: values[name] for name in TRACKED_FIELDS}
+
+
+def _current_values(log):
+    return {name: getattr(log, name) for name in TRACKED_FIELDS}
+
+
+def _company_id(machine_id):
+    if machine_id is None:
+        return None
+    return Machine.objects.filter(pk=machine_id).values_list("company_id", flat=True).first()
+
+
+def _key(values, company_id):
+    return {
+        "company_id": company_id,
+        "day": plant_day(values["breakdown_start"]),
+        "line_id": values["line_id"],
+        "machine_id": values["machine_id"],
+        "problem_category_id": values["problem_category_id"],
+        "mechanic_id": values["mechanic_id"],
+    }
+
+
+def _measures(values):
+    responded = values["repairing_start"] is not None
+    return {
+        "breakdown_count": 1,
+        "lost_time": values["lost_time"],
+        "response_count": 1 if responded else 0,
+        "response_lost_time": values["lost_time"] if responded else timedelta(),
+        "response_time": values["repairing_start"] - values["breakdown_start"] if responded else timedelta(),
+    }
+
+
+def _apply(key, sign, measures):
+    """Add (sign=1) or subtract (sign=-1) measures on the rollup row for key."""
+    measures = {name: value * sign for name, value in measures.items() if value}
+    if not measures:
+        return
+    row_pk = BreakdownDailyRollup.objects.filter(**key).values_list("pk", flat=True).first()
+    if row_pk is None:
+        BreakdownDailyRollup.objects.create(**key, **measures)
+    else:
+        BreakdownDailyRollup.objects.filter(pk=row_pk).update(
+            **{name: F(name) + value for name, value in measures.items()}
+        )
+
+
+def _parts_cost(breakdown_filter):
+    PartsUsageRecord = apps.get_model("inventory", "PartsUsageRecord")
+    return PartsUsageRecord.objects.filter(**breakdown_filter).aggregate(
+        total=Sum(F("quantity_used") * F("part__price"), output_field=DecimalField())
+    )["total"] or Decimal("0")
+
+
+def _parts_by_key(parts, amount):
+    """{rollup key tuple (see KEY_FIELDS): amount} of parts usage rows, amount being a Sum()."""
+    grouped = (
+        parts
+        .annotate(day=TruncDate("breakdown__breakdown_start", tzinfo=plant_timezone()))
+        .values(
+            "breakdown__machine__company",
+            "day",
+            "breakdown__line",
+            "breakdown__machine",
+            "breakdown__problem_category",
+            "breakdown__mechanic",
+        )
+        .annotate(amount=amount)
+        .order_by()
+    )
+    return {
+        (
+            item["breakdown__machine__company"], item["day"], item["breakdown__line"],
+            item["breakdown__machine"], item["breakdown__problem_category"], item["breakdown__mechanic"],
+        ): item["amount"] or 0
+        for item in grouped
+    }
+
+
+def remember_stored_values(log):
+    """pre_save fallback for instances that were not loaded from the database."""
+    if log.pk and _stored_values(log) is None:
+        log._loaded_values = (
+            BreakdownLog.objects.filter(pk=log.pk).values(*TRACKED_FIELDS).first() or {}
+        )
+
+
+def breakdown_saved(log, created):
+    new_values = _current_values(log)
+    old_values = None if created else _stored_values(log)
+    log._loaded_values = new_values
+
+    if old_values == new_values:
+        return
+
+    new_key = _key(new_values, _company_id(new_values["machine_id"]))
+    new_measures = _measures(new_values)
+
+    if old_values is not None:
+        if old_values["machine_id"] == new_values["machine_id"]:
+            old_key = _key(old_values, new_key["company_id"])
+        else:
+            old_key = _key(old_values, _company_id(old_values["machine_id"]))
+        # Parts already booked against this log follow it to its new key
+        if old_key != new_key:
+            parts_cost = _parts_cost({"breakdown_id": log.pk})
+            _apply(old_key, -1, {**_measures(old_values), "parts_cost": parts_cost})
+            new_measures["parts_cost"] = parts_cost
+        else:
+            _apply(old_key, -1, _measures(old_values))
+
+    _apply(new_key, 1, new_measures)
+
+
+def breakdown_deleted(log):
+    # Parts usage rows are removed by the cascade and subtract their own cost
+    values = _stored_values(log) or _current_values(log)
+    _apply(_key(values, _company_id(values["machine_id"])), -1, _measures(values))
+
+
+def breakdowns_created(logs):
+    """
+    Add logs saved with bulk_create, which sends no signals, to the rollups
+    with one write per rollup key.
+    """
+    company_ids = dict(
+        Machine.objects.filter(pk__in={log.machine_id for log in logs}).values_list("pk", "company_id")
+    )
+    totals = {}
+    for log in logs:
+        values = _current_values(log)
+        log._loaded_values = values
+        key = tuple(_key(values, company_ids.get(values["machine_id"])).items())
+        measures = totals.setdefault(key, {})
+        for name, value in _measures(values).items():
+            measures[name] = measures[name] + value if name in measures else value
+    for key, measures in totals.items():
+        _apply(dict(key), 1, measures)
+
+
+def parts_cost_changed(breakdown, amount):
+    """Add (or, with a negative amount, remove) parts cost booked against a breakdown."""
+    if not amount:
+        return
+    values = _stored_values(breakdown) or _current_values(breakdown)
+    _apply(_key(values, _company_id(values["machine_id"])), 1, {"parts_cost": amount})
+
+
+def parts_costs_added(amounts):
+    """
+    Add {breakdown: amount} of parts cost saved with bulk_create, which sends
+    no signals, with one write per rollup key.
+    """
+    values_by_breakdown = {
+        breakdown: _stored_values(breakdown) or _current_values(breakdown)
+        for breakdown, amount in amounts.items() if amount
+    }
+    company_ids = dict(
+        Machine.objects
+        .filter(pk__in={values["machine_id"] for values in values_by_breakdown.values()})
+        .values_list("pk", "company_id")
+    )
+    totals = {}
+    for breakdown, values in values_by_breakdown.items():
+        key = tuple(_key(values, company_ids.get(values["machine_id"])).items())
+        totals[key] = totals.get(key, 0) + amounts[breakdown]
+    for key, amount in totals.items():
+        _apply(dict(key), 1, {"parts_cost": amount})
+
+
+def part_price_changed(part_id, delta):
+    """Reprice the parts cost of every use of a part by delta per unit, with one write per rollup key."""
+    if not delta:
+        return
+    PartsUsageRecord = apps.get_model("inventory", "PartsUsageRecord")
+    quantities = _parts_by_key(PartsUsageRecord.objects.filter(part_id=part_id), Sum("quantity_used"))
+    for key, quantity in quantities.items():
+        _apply(dict(zip(KEY_FIELDS, key)), 1, {"parts_cost": quantity * delta})
+
+
+def rebuild_rollups(start=None, end=None):
+    """
+    Recompute the rollups for days start <= day < end (all days when omitted)
+    from the raw logs. Returns the number of rollup rows written.
+    """
+    logs = BreakdownLog.objects.all()
+    rollups = BreakdownDailyRollup.objects.all()
+    PartsUsageRecord = apps.get_model("inventory", "PartsUsageRecord")
+    parts = PartsUsageRecord.objects.all()
+    if start:
+        logs = logs.filter(breakdown_start__gte=day_start(start))
+        parts = parts.filter(breakdown__breakdown_start__gte=day_start(start))
+        rollups = rollups.filter(day__gte=start)
+    if end:
+        logs = logs.filter(breakdown_start__lt=day_start(end))
+        parts = parts.filter(breakdown__breakdown_start__lt=day_start(end))
+        rollups = rollups.filter(day__lt=end)
+
+    responded = Q(repairing_start__isnull=False)
+    response_time = ExpressionWrapper(F("repairing_start") - F("breakdown_start"), output_field=DurationField())
+    grouped_logs = (
+        logs
+        .annotate(day=TruncDate("breakdown_start", tzinfo=plant_timezone()))
+        .values("machine__company", "day", "line", "machine", "problem_category", "mechanic")
+        .annotate(
+            breakdowns=Count("id"),
+            lost=Sum("lost_time"),
+            responses=Count("id", filter=responded),
+            responded_lost=Sum("lost_time", filter=responded),
+            responded_time=Sum(response_time, filter=responded),
+        )
+        .order_by()
+    )
+    rows = {}
+    for item in grouped_logs:
+        key = (item["machine__company"], item["day"], item["line"], item["machine"], item["problem_category"], item["mechanic"])
+        rows[key] = BreakdownDailyRollup(
+            company_id=key[0], day=key[1], line_id=key[2], machine_id=key[3],
+            problem_category_id=key[4], mechanic_id=key[5],
+            breakdown_count=item["breakdowns"],
+            lost_time=item["lost"] or timedelta(),
+            response_count=item["responses"],
+            response_lost_time=item["responded_lost"] or timedelta(),
+            response_time=item["responded_time"] or timedelta(),
+        )
+    costs = _parts_by_key(parts, Sum(F("quantity_used") * F("part__price"), output_field=DecimalField()))
+    for key, cost in costs.items():
+        if key in rows:
+            rows[key].parts_cost = cost
+
+    with transaction.atomic():
+        rollups.delete()
+        BreakdownDailyRollup.objects.bulk_create(rows.values(), batch_size=1000)
+    return len(rows)
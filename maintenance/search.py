@@ -0,0 +1,114 @@
+"""
+Machine search over MachineSearchDocument.
+
+Every machine has one lower-cased document holding its own identifiers and
+the names of its category, type, brand, supplier, line, floor, mechanic,
+operator and company. A search splits the query into terms and requires
+each one to appear in the document (`document LIKE '%term%'`). On
+PostgreSQL a pg_trgm GIN index answers that without scanning the table;
+other databases fall back to scanning the single column, still without the
+joins.
+"""
+from django.db.models import Q
+
+from .models import Machine, MachineSearchDocument
+
+
+SEARCH_FIELDS = (
+    "machine_id",
+    "model_number",
+    "serial_no",
+    "sequence",
+    "status",
+    "last_problem",
+    "purchase_date",
+    "category__name",
+    "type__name",
+    "brand__name",
+    "supplier__name",
+    "line__name",
+    "line__floor__name",
+    "mechanic__name",
+    "operator__name",
+    "company__name",
+)
+
+# Models whose names appear in the documents, with the Machine lookups that reach them
+RELATED_LOOKUPS = {
+    "maintenance.Category": ("category",),
+    "maintenance.Type": ("type",),
+    "maintenance.Brand": ("brand",),
+    "maintenance.Supplier": ("supplier",),
+    "production.Line": ("line",),
+    "production.Floor": ("line__floor",),
+    "user_management.Employee": ("mechanic", "operator"),
+    "company.Company": ("company",),
+}
+
+# Machine columns the documents are built from
+DOCUMENT_COLUMNS = frozenset(Machine._meta.get_field(field.split("__")[0]).attname for field in SEARCH_FIELDS)
+
+BATCH_SIZE = 1000
+
+
+def build_document(values):
+    return " ".join(str(values[field]) for field in SEARCH_FIELDS if values[field] not in (None, "")).lower()
+
+
+def search_terms(query):
+    return [term for term in query.lower().split() if term]
+
+
+def document_changed(machine, update_fields=None):
+    """
+    Whether saving the machine can have changed its document: one of the
+    saved columns it is built from has a new value (or the old one is not
+    known). Saves of only the timestamps leave it alone.
+    """
+    columns = DOCUMENT_COLUMNS
+    if update_fields is not None:
+        columns = columns & {Machine._meta.get_field(name).attname for name in update_fields}
+    stored = machine.stored_values(columns)
+    if stored is None:
+        return True
+    return any(stored[column] != getattr(machine, column) for column in columns)
+
+
+def refresh_documents(machine_queryset):
+    """Rebuild the documents of the given machines. Returns how many were written."""
+    written = 0
+    rows = machine_queryset.order_by().values("pk", *SEARCH_FIELDS).iterator(chunk_size=BATCH_SIZE)
+    batch = []
+    for values in rows:
+        batch.append(MachineSearchDocument(machine_id=values["pk"], document=build_document(values)))
+        if len(batch) >= BATCH_SIZE:
+            written += _write(batch)
+            batch = []
+    return written + _write(batch)
+
+
+def _write(documents):
+    if documents:
+        MachineSearchDocument.objects.bulk_create(
+            documents, update_conflicts=True, unique_fields=["machine"], update_fields=["document"],
+        )
+    return len(documents)
+
+
+def related_machines(instance, model_label):
+    """Machines whose documents include the name of a related object."""
+    condition = Q(pk__in=[])
+    for lookup in RELATED_LOOKUPS[model_label]:
+        condition |= Q(**{lookup: instance.pk})
+    return Machine.objects.filter(condition)
+
+
+def rebuild_documents():
+    return refresh_documents(Machine.objects.all())
+
+
+def search_machines(queryset, query):
+    """Machines whose document contains every term of the query."""
+    for term in search_terms(query):
+        queryset = queryset.filter(search_document__document__contains=term)
+    return queryset
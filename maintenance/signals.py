@@ -1,7 +1,23 @@
-from django.db.models.signals import pre_save, post_save
-from django.dispatch import receiver
-from .models import Machine
-from .utils import send_push_notification
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver, Signal
+from production.models import Floor, Line
+from .models import Machine, BreakdownLog
+from .notifications import enqueue_status_change, enqueue_status_changes
+from . import rollups
+from . import timeline
+from . import live
+from . import hierarchy
+from . import search
+from . import cache as analytics_cache
+
+# Sent once per machine whose status changed, by Machine.save() and by the
+# bulk transitions in maintenance/transitions.py, with machine, old_status
+# and new_status (and batched=True from the bulk transitions).
+machine_status_changed = Signal()
+
+# Sent once per bulk transition with changes, a list of
+# (machine, old_status, new_status).
+machine_statuses_changed = Signal()
 
 @receiver(pre_save, sender=Machine)
 def detect_status_change(sender, instance, **kwargs):
@@ -10,56 +26,152 @@ def detect_status_change(sender, instance, **kwargs):
         instance._status_changed = False
         return
 
-    try:
-        previous = Machine.objects.get(pk=instance.pk)
-        instance._status_changed = previous.status != instance.status
-        instance._old_status = previous.status
-        instance._new_status = instance.status
-    except Machine.DoesNotExist:
+    # Compare against the values remembered when the machine was loaded; only
+    # instances that were not loaded from the database need a query
+    previous = instance.stored_values()
+    if previous is None:
+        previous = Machine.objects.filter(pk=instance.pk).values(*Machine.TRACKED_FIELDS).first()
+    if previous is None:
         instance._status_changed = False
+        return
+
+    instance._status_changed = previous["status"] != instance.status
+    instance._old_status = previous["status"]
+    instance._new_status = instance.status
+    instance._old_line_id = previous["line_id"]
+    instance._old_mechanic_id = previous["mechanic_id"]
+
+@receiver(post_save, sender=Machine)
+def invalidate_machine_analytics(sender, instance, raw=False, **kwargs):
+    if not raw:
+        analytics_cache.bump(analytics_cache.machine_scopes(instance))
+
+@receiver(post_save, sender=Machine)
+def refresh_machine_search_document(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    # Before emit_status_change below remembers the saved values
+    if not raw and (created or search.document_changed(instance, update_fields)):
+        search.refresh_documents(Machine.objects.filter(pk=instance.pk))
+
+@receiver(post_delete, sender=Machine)
+def invalidate_deleted_machine_analytics(sender, instance, **kwargs):
+    analytics_cache.bump(analytics_cache.machine_scopes(instance))
 
 @receiver(post_save, sender=Machine)
-def send_status_change_notification(sender, instance, created, **kwargs):
-    if not created and getattr(instance, '_status_changed', False):
-        old_status = instance._old_status
-        new_status = instance._new_status
-        machine_id = instance.machine_id
-        model_number = instance.model_number
-        line = instance.line
-        last_problem = instance.last_problem
-        
-        # Retrieve location details
-        line_name = line.name if line else 'Unknown line'
-        operation_type = line.operation_type if line else 'operation'
-        floor_no = line.floor.name if line else 'Unknown Floor'
-        last_problem = last_problem if last_problem else 'Unknown Problem'
-
-        if old_status == "active" and new_status == "broken":
-            topic_name = "mechanics"
-            title = f"🚨 A machine is broken down with {last_problem} in Floor: {floor_no}, Line: {line_name}, Operation: {operation_type}."
-            body = (
-                f"🔧 **Urgent Action Required**\n\n"
-                f"📌 **Machine Details:**\n"
-                f"    - ID: {machine_id}\n"
-                f"    - Model: {model_number}\n"
-                f"    - Status: ❌ Broken (was Active)\n"
-                f"    - Issue: {last_problem}\n\n"
-                f"📍 **Location Details:**\n"
-                f"    - Floor: {floor_no}\n"
-                f"    - Line: {line_name}\n"
-                f"    - Operation Type: {operation_type}\n\n"
-                "🚨 Immediate inspection and resolution are required to avoid further delays."
-            )
+@receiver(post_delete, sender=Machine)
+def journal_machine_change(sender, instance, raw=False, **kwargs):
+    if not raw:
+        hierarchy.journal("machine", [(instance.pk, instance.company_id)])
+
+@receiver(post_save, sender=Machine)
+def record_machine_placement(sender, instance, created, raw=False, **kwargs):
+    # First event of a new machine, and moves to another line without a
+    # status change; status changes are recorded from machine_status_changed
+    if raw:
+        return
+    moved = getattr(instance, '_old_line_id', instance.line_id) != instance.line_id
+    if created or (moved and not getattr(instance, '_status_changed', False)):
+        timeline.record([instance])
+
+@receiver(post_save, sender=Machine)
+def emit_status_change(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if not created and not raw and getattr(instance, '_status_changed', False):
+        machine_status_changed.send(
+            sender=Machine, machine=instance, old_status=instance._old_status, new_status=instance._new_status,
+        )
+    instance.remember_stored_values(update_fields)
+
+@receiver(machine_status_changed)
+def send_status_change_notification(sender, machine, old_status, new_status, batched=False, **kwargs):
+    # Queued in the outbox, merged with other changes of the machine and its
+    # line (see maintenance/notifications.py); deliver_notifications sends it.
+    # Bulk transitions are notified about as a whole below.
+    if not batched:
+        enqueue_status_change(machine, old_status, new_status)
+
+@receiver(machine_statuses_changed)
+def send_bulk_status_change_notification(sender, changes, **kwargs):
+    enqueue_status_changes(changes)
+
+@receiver(machine_status_changed)
+def record_status_event(sender, machine, old_status, new_status, batched=False, **kwargs):
+    if not batched:
+        timeline.record([machine])
 
+@receiver(machine_statuses_changed)
+def record_status_events(sender, changes, **kwargs):
+    timeline.record([machine for machine, old_status, new_status in changes])
+
+@receiver(machine_status_changed)
+def publish_status_change(sender, machine, old_status, new_status, batched=False, **kwargs):
+    if not batched:
+        live.publish_on_commit([live.status_event(machine, old_status, new_status)])
+
+@receiver(machine_statuses_changed)
+def journal_status_changes(sender, changes, **kwargs):
+    hierarchy.journal("machine", [(machine.pk, machine.company_id) for machine, old_status, new_status in changes])
+
+@receiver(machine_statuses_changed)
+def publish_status_changes(sender, changes, **kwargs):
+    live.publish_on_commit([live.status_event(*change) for change in changes])
+
+
+@receiver(pre_save, sender=BreakdownLog)
+def remember_breakdown_values(sender, instance, raw=False, **kwargs):
+    if not raw:
+        rollups.remember_stored_values(instance)
+
+@receiver(post_save, sender=BreakdownLog)
+def breakdown_log_saved(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        # Bump the cache before the rollups replace the stored values
+        analytics_cache.bump(analytics_cache.breakdown_scopes(instance))
+        rollups.breakdown_saved(instance, created)
+        if created:
+            live.publish_on_commit([live.breakdown_event(instance)])
+
+@receiver(post_delete, sender=BreakdownLog)
+def breakdown_log_deleted(sender, instance, **kwargs):
+    analytics_cache.bump(analytics_cache.breakdown_scopes(instance))
+    rollups.breakdown_deleted(instance)
+
+
+# Machine search documents hold the names of related objects too
+def refresh_related_search_documents(sender, instance, created=False, raw=False, **kwargs):
+    if not raw and not created:
+        search.refresh_documents(search.related_machines(instance, sender._meta.label))
+
+def remember_related_search_machines(sender, instance, **kwargs):
+    # Collected before SET_NULL relations are cleared by the delete
+    instance._search_machine_pks = list(
+        search.related_machines(instance, sender._meta.label).values_list("pk", flat=True)
+    )
+
+def refresh_search_documents_after_delete(sender, instance, **kwargs):
+    machine_pks = getattr(instance, "_search_machine_pks", None)
+    if machine_pks:
+        search.refresh_documents(Machine.objects.filter(pk__in=machine_pks))
+
+for model_label in search.RELATED_LOOKUPS:
+    post_save.connect(refresh_related_search_documents, sender=model_label, dispatch_uid=f"search-save-{model_label}")
+    pre_delete.connect(remember_related_search_machines, sender=model_label, dispatch_uid=f"search-pre-delete-{model_label}")
+    post_delete.connect(refresh_search_documents_after_delete, sender=model_label, dispatch_uid=f"search-delete-{model_label}")
+
+
+# Floors and lines in the plant hierarchy journal (see maintenance/hierarchy.py)
+def journal_location_change(sender, instance, raw=False, **kwargs):
+    if not raw:
+        if sender is Line:
+            # Still there when the line goes with its floor: the floor is deleted after its lines
+            company_id = Floor.objects.filter(pk=instance.floor_id).values_list("company_id", flat=True).first()
         else:
-            title = f"Machine {machine_id} Status Updated"
-            topic_name = None
-            body = (
-                f"Machine {machine_id} ({model_number}) status changed from {old_status} to {new_status}.\n"
-                f"Location details:\n"
-                f"  - Operation: {operation_type}\n"
-                f"  - Line: {line_name}\n"
-                f"  - Floor: {floor_no}\n\n"
-                "Please check the machine's current condition and ensure it's functioning as expected."
-            )
-        send_push_notification(title=title, body=body, topic=topic_name)
+            company_id = instance.company_id
+        hierarchy.journal(sender._meta.model_name, [(instance.pk, company_id)])
+
+def journal_unassigned_machines(sender, instance, **kwargs):
+    # Machines of a deleted line are moved off it by SET_NULL, which sends no signals
+    hierarchy.journal("machine", Machine.objects.filter(line_id=instance.pk).values_list("pk", "company_id"))
+
+for model_label in ("production.Floor", "production.Line"):
+    post_save.connect(journal_location_change, sender=model_label, dispatch_uid=f"hierarchy-save-{model_label}")
+    post_delete.connect(journal_location_change, sender=model_label, dispatch_uid=f"hierarchy-delete-{model_label}")
+pre_delete.connect(journal_unassigned_machines, sender="production.Line", dispatch_uid="hierarchy-line-machines")
@@ -1,3 +1,1597 @@
-from django.test import TestCase
+import asyncio
+import base64
+import importlib.util
+import io
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock, skipUnless
+from urllib.parse import urlencode
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.management import CommandError, call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import AsyncClient, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from company.models import Company
+from core import versioning
+from core.broadcast import InProcessBroadcaster, get_broadcaster, publish
+from inventory.models import MachinePart, PartsUsageRecord
+from production.models import Floor, Line
+from user_management.authentication import tokens
+from user_management.models import Employee
+from . import cache as analytics_cache, hierarchy, imports, live, notifications, rollups
+from .models import (
+    Brand, BreakdownDailyRollup, BreakdownLog, Machine, MachineStatusEvent, NotificationOutbox, PlantChange,
+    ProblemCategory, ProblemCategoryType, Type,
+)
+from .periods import parse_bound, plant_day, previous_window
+from .references import references
+from .reliability import bucket_edges, reliability_report
+from .search import refresh_documents, search_machines
+from .signals import machine_status_changed
+from .timeline import time_in_state
+
+
+class TotalLostTimeTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        company = Company.objects.create(name="Panacea")
+        floor = Floor.objects.create(name="1", company=company)
+        cls.line_a = Line.objects.create(name="Line A", operation_type="sewing", floor=floor)
+        cls.line_b = Line.objects.create(name="Line B", operation_type="sewing", floor=floor)
+        lockstitch = Type.objects.create(name="Lockstitch", company=company)
+        mechanic = Employee.objects.create(name="Rahim", company=company)
+        problem_type = ProblemCategoryType.objects.create(name="Mechanical")
+        needle = ProblemCategory.objects.create(name="Needle", category_type=problem_type)
+
+        cls.m1 = Machine.objects.create(machine_id="M-1", type=lockstitch, line=cls.line_a, company=company)
+        cls.m2 = Machine.objects.create(machine_id="M-2", type=lockstitch, line=cls.line_a, company=company, status="maintenance")
+        Machine.objects.create(machine_id="M-3", line=cls.line_b, company=company, status="inactive")
+
+        day_one = timezone.make_aware(datetime(2025, 2, 5, 8, 0))
+        day_two = timezone.make_aware(datetime(2025, 2, 6, 8, 0))
+        BreakdownLog.objects.create(
+            machine=cls.m1, mechanic=mechanic, problem_category=needle, line=cls.line_a,
+            breakdown_start=day_one, repairing_start=day_one + timedelta(minutes=10),
+            lost_time=timedelta(minutes=30),
+        )
+        BreakdownLog.objects.create(
+            machine=cls.m1, mechanic=mechanic, problem_category=needle, line=cls.line_a,
+            breakdown_start=day_two, repairing_start=day_two + timedelta(minutes=20),
+            lost_time=timedelta(minutes=40),
+        )
+        BreakdownLog.objects.create(
+            machine=cls.m2, line=cls.line_a, breakdown_start=day_two, lost_time=timedelta(minutes=5),
+        )
+
+    def setUp(self):
+        cache.clear()
+        # Type, problem and line names come from the reference registry
+        references.warm()
+
+    def test_summaries_in_two_queries(self):
+        client = APIClient()
+        with self.assertNumQueries(2):
+            response = client.get("/api/maintenance/breakdown-logs/total-lost-time-per-location/")
+        self.assertEqual(response.status_code, 200)
+        data = response.data
+
+        self.assertEqual(data["total_lost_time"], "1:15:00")
+        self.assertEqual(data["total_machine_count"], 3)
+        self.assertEqual(data["total_active_machines"], 1)
+        self.assertEqual(data["total_repairing_machines"], 1)
+        self.assertEqual(data["total_idle_machines"], 1)
+        self.assertEqual(data["avg_time_to_respond"], "0:15:00")
+
+        by_machine = {item["machine_id"]: item for item in data["summary_by_machine_id"]}
+        self.assertEqual(by_machine["M-1"]["breakdowns_count"], 2)
+        self.assertEqual(by_machine["M-1"]["lost_time"], "1:10:00")
+        self.assertEqual(by_machine["M-2"]["status"], "maintenance")
+
+        self.assertEqual(data["summary_by_type"], [
+            {"type": "Lockstitch", "machine_count": 2, "breakdowns_count": 3, "lost_time": "1:15:00"},
+        ])
+        self.assertEqual(
+            {item["problem"]: item["breakdowns_count"] for item in data["summary_by_problem"]},
+            {"Needle": 2, None: 1},
+        )
+        self.assertEqual(data["summary_by_line"], [
+            {"id": self.line_a.id, "line": "Line A", "breakdowns_count": 3, "lost_time": "1:15:00"},
+        ])
+        self.assertEqual(data["summary_by_day"], [
+            {"date": "2025-02-05", "breakdowns_count": 1, "lost_time": "0:30:00"},
+            {"date": "2025-02-06", "breakdowns_count": 2, "lost_time": "0:45:00"},
+        ])
+        self.assertEqual(len(data["summary_by_mechanic"]), 1)
+        self.assertEqual(data["summary_by_mechanic"][0]["breakdowns_count"], 2)
+        self.assertEqual(data["summary_by_mechanic"][0]["avg_time_to_respond"], "0:15:00")
+
+    def test_filters_by_line_and_date(self):
+        client = APIClient()
+        response = client.get(
+            "/api/maintenance/breakdown-logs/total-lost-time-per-location/",
+            {"line": str(self.line_a.id), "date": "2025-02-06"},
+        )
+        data = response.data
+        self.assertEqual(data["total_lost_time"], "0:45:00")
+        self.assertEqual(data["total_machine_count"], 2)
+        self.assertEqual(data["avg_time_to_respond"], "0:20:00")
+
+    def test_start_and_end_bounds(self):
+        client = APIClient()
+        url = "/api/maintenance/breakdown-logs/total-lost-time-per-location/"
+        # A date end is inclusive
+        data = client.get(url, {"start": "2025-02-06", "end": "2025-02-06"}).data
+        self.assertEqual(data["total_lost_time"], "0:45:00")
+        self.assertEqual((data["start"], data["end"]), (
+            timezone.make_aware(datetime(2025, 2, 6)), timezone.make_aware(datetime(2025, 2, 7)),
+        ))
+        self.assertNotIn("previous_period", data)
+        # Datetimes are taken as they are, naive ones in the plant's time zone
+        self.assertEqual(client.get(url, {"start": "2025-02-05T08:00:01"}).data["total_lost_time"], "0:45:00")
+        self.assertEqual(client.get(url, {"end": "2025-02-05T08:00:01Z"}).data["total_lost_time"], "0:30:00")
+
+        for params in (
+            {"start": "yesterday"},
+            {"start": "2025-02-07", "end": "2025-02-06"},
+            {"compare": "previous_period", "start": "2025-02-06"},
+            {"compare": "last_year", "start": "2025-02-06", "end": "2025-02-06"},
+            {"compare": "previous_period", "start": "2025-02-06", "end": "2025-02-06", "date": "2025-02-06"},
+        ):
+            self.assertEqual(client.get(url, params).status_code, 400, params)
+
+    def test_previous_period(self):
+        url = "/api/maintenance/breakdown-logs/total-lost-time-per-location/"
+        params = {"start": "2025-02-06", "end": "2025-02-06", "compare": "previous_period"}
+        for enabled in (False, True):
+            with self.subTest(rollups=enabled), override_settings(BREAKDOWN_ROLLUPS_ENABLED=enabled):
+                cache.clear()
+                data = APIClient().get(url, params).data
+                self.assertEqual(data["total_lost_time"], "0:45:00")
+                previous = data["previous_period"]
+                self.assertEqual((previous["start"], previous["end"]), (
+                    timezone.make_aware(datetime(2025, 2, 5)), timezone.make_aware(datetime(2025, 2, 6)),
+                ))
+                self.assertEqual(previous["total_lost_time"], "0:30:00")
+                self.assertEqual(previous["avg_time_to_respond"], "0:10:00")
+                self.assertEqual(previous["summary_by_day"], [
+                    {"date": "2025-02-05", "breakdowns_count": 1, "lost_time": "0:30:00"},
+                ])
+
+    @override_settings(PLANT_TIME_ZONE="Asia/Dhaka")
+    def test_bounds_are_plant_days(self):
+        self.assertEqual(parse_bound("2025-02-05"), datetime(2025, 2, 4, 18, tzinfo=dt_timezone.utc))
+        self.assertEqual(parse_bound("2025-02-05", end=True), datetime(2025, 2, 5, 18, tzinfo=dt_timezone.utc))
+        self.assertEqual(parse_bound("2025-02-05T06:00"), datetime(2025, 2, 5, tzinfo=dt_timezone.utc))
+        self.assertIsNone(parse_bound("2025-02-30"))
+        start, end = parse_bound("2025-02-05"), parse_bound("2025-02-06", end=True)
+        self.assertEqual(previous_window(start, end), (start - timedelta(days=2), start))
+
+
+class MachineMonitoringBatchTests(TestCase):
+    url = "/api/maintenance/breakdown-logs/machines-monitoring-batch/"
+
+    @classmethod
+    def setUpTestData(cls):
+        company = Company.objects.create(name="Panacea")
+        cls.floor = Floor.objects.create(name="Monitoring", company=company)
+        cls.line = Line.objects.create(name="Line M", operation_type="sewing", floor=cls.floor)
+        needle = ProblemCategory.objects.create(
+            name="Needle", category_type=ProblemCategoryType.objects.create(name="Mechanical"),
+        )
+        cls.machines = [
+            Machine.objects.create(machine_id=f"M-{number}", line=cls.line, company=company) for number in range(1, 4)
+        ]
+        Machine.objects.create(machine_id="M-9", company=company)
+        now = timezone.now()
+        for machine, days, minutes, problem in (
+            (cls.machines[0], 1, 30, needle),
+            (cls.machines[0], 2, 15, None),
+            (cls.machines[1], 3, 10, needle),
+            (cls.machines[1], 10, 60, needle),  # more than a week ago
+        ):
+            BreakdownLog.objects.create(
+                machine=machine, line=cls.line, problem_category=problem,
+                breakdown_start=now - timedelta(days=days), lost_time=timedelta(minutes=minutes),
+            )
+
+    def setUp(self):
+        cache.clear()
+        references.warm()
+
+    def test_same_documents_as_one_machine_at_a_time(self):
+        client = APIClient()
+        data = client.get(self.url, {"floor": str(self.floor.pk)}).data
+        self.assertEqual(sorted(data), ["M-1", "M-2", "M-3"])
+        for machine_id, document in data.items():
+            single = client.get("/api/maintenance/breakdown-logs/machines-monitoring/", {"machine_id": machine_id}).data
+            self.assertEqual(document, single)
+
+        self.assertEqual(data["M-1"]["breakdowns-count-last-week"], 2)
+        self.assertEqual(data["M-1"]["total-lost-time-last-week"], "0:45:00")
+        self.assertEqual(data["M-2"]["breakdowns-count-last-week"], 1)
+        self.assertEqual(data["M-3"]["breakdowns-last-week"], [])
+        self.assertEqual(data["M-1"]["floor"], "Monitoring")
+        self.assertEqual(
+            {reason["problem-category"] for reason in data["M-1"]["lost-time-reasons-last-week"]}, {"Needle", None},
+        )
+
+    def test_query_count_does_not_grow_with_the_machines(self):
+        client = APIClient()
+        with self.assertNumQueries(2):
+            client.get(self.url, {"machine_id": "M-1"})
+        with self.assertNumQueries(2):
+            client.get(self.url, {"line": str(self.line.pk)})
+
+    def test_selectors(self):
+        client = APIClient()
+        self.assertEqual(client.get(self.url).status_code, 400)
+        data = client.get(self.url, {"machine_id": "M-9, M-2,M-404"}).data
+        self.assertEqual(sorted(data), ["M-2", "M-9"])
+        # Machines without a line have no floor either
+        self.assertEqual((data["M-9"]["line"], data["M-9"]["floor"]), (None, None))
+
+
+class BreakdownExportTests(TestCase):
+    url = "/api/maintenance/breakdown-logs/export/"
+
+    @classmethod
+    def setUpTestData(cls):
+        company = Company.objects.create(name="Panacea")
+        floor = Floor.objects.create(name="Export", company=company)
+        cls.line_a = Line.objects.create(name="Line A", operation_type="sewing", floor=floor)
+        line_b = Line.objects.create(name="Line B", operation_type="sewing", floor=floor)
+        mechanic = Employee.objects.create(name="Rahim", company=company)
+        m1 = Machine.objects.create(machine_id="M-1", company=company)
+        m2 = Machine.objects.create(machine_id="M-2", company=company)
+        start = timezone.make_aware(datetime(2025, 2, 5, 8, 0))
+        cls.logs = [
+            BreakdownLog.objects.create(
+                machine=m2, line=line_b, breakdown_start=start + timedelta(days=1), lost_time=timedelta(minutes=5),
+            ),
+            BreakdownLog.objects.create(
+                machine=m1, line=cls.line_a, mechanic=mechanic, breakdown_start=start,
+                lost_time=timedelta(minutes=30), comments="Needle, bent",
+            ),
+        ]
+
+    def read(self, params):
+        response = APIClient().get(self.url, params)
+        return response, b"".join(response.streaming_content).decode()
+
+    def test_csv_oldest_first_in_one_query(self):
+        with self.assertNumQueries(1):
+            response, content = self.read({})
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertTrue(response["Content-Disposition"].startswith('attachment; filename="breakdown-logs-'))
+        lines = content.splitlines()
+        self.assertEqual(lines[0], "id,machine_id,line,floor,mechanic,operator,problem_category,breakdown_start,repairing_start,lost_time,comments")
+        self.assertEqual(lines[1], f'{self.logs[1].pk},M-1,Line A,Export,Rahim,,,2025-02-05T08:00:00+00:00,,0:30:00,"Needle, bent"')
+        self.assertEqual(len(lines), 3)
+
+    def test_ndjson_with_filters(self):
+        response, content = self.read({"output": "ndjson", "start": "2025-02-06", "end": "2025-02-06"})
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([row["machine_id"] for row in rows], ["M-2"])
+        self.assertEqual(rows[0]["lost_time"], "0:05:00")
+
+        _, content = self.read({"output": "ndjson", "line": str(self.line_a.pk)})
+        self.assertEqual([json.loads(line)["id"] for line in content.splitlines()], [self.logs[1].pk])
+
+    def test_invalid_parameters(self):
+        client = APIClient()
+        self.assertEqual(client.get(self.url, {"output": "xlsx"}).status_code, 400)
+        self.assertEqual(client.get(self.url, {"start": "soon"}).status_code, 400)
+
+
+class AnalyticsCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        company = Company.objects.create(name="Panacea")
+        cls.floor_1 = Floor.objects.create(name="1", company=company)
+        cls.floor_2 = Floor.objects.create(name="2", company=company)
+        cls.line_a = Line.objects.create(name="Line A", operation_type="sewing", floor=cls.floor_1)
+        cls.line_b = Line.objects.create(name="Line B", operation_type="sewing", floor=cls.floor_2)
+        cls.m1 = Machine.objects.create(machine_id="M-1", line=cls.line_a, company=company)
+        cls.m2 = Machine.objects.create(machine_id="M-2", line=cls.line_b, company=company)
+
+    def setUp(self):
+        cache.clear()
+        self.computed = []
+
+    def get(self, name, **scopes):
+        def compute():
+            self.computed.append(name)
+            return {"name": name}
+        return analytics_cache.get_or_compute("test", {"name": name}, analytics_cache.scopes_for(**scopes), compute)
+
+    def get_all(self):
+        self.computed = []
+        self.get("plant")
+        self.get("floor 1", floors=[self.floor_1.pk])
+        self.get("floor 2", floors=[self.floor_2.pk])
+        self.get("line A", lines=[self.line_a.pk])
+        self.get("line B", lines=[self.line_b.pk])
+        self.get("M-1", machines=[self.m1.pk])
+        self.get("M-2", machines=[self.m2.pk])
+        return self.computed
+
+    def test_hits_and_misses(self):
+        self.assertEqual(self.get("plant"), {"name": "plant"})
+        self.assertEqual(self.get("plant"), {"name": "plant"})
+        self.assertEqual(self.computed, ["plant"])
+        self.assertEqual(analytics_cache.stats(), {"hits": 1, "misses": 1, "hit_ratio": 0.5})
+
+        response = APIClient().get("/api/maintenance/breakdown-logs/analytics-cache-stats/")
+        self.assertEqual(response.data["hits"], 1)
+
+    @override_settings(MAINTENANCE_ANALYTICS_CACHE={"TTL": 60})
+    def test_entries_expire_after_the_ttl(self):
+        self.get("plant")
+        now = time.time()
+        with mock.patch("django.core.cache.backends.locmem.time.time", return_value=now + 59):
+            self.get("plant")
+        with mock.patch("django.core.cache.backends.locmem.time.time", return_value=now + 61):
+            self.get("plant")
+        self.assertEqual(self.computed, ["plant", "plant"])
+
+    def test_breakdown_writes_only_invalidate_their_own_scopes(self):
+        self.get_all()
+        log = BreakdownLog.objects.create(
+            machine=self.m1, line=self.line_a, breakdown_start=timezone.now(), lost_time=timedelta(minutes=5),
+        )
+        self.assertEqual(self.get_all(), ["plant", "floor 1", "line A", "M-1"])
+        self.assertEqual(self.get_all(), [])
+
+        # Moving the breakdown touches the line and floor it left too
+        log.line = self.line_b
+        log.save()
+        self.assertEqual(self.get_all(), ["plant", "floor 1", "floor 2", "line A", "line B", "M-1"])
+
+        log.delete()
+        self.assertEqual(self.get_all(), ["plant", "floor 2", "line B", "M-1"])
+
+
+SHARED_VERSIONS = {
+    "CACHES": {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "shared": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": os.path.join(tempfile.gettempdir(), "fasttracker-version-tests"),
+        },
+    },
+    "MODEL_VERSIONS": {"ALIAS": "shared"},
+}
+
+
+@override_settings(**SHARED_VERSIONS)
+class ConditionalGetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(name="Panacea")
+        cls.brand = Brand.objects.create(name="Juki", company=cls.company)
+        cls.type = Type.objects.create(name="Lockstitch", company=cls.company)
+
+    def setUp(self):
+        caches["shared"].clear()
+
+    def assert_revalidated(self, url, write):
+        client = APIClient()
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        with self.assertNumQueries(0):
+            self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            write()
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_brands(self):
+        self.assert_revalidated(
+            "/api/maintenance/brand/",
+            lambda: APIClient().patch(f"/api/maintenance/brand/{self.brand.pk}/", {"name": "Brother"}),
+        )
+
+    def test_types(self):
+        self.assert_revalidated(
+            f"/api/maintenance/type/{self.type.pk}/",
+            lambda: Type.objects.create(name="Overlock", company=self.company),
+        )
+
+    @override_settings(MODEL_VERSIONS={"ALIAS": "default"})
+    def test_local_memory_versions_are_not_used(self):
+        client = APIClient()
+        response = client.get("/api/maintenance/brand/")
+        self.assertNotIn("ETag", response)
+        self.assertEqual(client.get("/api/maintenance/brand/", HTTP_IF_NONE_MATCH="*").status_code, 200)
+
+
+class ReferenceRegistryTests(TestCase):
+
+    def setUp(self):
+        references.clear()
+
+    def test_names_without_queries_and_reload_on_change(self):
+        company = Company.objects.create(name="Panacea")
+        floor = Floor.objects.create(name="1", company=company)
+        line = Line.objects.create(name="Line A", operation_type="sewing", floor=floor)
+        references.warm()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(references.name("line", line.pk), "Line A")
+            self.assertEqual(references.name("floor", references.get("line", line.pk)["floor_id"]), "1")
+            self.assertIsNone(references.name("line", None))
+
+        line.name = "Line B"
+        line.save()
+        self.assertEqual(references.name("line", line.pk), "Line B")
+        self.assertGreater(references.stats()["hits"], 0)
+
+    @override_settings(REFERENCE_REGISTRY={"REFRESH_SECONDS": 60})
+    def test_rows_from_other_processes_are_found_on_a_miss(self):
+        company = Company.objects.create(name="Panacea")
+        floor = Floor.objects.create(name="1", company=company)
+        references.warm()
+        # Another process adds a line: no signal here, no version bump
+        Line.objects.bulk_create([Line(name="Line A", operation_type="sewing", floor=floor)])
+        line_pk = Line.objects.get(name="Line A").pk
+
+        self.assertEqual(references.name("line", line_pk), "Line A")
+        # Unknown ids reload the table at most once per REFRESH_SECONDS
+        with self.assertNumQueries(0):
+            self.assertIsNone(references.name("line", line_pk + 1))
+            self.assertIsNone(references.name("line", line_pk + 2))
+
+
+class CompanyScopingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.own, cls.other = Company.objects.create(name="Panacea"), Company.objects.create(name="Other")
+        cls.machines = {}
+        for company in (cls.own, cls.other):
+            floor = Floor.objects.create(name=company.name, company=company)
+            line = Line.objects.create(name=f"{company.name} A", operation_type="sewing", floor=floor)
+            machine = Machine.objects.create(machine_id=f"M-{company.pk}", line=line, company=company)
+            cls.machines[company.pk] = machine
+            BreakdownLog.objects.create(
+                machine=machine, line=line, breakdown_start=timezone.now(), lost_time=timedelta(minutes=10),
+            )
+        user = User.objects.create_user(username="rahim", password="secret")
+        Employee.objects.create(user=user, name="Rahim", company=cls.own)
+        cls.token = Token.objects.create(user=user)
+
+    def setUp(self):
+        cache.clear()
+        tokens.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+    def test_employees_only_see_their_company(self):
+        machines = self.client.get("/api/maintenance/machines/").data
+        self.assertEqual([machine["machine_id"] for machine in machines], [f"M-{self.own.pk}"])
+        self.assertEqual(len(self.client.get("/api/maintenance/breakdown-logs/").data), 1)
+        # The cached dashboard is per company
+        url = "/api/maintenance/breakdown-logs/total-lost-time-per-location/"
+        self.assertEqual(self.client.get(url).data["total_lost_time"], "0:10:00")
+        self.assertEqual(APIClient().get(url).data["total_lost_time"], "0:20:00")
+
+    def test_writes_cannot_point_at_another_company(self):
+        own_machine, other_machine = self.machines[self.own.pk], self.machines[self.other.pk]
+        response = self.client.post("/api/maintenance/breakdown-logs/", {
+            "machine": other_machine.pk, "breakdown_start": timezone.now().isoformat(), "lost_time": "00:10:00",
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("machine", response.data)
+
+        response = self.client.patch(f"/api/maintenance/machines/{own_machine.pk}/", {"line": other_machine.line_id})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("line", response.data)
+        response = self.client.post("/api/production/lineslist/", {
+            "name": "Line Z", "operation_type": "sewing", "floor": other_machine.line.floor_id,
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(BreakdownLog.objects.count(), 2)
+        self.assertFalse(Line.objects.filter(name="Line Z").exists())
+
+        # Own rows are fine, and the company is filled in
+        response = self.client.post("/api/maintenance/machines/", {
+            "machine_id": "M-new", "line": own_machine.line_id, "company": self.other.pk,
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Machine.objects.get(machine_id="M-new").company_id, self.own.pk)
+
+    async def test_live_stream_is_scoped_by_token(self):
+        headers = {"Authorization": f"Token {self.token.key}"}
+        client = AsyncClient()
+        response = await client.get(f"/api/maintenance/live/?company={self.other.pk}", headers=headers)
+        self.assertEqual(response.status_code, 403)
+        response = await client.get("/api/maintenance/live/", headers={"Authorization": "Token nope"})
+        self.assertEqual(response.status_code, 401)
+
+        response = await client.get("/api/maintenance/live/", headers=headers)
+        stream = aiter(response.streaming_content)
+        await anext(stream)  # retry:
+        snapshot = (await anext(stream)).decode()
+        await stream.aclose()
+        self.assertIn(f'"M-{self.own.pk}"', snapshot)
+        self.assertNotIn(f'"M-{self.other.pk}"', snapshot)
+
+
+class LiveEventTests(TestCase):
+
+    def event(self, company=1, floor=1, line=1, **fields):
+        return {"type": "machine_status", "company": company, "floor": floor, "line": line, **fields}
+
+    def test_matches(self):
+        self.assertTrue(live.matches()(self.event()))
+        match = live.matches(companies={1}, floors={2})
+        self.assertTrue(match(self.event(floor=2)))
+        self.assertFalse(match(self.event(floor=3)))
+        self.assertFalse(match(self.event(company=2, floor=2)))
+        self.assertTrue(live.matches(lines={4, 5})(self.event(line=5)))
+        self.assertFalse(live.matches(lines={4, 5})(self.event(line=None)))
+
+    async def test_subscribers_only_get_matching_events(self):
+        broadcaster = InProcessBroadcaster()
+        own = broadcaster.subscribe(live.matches(companies={1}))
+        everything = broadcaster.subscribe()
+        for company in (2, 1):
+            # Published from a worker thread, as signal handlers do
+            await asyncio.to_thread(broadcaster.publish, self.event(company=company))
+
+        self.assertEqual((await own.get(timeout=1))["company"], 1)
+        self.assertIsNone(await own.get(timeout=0.01))
+        self.assertEqual([(await everything.get(timeout=1))["company"] for _ in range(2)], [2, 1])
+
+        broadcaster.unsubscribe(own)
+        broadcaster.publish(self.event())
+        await asyncio.sleep(0)
+        self.assertTrue(own.queue.empty())
+        self.assertEqual(broadcaster.stats(), {"subscribers": 1, "dropped": 0})
+
+    async def test_full_queues_drop_the_oldest_events(self):
+        broadcaster = InProcessBroadcaster(queue_size=2)
+        subscription = broadcaster.subscribe()
+        for number in range(3):
+            broadcaster.publish(self.event(number=number))
+        await asyncio.sleep(0)
+        self.assertEqual([(await subscription.get(timeout=1))["number"] for _ in range(2)], [1, 2])
+        self.assertEqual(broadcaster.stats()["dropped"], 1)
+
+    def test_subscriptions_of_closed_loops_are_dropped(self):
+        broadcaster = InProcessBroadcaster()
+
+        async def subscribe():
+            return broadcaster.subscribe()
+
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(subscribe())
+        loop.close()
+        broadcaster.publish(self.event())
+        self.assertEqual(broadcaster.stats()["subscribers"], 0)
+
+    async def test_stream_unsubscribes_on_disconnect(self):
+        subscribers = get_broadcaster().stats()["subscribers"]
+        response = await AsyncClient().get("/api/maintenance/live/?company=1")
+        self.assertEqual(get_broadcaster().stats()["subscribers"], subscribers + 1)
+        stream = aiter(response.streaming_content)
+        await anext(stream)  # retry:
+        self.assertTrue((await anext(stream)).startswith(b"event: snapshot"))
+
+        publish(self.event(company=2, machine_id="M-2"))
+        publish(self.event(company=1, machine_id="M-1"))
+        message = (await anext(stream)).decode()
+        self.assertTrue(message.startswith("event: machine_status"))
+        self.assertIn('"M-1"', message)
+
+        # A client disconnecting cancels the task sending the response
+        waiting = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        self.assertEqual(get_broadcaster().stats()["subscribers"], subscribers)
+
+
+class MachineSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        company = Company.objects.create(name="Panacea")
+        cls.floor = Floor.objects.create(name="Knitting", company=company)
+        line = Line.objects.create(name="Line 9", operation_type="sewing", floor=cls.floor)
+        cls.brand = Brand.objects.create(name="Juki", company=company)
+        cls.mechanic = Employee.objects.create(name="Rahim", company=company)
+        cls.machine = Machine.objects.create(
+            machine_id="M-1", brand=cls.brand, line=line, mechanic=cls.mechanic, company=company,
+        )
+        cls.other = Machine.objects.create(machine_id="M-2", company=company)
+
+    def found(self, query):
+        return list(search_machines(Machine.objects.order_by("machine_id"), query).values_list("machine_id", flat=True))
+
+    def test_every_term_must_match(self):
+        self.assertEqual(self.found("juki m-1"), ["M-1"])
+        self.assertEqual(self.found("KNITTING rahim"), ["M-1"])
+        self.assertEqual(self.found("m-"), ["M-1", "M-2"])
+        self.assertEqual(self.found("juki m-2"), [])
+        data = APIClient().get("/api/maintenance/machinepagination/", {"search": "line 9"}).data
+        self.assertEqual([machine["machine_id"] for machine in data["results"]], ["M-1"])
+
+    def test_renames_refresh_the_documents(self):
+        self.machine.machine_id = "SEW-1"
+        self.machine.save()
+        self.assertEqual(self.found("sew-1"), ["SEW-1"])
+
+        self.brand.name = "Brother"
+        self.brand.save()
+        self.assertEqual(self.found("brother"), ["SEW-1"])
+        self.assertEqual(self.found("juki"), [])
+
+        # Two relations away
+        self.floor.name = "Finishing"
+        self.floor.save()
+        self.assertEqual(self.found("finishing"), ["SEW-1"])
+        self.assertEqual(self.found("knitting"), [])
+
+    def test_only_searched_fields_refresh_the_document(self):
+        machine = Machine.objects.get(pk=self.machine.pk)
+        machine.save()
+        with mock.patch("maintenance.search.refresh_documents", wraps=refresh_documents) as refresh:
+            machine.save()
+            machine.last_breakdown_start = timezone.now()
+            machine.model_number = "DDL-900"
+            machine.save(update_fields=["last_breakdown_start"])
+            refresh.assert_not_called()
+            machine.save(update_fields=["model_number"])
+            refresh.assert_called_once()
+        self.assertEqual(self.found("ddl-900"), ["M-1"])
+
+    def test_deleted_names_are_removed(self):
+        self.mechanic.delete()
+        self.assertEqual(self.found("rahim"), [])
+        self.assertEqual(self.found("juki"), ["M-1"])
+
+    def test_rebuild_command(self):
+        Machine.objects.filter(pk=self.other.pk).update(machine_id="M-22")
+        self.assertEqual(self.found("m-22"), [])
+        output = io.StringIO()
+        call_command("rebuild_machine_search", stdout=output)
+        self.assertIn("Rebuilt 2 machine search documents.", output.getvalue())
+        self.assertEqual(self.found("m-22"), ["M-22"])
+
+
+class StatusChangeTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(name="Panacea")
+        Machine.objects.create(machine_id="M-1", company=cls.company)
+
+    def setUp(self):
+        self.changes = []
+        machine_status_changed.connect(self.record, sender=Machine)
+        self.addCleanup(machine_status_changed.disconnect, self.record, sender=Machine)
+
+    def record(self, sender, machine, old_status, new_status, **kwargs):
+        self.changes.append((machine.machine_id, old_status, new_status))
+
+    def test_loaded_machines_are_not_read_again_before_saving(self):
+        machine = Machine.objects.get(machine_id="M-1")
+        machine.status = "broken"
+        with CaptureQueriesContext(connection) as queries:
+            machine.save()
+        self.assertTrue(queries[0]["sql"].startswith('UPDATE "maintenance_machine"'), queries[0]["sql"])
+
+        # The saved values are the ones the next save compares against
+        machine.status = "maintenance"
+        machine.save()
+        machine.model_number = "DDL-8700"
+        machine.save()
+        self.assertEqual(self.changes, [("M-1", "active", "broken"), ("M-1", "broken", "maintenance")])
+
+    def test_unloaded_and_deferred_machines_read_the_stored_status(self):
+        pk = Machine.objects.get(machine_id="M-1").pk
+        Machine(pk=pk, machine_id="M-1", status="broken", company=self.company).save()
+        machine = Machine.objects.only("machine_id").get(pk=pk)
+        machine.status = "inactive"
+        machine.save()
+        self.assertEqual(self.changes, [("M-1", "active", "broken"), ("M-1", "broken", "inactive")])
+
+    def test_new_machines_announce_nothing(self):
+        Machine.objects.create(machine_id="M-2", status="broken", company=self.company)
+        self.assertEqual(self.changes, [])
+
+
+class ProblemTreeTests(TestCase):
+    url = "/api/maintenance/problem-category-type/tree/"
+
+    @classmethod
+    def setUpTestData(cls):
+        mechanical = ProblemCategoryType.objects.create(name="Mechanical")
+        electrical = ProblemCategoryType.objects.create(name="Electrical")
+        ProblemCategoryType.objects.create(name="Unused")
+        cls.needle = ProblemCategory.objects.create(name="Needle", category_type=mechanical)
+        belt = ProblemCategory.objects.create(name="Belt", category_type=mechanical, severity="major")
+        motor = ProblemCategory.objects.create(name="Motor", category_type=electrical)
+        machine = Machine.objects.create(machine_id="M-1", company=Company.objects.create(name="Panacea"))
+        now = timezone.now()
+        for problem, days in ((motor, 1), (motor, 2), (motor, 90), (belt, 3), (belt, 60)):
+            BreakdownLog.objects.create(
+                machine=machine, problem_category=problem,
+                breakdown_start=now - timedelta(days=days), lost_time=timedelta(minutes=5),
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_built_in_two_queries_then_cached(self):
+        client = APIClient()
+        with self.assertNumQueries(2):
+            response = client.get(self.url)
+        with self.assertNumQueries(0):
+            cached = client.get(self.url)
+        self.assertEqual(cached.data, response.data)
+
+        tree = response.data
+        self.assertEqual([problem_type["name"] for problem_type in tree], ["Electrical", "Mechanical", "Unused"])
+        self.assertEqual([problem_type["usage_count"] for problem_type in tree], [3, 2, 0])
+        self.assertEqual(
+            [(category["name"], category["severity"], category["usage_count"], category["recent_usage_count"])
+             for category in tree[1]["categories"]],
+            [("Belt", "major", 2, 1), ("Needle", "minor", 0, 0)],
+        )
+        self.assertEqual(tree[2]["categories"], [])
+
+        self.assertEqual(client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+
+    def test_rebuilt_when_a_category_changes(self):
+        client = APIClient()
+        etag = client.get(self.url)["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.needle.name = "Needle broken"
+            self.needle.save()
+        response = client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        mechanical = next(problem_type for problem_type in response.data if problem_type["name"] == "Mechanical")
+        self.assertIn("Needle broken", [category["name"] for category in mechanical["categories"]])
+
+    @override_settings(PROBLEM_TREE={"TTL": 60})
+    def test_usage_counts_refresh_after_the_ttl(self):
+        APIClient().get(self.url)
+        now = time.time()
+        with mock.patch("django.core.cache.backends.locmem.time.time", return_value=now + 61):
+            with self.assertNumQueries(2):
+                APIClient().get(self.url)
+
+
+class FailingTransport:
+
+    def send(self, notifications):
+        return ["unavailable"] * len(notifications)
+
+
+@override_settings(NOTIFICATIONS={
+    "TRANSPORT": "maintenance.notifications.LocalTransport",
+    "DEFAULT_TOPIC": "all",
+    "MAX_ATTEMPTS": 3,
+    "BACKOFF_SECONDS": 30,
+})
+class NotificationOutboxTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        company = Company.objects.create(name="Panacea")
+        floor = Floor.objects.create(name="Outbox", company=company)
+        line = Line.objects.create(name="A", operation_type="sewing", floor=floor)
+        cls.machine = Machine.objects.create(machine_id="M-1", line=line, company=company)
+
+    def setUp(self):
+        cache.clear()
+        notifications.LocalTransport.sent = []
+
+    def make_due(self):
+        NotificationOutbox.objects.update(available_at=timezone.now() - timedelta(seconds=1))
+
+    def test_status_changes_are_queued_with_their_transaction(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self.machine.status = "broken"
+                self.machine.save()
+                raise RuntimeError
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+        machine = Machine.objects.get(pk=self.machine.pk)
+        machine.status = "broken"
+        machine.save()
+        notification = NotificationOutbox.objects.get()
+        self.assertEqual(notification.status, "pending")
+        self.assertEqual(notification.topic, "mechanics")
+        # Held back for the debounce window, nothing is sent yet
+        self.assertGreater(notification.available_at, timezone.now())
+        self.assertEqual(notifications.deliver_pending(), (0, 0, 0))
+        self.assertEqual(notifications.LocalTransport.sent, [])
+
+    def test_claimed_notifications_are_hidden_from_other_workers(self):
+        notification = notifications.enqueue("Title", "Body")
+        before = timezone.now()
+        self.assertEqual(notifications.claim(10), [notification])
+        claimed_until = NotificationOutbox.objects.get(pk=notification.pk).claimed_until
+        self.assertGreaterEqual(claimed_until, before + timedelta(seconds=300))
+        self.assertEqual(notifications.claim(10), [])
+
+        # An expired claim (the worker died) makes it available again
+        NotificationOutbox.objects.update(claimed_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(notifications.claim(10), [notification])
+
+    def test_failures_back_off_until_max_attempts(self):
+        notification = notifications.enqueue("Title", "Body")
+        for attempt, delay in ((1, 30), (2, 60)):
+            before = timezone.now()
+            self.assertEqual(notifications.deliver_pending(transport=FailingTransport()), (0, 1, 0))
+            notification.refresh_from_db()
+            self.assertEqual(notification.status, "pending")
+            self.assertEqual(notification.attempts, attempt)
+            self.assertEqual(notification.last_error, "unavailable")
+            self.assertIsNone(notification.claimed_until)
+            self.assertGreaterEqual(notification.available_at, before + timedelta(seconds=delay))
+            self.assertLessEqual(notification.available_at, timezone.now() + timedelta(seconds=delay))
+            # Not retried before its backoff is over
+            self.assertEqual(notifications.deliver_pending(transport=FailingTransport()), (0, 0, 0))
+            self.make_due()
+
+        self.assertEqual(notifications.deliver_pending(transport=FailingTransport()), (0, 0, 1))
+        notification.refresh_from_db()
+        self.assertEqual((notification.status, notification.attempts), ("failed", 3))
+        self.assertEqual(notifications.stats()["failed"], 1)
+
+    def test_delivered_notifications_are_counted(self):
+        notifications.enqueue("First", "Body")
+        notifications.enqueue("Second", "Body", topic="mechanics")
+        self.assertEqual(notifications.stats()["pending"], 2)
+
+        self.assertEqual(notifications.deliver_pending(batch_size=1), (2, 0, 0))
+        self.assertEqual(
+            sorted((message["topic"], message["title"]) for message in notifications.LocalTransport.sent),
+            [("all", "First"), ("mechanics", "Second")],
+        )
+        self.assertFalse(NotificationOutbox.objects.exclude(status="sent").exists())
+        self.assertFalse(NotificationOutbox.objects.filter(sent_at__isnull=True).exists())
+        stats = notifications.stats()
+        self.assertEqual((stats["queued"], stats["delivered"], stats["failed"], stats["pending"]), (2, 2, 0, 0))
+
+
+@override_settings(NOTIFICATIONS={
+    "TRANSPORT": "maintenance.notifications.LocalTransport",
+    "DEFAULT_TOPIC": "all",
+    "LINE_WINDOW_SECONDS": 30,
+    "TOPIC_RATES": {"mechanics": (1, 3600)},
+})
+class NotificationCoalescingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        company = Company.objects.create(name="Panacea")
+        floor = Floor.objects.create(name="Coalescing", company=company)
+        line = Line.objects.create(name="4", operation_type="sewing", floor=floor)
+        cls.machines = [
+            Machine.objects.create(machine_id=f"M-{number}", line=line, company=company) for number in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        notifications.LocalTransport.sent = []
+
+    def change(self, machine, status):
+        machine = Machine.objects.get(pk=machine.pk)
+        machine.status = status
+        machine.save()
+
+    def test_changes_on_a_line_within_the_window_make_one_digest(self):
+        for machine in self.machines:
+            self.change(machine, "broken")
+        # Back and forth on one machine merges into its entry
+        self.change(self.machines[0], "active")
+        self.change(self.machines[0], "broken")
+
+        notification = NotificationOutbox.objects.get()
+        self.assertEqual([event["machine_id"] for event in notification.events], ["M-0", "M-1", "M-2"])
+        self.assertEqual([event["changes"] for event in notification.events], [3, 1, 1])
+        self.assertEqual(notification.title, "Line 4: 3 machines broken")
+        self.assertEqual(notification.topic, "mechanics")
+        stats = notifications.stats()
+        self.assertEqual((stats["queued"], stats["suppressed"]), (5, 4))
+
+    def test_a_topic_over_its_rate_waits_for_the_next_period(self):
+        first = notifications.enqueue("First", "Body", topic="mechanics")
+        second = notifications.enqueue("Second", "Body", topic="mechanics")
+        other = notifications.enqueue("Other", "Body")
+        now = timezone.now()
+
+        self.assertEqual(notifications.deliver_pending(), (2, 0, 0))
+        self.assertEqual(sorted(message["title"] for message in notifications.LocalTransport.sent), ["First", "Other"])
+        for notification in (first, second, other):
+            notification.refresh_from_db()
+        self.assertEqual((first.status, second.status, other.status), ("sent", "pending", "sent"))
+        # Deferred to the start of the next hour, without using up an attempt
+        next_period = datetime.fromtimestamp((int(now.timestamp()) // 3600 + 1) * 3600, tz=dt_timezone.utc)
+        self.assertEqual(second.available_at, next_period)
+        self.assertEqual(second.attempts, 0)
+        self.assertIsNone(second.claimed_until)
+        self.assertEqual(notifications.stats()["rate_limited"], 1)
+
+    def test_recently_notified_machines_wait_out_their_window(self):
+        self.change(self.machines[0], "broken")
+        NotificationOutbox.objects.update(available_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(notifications.deliver_pending(), (1, 0, 0))
+        sent_at = NotificationOutbox.objects.get().sent_at
+        # The web process shares nothing with the delivery process but the outbox
+        cache.clear()
+
+        self.change(self.machines[0], "active")
+        notification = NotificationOutbox.objects.get(status="pending")
+        self.assertEqual(notification.available_at, sent_at + timedelta(seconds=120))
+
+    def test_counters_come_from_the_outbox(self):
+        for machine in self.machines:
+            self.change(machine, "broken")
+        notifications.enqueue("Plain", "Body")
+        NotificationOutbox.objects.update(available_at=timezone.now() - timedelta(seconds=1))
+        notifications.deliver_pending()
+        cache.clear()
+        self.assertEqual(notifications.stats(), {
+            "queued": 4, "suppressed": 2, "delivered": 2, "rate_limited": 0, "failed": 0, "pending": 0,
+        })
+
+
+@override_settings(NOTIFICATIONS={"TRANSPORT": "maintenance.notifications.LocalTransport", "DEFAULT_TOPIC": "all"})
+class BulkTransitionTests(TestCase):
+    url = "/api/maintenance/machines/bulk-transition/"
+
+    @classmethod
+    def setUpTestData(cls):
+        company = Company.objects.create(name="Panacea")
+        cls.floor = Floor.objects.create(name="Transitions", company=company)
+        cls.line = Line.objects.create(name="7", operation_type="sewing", floor=cls.floor)
+        cls.mechanic = Employee.objects.create(name="Rahim", company=company)
+        cls.needle = ProblemCategory.objects.create(
+            name="Needle", category_type=ProblemCategoryType.objects.create(name="Mechanical"),
+        )
+        now = timezone.now()
+        cls.running = Machine.objects.create(machine_id="M-1", line=cls.line, company=company)
+        cls.broken = Machine.objects.create(
+            machine_id="M-2", line=cls.line, company=company, status="broken", mechanic=cls.mechanic,
+            last_problem="Needle", last_breakdown_start=now - timedelta(hours=2),
+        )
+        cls.repairing = Machine.objects.create(
+            machine_id="M-3", line=cls.line, company=company, status="maintenance",
+            last_breakdown_start=now - timedelta(hours=3), last_repairing_start=now - timedelta(hours=1),
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def transition(self, data):
+        with mock.patch("maintenance.live.publish") as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = APIClient().post(self.url, data, format="json")
+        return response, [call.args[0] for call in publish.call_args_list]
+
+    def test_broken_machines_are_stamped(self):
+        before = timezone.now()
+        response, events = self.transition({"status": "broken", "floor": [self.floor.pk], "last_problem": "Belt"})
+        self.assertEqual(response.status_code, 200)
+        # Already broken machines are left alone
+        self.assertEqual(sorted(response.data["machine_ids"]), ["M-1", "M-3"])
+        self.assertEqual(response.data["breakdown_logs"], [])
+
+        for machine in Machine.objects.filter(machine_id__in=["M-1", "M-3"]):
+            self.assertEqual((machine.status, machine.last_problem), ("broken", "Belt"))
+            self.assertGreaterEqual(machine.last_breakdown_start, before)
+            self.assertIsNone(machine.last_repairing_start)
+        self.assertEqual(Machine.objects.get(pk=self.broken.pk).last_problem, "Needle")
+
+        notification = NotificationOutbox.objects.get()
+        self.assertEqual(notification.title, "Line 7: 2 machines broken")
+        self.assertEqual(
+            sorted((event["type"], event["machine_id"]) for event in events),
+            [("machine_status", "M-1"), ("machine_status", "M-3")],
+        )
+
+    def test_repaired_machines_get_breakdown_logs(self):
+        before = timezone.now()
+        response, events = self.transition({"status": "active", "machine_ids": ["M-1", "M-2", "M-3"]})
+        self.assertEqual(sorted(response.data["machine_ids"]), ["M-2", "M-3"])
+
+        logs = {log.machine_id: log for log in BreakdownLog.objects.all()}
+        self.assertEqual(sorted(logs), [self.broken.pk, self.repairing.pk])
+        self.assertEqual(sorted(response.data["breakdown_logs"]), sorted(log.pk for log in logs.values()))
+        log = logs[self.broken.pk]
+        self.assertEqual((log.problem_category_id, log.mechanic_id, log.line_id), (self.needle.pk, self.mechanic.pk, self.line.pk))
+        self.assertEqual(log.breakdown_start, self.broken.last_breakdown_start)
+        self.assertGreaterEqual(log.lost_time, before - self.broken.last_breakdown_start)
+        self.assertEqual(logs[self.repairing.pk].repairing_start, self.repairing.last_repairing_start)
+        self.assertEqual(
+            sum(measures["breakdown_count"] for measures in _rollup_totals().values()), 2,
+        )
+
+        self.assertEqual(NotificationOutbox.objects.count(), 1)
+        self.assertEqual(
+            sorted((event["type"], event["machine_id"]) for event in events),
+            [("breakdown", "M-2"), ("breakdown", "M-3"), ("machine_status", "M-2"), ("machine_status", "M-3")],
+        )
+
+    def test_nothing_to_change(self):
+        response, events = self.transition({"status": "active", "machine_ids": ["M-1"]})
+        self.assertEqual(response.data["changed"], 0)
+        self.assertEqual(events, [])
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+    def test_invalid_requests(self):
+        client = APIClient()
+        self.assertEqual(client.post(self.url, {"status": "gone", "machine_ids": ["M-1"]}, format="json").status_code, 400)
+        self.assertEqual(client.post(self.url, {"status": "broken"}, format="json").status_code, 400)
+        self.assertEqual(client.post(self.url, {"status": "broken", "line": self.line.pk}, format="json").status_code, 400)
+        self.assertEqual(Machine.objects.filter(status="broken").count(), 1)
+
+
+class ImportReferenceTests(TestCase):
+
+    def test_created_references_reach_the_registry_and_etags(self):
+        company = Company.objects.create(name="Panacea")
+        cache.clear()
+        references.clear()
+        self.assertEqual(references.names("brand"), {})
+        token, _ = versioning.versions([Brand])
+
+        sheet = io.BytesIO(b"machine_id,brand\nM-1,Juki\n")
+        with self.captureOnCommitCallbacks(execute=True):
+            report = imports.import_machines(sheet, "machines.csv", company)
+        self.assertEqual(report["created_references"], {"brand": ["Juki"]})
+
+        brand = Brand.objects.get(name="Juki")
+        self.assertEqual(references.name("brand", brand.pk), "Juki")
+        self.assertNotEqual(versioning.versions([Brand])[0], token)
+
+
+class MachineImportTests(TestCase):
+    url = "/api/maintenance/machines/import/"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company, cls.other = Company.objects.create(name="Panacea"), Company.objects.create(name="Other")
+        floor = Floor.objects.create(name="Import", company=cls.company)
+        cls.line = Line.objects.create(name="Line 1", operation_type="sewing", floor=floor)
+        cls.mechanic = Employee.objects.create(name="Rahim", employee_id="E-7", company=cls.company)
+        cls.existing = Machine.objects.create(machine_id="M-OLD", model_number="old", status="broken", company=cls.company)
+        cls.foreign = Machine.objects.create(machine_id="F-1", model_number="theirs", company=cls.other)
+
+    def setUp(self):
+        cache.clear()
+
+    def upload(self, *rows, dry_run=False):
+        sheet = SimpleUploadedFile("machines.csv", "\n".join(rows).encode())
+        params = f"?company={self.company.pk}" + ("&dry_run=true" if dry_run else "")
+        response = APIClient().post(self.url + params, {"file": sheet}, format="multipart")
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_csv_creates_and_updates_machines(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            report = self.upload(
+                "machine_id,model_number,sequence,brand,floor,line,mechanic",
+                "M-NEW,JK-8700,1,Juki,Import,Line 1,E-7",
+                "M-OLD,DDL-900,2,juki,Import,Line 1,",
+            )
+        self.assertEqual((report["created"], report["updated"], report["imported"]), (1, 1, 2))
+        self.assertEqual((report["created_references"], report["errors"]), ({"brand": ["Juki"]}, []))
+
+        brand = Brand.objects.get(company=self.company)
+        created = Machine.objects.get(machine_id="M-NEW")
+        self.assertEqual(
+            (created.company, created.brand, created.line, created.mechanic, created.sequence, created.status),
+            (self.company, brand, self.line, self.mechanic, 1, "active"),
+        )
+        updated = Machine.objects.get(pk=self.existing.pk)
+        self.assertEqual((updated.model_number, updated.brand, updated.mechanic), ("DDL-900", brand, None))
+        # Status changes go through bulk-transition, not the import
+        self.assertEqual(updated.status, "broken")
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        report = self.upload(
+            "machine_id,model_number,sequence,status,line",
+            "M-1,JK-8700,1,active,Line 1",
+            "M-2,,40000,,",
+            f"M-3,{'x' * 256},,,",
+            "M-4,,,exploded,Nowhere",
+            ",JK-8700,,,",
+            "M-1,,,,",
+        )
+        self.assertEqual(report["created"], 1)
+        self.assertEqual(
+            [(error["row"], error["machine_id"], error["errors"]) for error in report["errors"]],
+            [
+                (3, "M-2", ["sequence must be between -32768 and 32767, got '40000'"]),
+                (4, "M-3", ["model_number is longer than 255 characters"]),
+                (5, "M-4", [
+                    "status must be one of active, broken, inactive, maintenance, got 'exploded'",
+                    "line 'Nowhere' not found",
+                ]),
+                (6, None, ["machine_id is required"]),
+                (7, "M-1", ["machine_id already used on row 2"]),
+            ],
+        )
+        self.assertEqual(
+            sorted(Machine.objects.filter(company=self.company).values_list("machine_id", flat=True)), ["M-1", "M-OLD"],
+        )
+
+    def test_machines_of_another_company_are_left_alone(self):
+        report = self.upload("machine_id,model_number", "F-1,mine now")
+        self.assertEqual((report["created"], report["updated"]), (0, 0))
+        self.assertEqual(
+            report["errors"], [{"row": 2, "machine_id": "F-1", "errors": ["machine_id belongs to another company"]}],
+        )
+        self.assertEqual(Machine.objects.get(pk=self.foreign.pk).model_number, "theirs")
+
+    def test_dry_run_writes_nothing(self):
+        report = self.upload("machine_id,brand", "M-NEW,Juki", "M-OLD,Juki", dry_run=True)
+        self.assertEqual((report["created"], report["updated"]), (1, 1))
+        self.assertEqual(report["created_references"], {"brand": ["Juki"]})
+        self.assertFalse(Machine.objects.filter(machine_id="M-NEW").exists())
+        self.assertFalse(Brand.objects.exists())
+        self.assertIsNone(Machine.objects.get(pk=self.existing.pk).brand)
+
+    @skipUnless(importlib.util.find_spec("openpyxl"), "openpyxl is not installed")
+    def test_xlsx_is_read_like_csv(self):
+        from openpyxl import Workbook
+
+        workbook = Workbook()
+        workbook.active.append(["Machine ID", "Model Number", "Sequence", "Purchase Date", "Line"])
+        workbook.active.append(["M-NEW", "JK-8700", 3, datetime(2024, 5, 1), "Line 1"])
+        workbook.active.append([None, None, None, None, None])
+        workbook.active.append(["M-OLD", 900, None, None, None])
+        data = io.BytesIO()
+        workbook.save(data)
+
+        sheet = SimpleUploadedFile("machines.xlsx", data.getvalue())
+        response = APIClient().post(f"{self.url}?company={self.company.pk}", {"file": sheet}, format="multipart")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data["created"], response.data["updated"], response.data["errors"]), (1, 1, []))
+        created = Machine.objects.get(machine_id="M-NEW")
+        self.assertEqual(
+            (created.model_number, created.sequence, created.purchase_date, created.line),
+            ("JK-8700", 3, datetime(2024, 5, 1).date(), self.line),
+        )
+        self.assertEqual(Machine.objects.get(pk=self.existing.pk).model_number, "900")
+
+
+MEASURES = ("breakdown_count", "lost_time", "response_count", "response_lost_time", "response_time", "parts_cost")
+
+
+def _rollup_totals():
+    """{rollup key: measures}, summed over duplicate rows, without the keys that add up to nothing."""
+    totals = {}
+    for row in BreakdownDailyRollup.objects.values(*rollups.KEY_FIELDS, *MEASURES):
+        measures = totals.setdefault(tuple(row[name] for name in rollups.KEY_FIELDS), dict.fromkeys(MEASURES))
+        for name in MEASURES:
+            measures[name] = row[name] if measures[name] is None else measures[name] + row[name]
+    return {key: measures for key, measures in totals.items() if any(measures.values())}
+
+
+class BreakdownRollupTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(name="Panacea")
+        floor = Floor.objects.create(name="Rollups", company=cls.company)
+        cls.line = Line.objects.create(name="A", operation_type="sewing", floor=floor)
+        cls.m1 = Machine.objects.create(machine_id="M-1", line=cls.line, company=cls.company)
+        cls.m2 = Machine.objects.create(machine_id="M-2", line=cls.line, company=cls.company)
+        cls.day_one = timezone.make_aware(datetime(2025, 2, 5, 8, 0))
+        cls.day_two = timezone.make_aware(datetime(2025, 2, 6, 8, 0))
+        cls.needle = MachinePart.objects.create(name="Needle", price=2, quantity=100, company=cls.company)
+        cls.belt = MachinePart.objects.create(name="Belt", price=10, quantity=100, company=cls.company)
+
+    def key(self, machine, start):
+        return (self.company.pk, plant_day(start), self.line.pk, machine.pk, None, None)
+
+    def measures(self, count=1, lost=0, responses=0, responded_lost=0, response=0, parts_cost=0):
+        return {
+            "breakdown_count": count,
+            "lost_time": timedelta(minutes=lost),
+            "response_count": responses,
+            "response_lost_time": timedelta(minutes=responded_lost),
+            "response_time": timedelta(minutes=response),
+            "parts_cost": parts_cost,
+        }
+
+    def log(self, machine, start, **fields):
+        return BreakdownLog.objects.create(
+            machine=machine, line=self.line, breakdown_start=start, lost_time=timedelta(minutes=10), **fields,
+        )
+
+    def assertRollups(self, expected):
+        """The incrementally kept rollups are as expected, and a full rebuild agrees."""
+        self.assertEqual(_rollup_totals(), expected)
+        call_command("rebuild_breakdown_rollups", stdout=io.StringIO())
+        self.assertEqual(_rollup_totals(), expected)
+
+    def test_breakdown_logs_update_their_rollups(self):
+        log = self.log(self.m1, self.day_one, repairing_start=self.day_one + timedelta(minutes=3))
+        self.log(self.m1, self.day_one)
+        self.assertRollups({self.key(self.m1, self.day_one): self.measures(2, 20, 1, 10, 3)})
+
+        log = BreakdownLog.objects.get(pk=log.pk)
+        log.lost_time = timedelta(minutes=25)
+        log.save()
+        self.assertRollups({self.key(self.m1, self.day_one): self.measures(2, 35, 1, 25, 3)})
+
+        # Moving a log takes it off its old key
+        log = BreakdownLog.objects.get(pk=log.pk)
+        log.machine = self.m2
+        log.breakdown_start = self.day_two
+        log.repairing_start = None
+        log.save()
+        self.assertRollups({
+            self.key(self.m1, self.day_one): self.measures(1, 10),
+            self.key(self.m2, self.day_two): self.measures(1, 25),
+        })
+
+        BreakdownLog.objects.get(pk=log.pk).delete()
+        self.assertRollups({self.key(self.m1, self.day_one): self.measures(1, 10)})
+
+    def test_parts_usage_updates_parts_cost(self):
+        first = self.log(self.m1, self.day_one)
+        second = self.log(self.m2, self.day_two)
+        usage = PartsUsageRecord.objects.create(part=self.needle, quantity_used=3, breakdown=first, company=self.company)
+        self.assertRollups({
+            self.key(self.m1, self.day_one): self.measures(1, 10, parts_cost=6),
+            self.key(self.m2, self.day_two): self.measures(1, 10),
+        })
+
+        usage = PartsUsageRecord.objects.get(pk=usage.pk)
+        usage.quantity_used = 5
+        usage.save()
+        self.assertEqual(_rollup_totals()[self.key(self.m1, self.day_one)]["parts_cost"], 10)
+
+        # Booked against another breakdown, then as another part
+        usage.breakdown = second
+        usage.save()
+        self.assertRollups({
+            self.key(self.m1, self.day_one): self.measures(1, 10),
+            self.key(self.m2, self.day_two): self.measures(1, 10, parts_cost=10),
+        })
+        usage = PartsUsageRecord.objects.get(pk=usage.pk)
+        usage.part = self.belt
+        usage.quantity_used = 2
+        usage.save()
+        self.assertEqual(_rollup_totals()[self.key(self.m2, self.day_two)]["parts_cost"], 20)
+
+        PartsUsageRecord.objects.get(pk=usage.pk).delete()
+        self.assertRollups({
+            self.key(self.m1, self.day_one): self.measures(1, 10),
+            self.key(self.m2, self.day_two): self.measures(1, 10),
+        })
+
+        # Deleting a breakdown takes its parts with it
+        PartsUsageRecord.objects.create(part=self.belt, quantity_used=1, breakdown=first, company=self.company)
+        BreakdownLog.objects.get(pk=first.pk).delete()
+        self.assertRollups({self.key(self.m2, self.day_two): self.measures(1, 10)})
+
+    def test_rebuild_command_only_touches_the_days_given(self):
+        self.log(self.m1, self.day_one)
+        self.log(self.m1, self.day_two)
+        BreakdownDailyRollup.objects.update(breakdown_count=99)
+
+        out = io.StringIO()
+        call_command("rebuild_breakdown_rollups", start="2025-02-06", end="2025-02-07", stdout=out)
+        self.assertIn("Rebuilt 1 breakdown rollup rows.", out.getvalue())
+        totals = _rollup_totals()
+        self.assertEqual(totals[self.key(self.m1, self.day_one)]["breakdown_count"], 99)
+        self.assertEqual(totals[self.key(self.m1, self.day_two)]["breakdown_count"], 1)
+
+        with self.assertRaisesMessage(CommandError, "--start must be before --end"):
+            call_command("rebuild_breakdown_rollups", start="2025-02-07", end="2025-02-06")
+
+
+@override_settings(PLANT_HIERARCHY={"OVERLAP_SECONDS": 10})
+class PlantHierarchyTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.own, cls.other = Company.objects.create(name="Panacea"), Company.objects.create(name="Other")
+        floor = Floor.objects.create(name="Hierarchy", company=cls.own)
+        cls.line_10 = Line.objects.create(name="Line 10", operation_type="sewing", floor=floor)
+        cls.line_2 = Line.objects.create(name="Line 2", operation_type="sewing", floor=floor)
+        cls.m1 = Machine.objects.create(machine_id="M-1", sequence=2, line=cls.line_2, company=cls.own)
+        cls.m2 = Machine.objects.create(machine_id="M-2", sequence=1, line=cls.line_2, company=cls.own)
+        other_floor = Floor.objects.create(name="Hierarchy other", company=cls.other)
+        other_line = Line.objects.create(name="Line 1", operation_type="sewing", floor=other_floor)
+        cls.foreign = Machine.objects.create(machine_id="F-1", line=other_line, company=cls.other)
+
+    def setUp(self):
+        cache.clear()
+
+    def change(self, *machines):
+        with self.captureOnCommitCallbacks(execute=True):
+            for machine in machines:
+                Machine.objects.get(pk=machine.pk).save()
+
+    def settle(self):
+        """Age the journal past the overlap, as if its inserts committed long ago."""
+        PlantChange.objects.update(created_at=timezone.now() - timedelta(minutes=1))
+
+    def test_full_document(self):
+        self.change(self.m1)
+        self.settle()
+        document = hierarchy.full_document([self.own.pk])
+        self.assertEqual(document["version"], PlantChange.objects.get().pk)
+        [company] = document["companies"]
+        self.assertEqual(company["id"], self.own.pk)
+        [floor] = company["floors"]
+        self.assertEqual([line["name"] for line in floor["lines"]], ["Line 2", "Line 10"])
+        self.assertEqual([machine["machine_id"] for machine in floor["lines"][0]["machines"]], ["M-2", "M-1"])
+
+    def test_deltas_only_name_the_requested_companies(self):
+        self.change(self.m1)
+        self.settle()
+        version = hierarchy.full_document([self.own.pk])["version"]
+
+        self.change(self.m1, self.foreign)
+        with self.captureOnCommitCallbacks(execute=True):
+            Machine.objects.get(pk=self.m2.pk).delete()
+        self.settle()
+        delta = hierarchy.changes_since(version, [self.own.pk])
+        self.assertFalse(delta["full"])
+        self.assertEqual([machine["id"] for machine in delta["machines"]], [self.m1.pk])
+        self.assertEqual(delta["deleted"], {"floors": [], "lines": [], "machines": [self.m2.pk]})
+        self.assertEqual(delta["version"], PlantChange.objects.latest("id").pk)
+
+        everything = hierarchy.changes_since(version)
+        self.assertEqual({machine["id"] for machine in everything["machines"]}, {self.m1.pk, self.foreign.pk})
+
+    def test_the_version_waits_for_journal_rows_that_may_still_commit_before_it(self):
+        self.change(self.m1)
+        self.settle()
+        version = hierarchy.full_document()["version"]
+
+        # Journaled when the transaction commits, however long it ran
+        with self.captureOnCommitCallbacks() as callbacks:
+            Machine.objects.get(pk=self.m2.pk).save()
+        self.assertEqual(PlantChange.objects.count(), 1)
+        for callback in callbacks:
+            callback()
+
+        # A fresh row is sent, but the version stays before it so it is sent again
+        delta = hierarchy.changes_since(version)
+        self.assertEqual([machine["id"] for machine in delta["machines"]], [self.m2.pk])
+        self.assertEqual(delta["version"], version)
+        self.settle()
+        delta = hierarchy.changes_since(version)
+        self.assertEqual([machine["id"] for machine in delta["machines"]], [self.m2.pk])
+        self.assertGreater(delta["version"], version)
+
+    def test_pruned_journal_falls_back_to_the_full_document(self):
+        self.change(self.m1)
+        self.change(self.m2)
+        version = PlantChange.objects.order_by("id").first().pk
+        PlantChange.objects.update(created_at=timezone.now() - timedelta(days=2))
+        self.change(self.m1)
+        self.assertEqual(hierarchy.prune(), 2)
+
+        document = hierarchy.changes_since(version - 1)
+        self.assertTrue(document["full"])
+        self.assertEqual(len(document["companies"]), 2)
+
+
+class CursorPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        company = Company.objects.create(name="Panacea")
+        machine = Machine.objects.create(machine_id="M-1", company=company)
+        start = timezone.make_aware(datetime(2025, 2, 5, 8, 0))
+        # Five breakdowns share a start, between an earlier and a later one
+        starts = [start - timedelta(hours=1)] + [start] * 5 + [start + timedelta(hours=1)]
+        cls.logs = [
+            BreakdownLog.objects.create(machine=machine, breakdown_start=moment, lost_time=timedelta(minutes=5))
+            for moment in starts
+        ]
+        cls.expected = [log.pk for log in sorted(cls.logs, key=lambda log: (log.breakdown_start, log.pk), reverse=True)]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def page(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_lists_stay_unpaginated_without_cursor_or_page_size(self):
+        self.assertEqual(len(self.page("/api/maintenance/breakdown-logs/")), 7)
+
+    def test_pages_through_tied_timestamps_in_both_directions(self):
+        pages, url = [], "/api/maintenance/breakdown-logs/?page_size=2"
+        while url:
+            data = self.page(url)
+            pages.append([log["id"] for log in data["results"]])
+            url = data["next"]
+        self.assertEqual([pk for page in pages for pk in page], self.expected)
+        self.assertEqual(len(pages), 4)
+
+        back, url = [], data["previous"]
+        while url:
+            data = self.page(url)
+            back.insert(0, [log["id"] for log in data["results"]])
+            url = data["previous"]
+        self.assertEqual(back, pages[:-1])
+
+    def test_rows_removed_before_the_next_page_shift_nothing(self):
+        first = self.page("/api/maintenance/breakdown-logs/?page_size=3")
+        self.assertEqual([log["id"] for log in first["results"]], self.expected[:3])
+        # An offset into the tied rows would now skip one
+        BreakdownLog.objects.filter(pk=self.expected[1]).delete()
+        second = self.page(first["next"])
+        self.assertEqual([log["id"] for log in second["results"]], self.expected[3:6])
+
+    def test_tampered_cursors_are_not_found(self):
+        for position in ("garbage", json.dumps(["not a date", "1"]), json.dumps(["1"])):
+            cursor = base64.b64encode(urlencode({"p": position}).encode()).decode()
+            response = self.client.get("/api/maintenance/breakdown-logs/", {"cursor": cursor})
+            self.assertEqual(response.status_code, 404)
+
+
+class TimeInStateTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        company = Company.objects.create(name="Panacea")
+        floor_1 = Floor.objects.create(name="Timeline 1", company=company)
+        floor_2 = Floor.objects.create(name="Timeline 2", company=company)
+        cls.line_a = Line.objects.create(name="A", operation_type="sewing", floor=floor_1)
+        cls.line_b = Line.objects.create(name="B", operation_type="sewing", floor=floor_2)
+        cls.m1 = Machine.objects.create(machine_id="M-1", company=company)
+        cls.m2 = Machine.objects.create(machine_id="M-2", company=company)
+        cls.machines = Machine.objects.filter(company=company)
+        # Replace the events of creating the machines with a known history
+        MachineStatusEvent.objects.all().delete()
+        cls.start = datetime(2025, 3, 10, tzinfo=dt_timezone.utc)
+        cls.end = cls.start + timedelta(hours=10)
+        for machine, hour, status, line in (
+            (cls.m1, -4, "active", cls.line_a),     # carried into the window
+            (cls.m1, 2, "broken", cls.line_a),
+            (cls.m1, 5, "active", cls.line_b),      # repaired and moved
+            (cls.m1, 12, "broken", cls.line_b),     # after the window
+            (cls.m2, 4, "maintenance", cls.line_b), # no history before this
+        ):
+            MachineStatusEvent.objects.create(
+                machine=machine, status=status, line=line, timestamp=cls.start + timedelta(hours=hour),
+            )
+
+    def setUp(self):
+        references.clear()
+
+    def hours(self, row, *states):
+        return tuple(row["hours"][state] for state in states)
+
+    def test_hours_per_machine_line_and_floor(self):
+        report = time_in_state(self.machines, self.start, self.end, with_events=True)
+        m1, m2 = report["machines"]
+        self.assertEqual(self.hours(m1, "active", "broken", "maintenance", "unknown"), (7.0, 3.0, 0, 0))
+        self.assertEqual(m1["transitions"], 2)
+        self.assertEqual(
+            [(interval["status"], interval["line"], interval["hours"]) for interval in m1["intervals"]],
+            [("active", self.line_a.pk, 2.0), ("broken", self.line_a.pk, 3.0), ("active", self.line_b.pk, 5.0)],
+        )
+        self.assertEqual(self.hours(m2, "maintenance", "unknown"), (6.0, 4.0))
+        self.assertEqual(m2["transitions"], 1)
+
+        lines = {line["name"]: line for line in report["lines"]}
+        self.assertEqual(self.hours(lines["A"], "active", "broken"), (2.0, 3.0))
+        self.assertEqual(self.hours(lines["B"], "active", "maintenance"), (5.0, 6.0))
+        self.assertEqual(lines["B"]["floor"], "Timeline 2")
+        floors = {floor["name"]: floor for floor in report["floors"]}
+        self.assertEqual(self.hours(floors["Timeline 1"], "active", "broken"), (2.0, 3.0))
+        self.assertEqual(floors["Timeline 2"]["share"]["maintenance"], round(100 * 6 / 11, 2))
+
+        fleet = report["fleet"]
+        self.assertEqual(self.hours(fleet, "active", "broken", "maintenance", "unknown"), (7.0, 3.0, 6.0, 4.0))
+        self.assertEqual(fleet["share"]["active"], 35.0)
+        self.assertEqual((fleet["machines"], fleet["transitions"]), (2, 3))
+
+    def test_a_window_into_the_future_stops_at_now(self):
+        now = timezone.now()
+        MachineStatusEvent.objects.create(machine=self.m1, status="inactive", timestamp=now - timedelta(hours=3))
+        report = time_in_state(self.machines.filter(pk=self.m1.pk), now - timedelta(hours=2), now + timedelta(hours=5))
+        self.assertLessEqual(report["end"], timezone.now())
+        self.assertEqual(self.hours(report["machines"][0], "inactive", "unknown"), (2.0, 0))
+        self.assertEqual(report["machines"][0]["transitions"], 0)
+
+
+class ReliabilityTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        company = Company.objects.create(name="Panacea")
+        cls.machines = Machine.objects.filter(company=company)
+        busy = Machine.objects.create(machine_id="M-1", company=company)
+        Machine.objects.create(machine_id="M-2", company=company)
+        cls.start = datetime(2025, 2, 3, tzinfo=dt_timezone.utc)
+        cls.end = cls.start + timedelta(days=2)
+        for hour, lost in ((8, 2), (14, 1), (47, 3)):
+            BreakdownLog.objects.create(
+                machine=busy, breakdown_start=cls.start + timedelta(hours=hour), lost_time=timedelta(hours=lost),
+            )
+        # Outside the window
+        BreakdownLog.objects.create(
+            machine=busy, breakdown_start=cls.end + timedelta(hours=1), lost_time=timedelta(hours=5),
+        )
+
+    def figures(self, report):
+        names = ("failures", "downtime_hours", "operating_hours", "mtbf_hours", "mttr_hours", "availability")
+        return [tuple(period[name] for name in names) for period in report]
+
+    def test_bucket_edges(self):
+        start = datetime(2025, 1, 30, 12, tzinfo=dt_timezone.utc)
+        end = datetime(2025, 3, 4, tzinfo=dt_timezone.utc)
+        utc = lambda *day: datetime(*day, tzinfo=dt_timezone.utc)
+        self.assertEqual(bucket_edges(start, end), [start, end])
+        self.assertEqual(bucket_edges(start, utc(2025, 2, 2), "day"), [start, utc(2025, 1, 31), utc(2025, 2, 1), utc(2025, 2, 2)])
+        self.assertEqual(bucket_edges(start, utc(2025, 2, 12), "week"), [start, utc(2025, 2, 3), utc(2025, 2, 10), utc(2025, 2, 12)])
+        self.assertEqual(bucket_edges(start, end, "month"), [start, utc(2025, 2, 1), utc(2025, 3, 1), end])
+
+    def test_daily_metrics(self):
+        report = reliability_report(self.machines, self.start, self.end, "day")
+        # Day 1: 2 failures, 3h down of 24h. Day 2: the 3h breakdown at 23:00
+        # only counts up to the end of the window
+        self.assertEqual(self.figures(report["machines"]["M-1"]), [
+            (2, 3.0, 24.0, 10.5, 1.5, 0.875),
+            (1, 1.0, 24.0, 23.0, 1.0, 0.958333),
+        ])
+        self.assertEqual(self.figures(report["machines"]["M-2"]), [
+            (0, 0.0, 24.0, None, None, 1.0),
+            (0, 0.0, 24.0, None, None, 1.0),
+        ])
+        self.assertEqual(report["machines"]["M-1"][0]["failure_rate_per_hour"], round(2 / 21, 6))
+        self.assertEqual(report["machines"]["M-2"][0]["failure_rate_per_hour"], 0.0)
+
+        # Fleet figures come from the summed times, not averaged ratios
+        self.assertEqual(report["fleet"]["machine_count"], 2)
+        self.assertEqual(self.figures(report["fleet"]["periods"]), [
+            (2, 3.0, 48.0, 22.5, 1.5, 0.9375),
+            (1, 1.0, 48.0, 47.0, 1.0, 0.979167),
+        ])
+
+    def test_operating_hours_per_day(self):
+        report = reliability_report(self.machines, self.start, self.end, hours_per_day=10)
+        # 20 operating hours over the 2 days, 4 of them lost to 3 failures
+        self.assertEqual(self.figures(report["machines"]["M-1"]), [(3, 4.0, 20.0, 5.3333, 1.3333, 0.8)])
+        self.assertEqual(report["machines"]["M-1"][0]["failure_rate_per_hour"], 0.1875)
+
+    def test_api_validates_the_window(self):
+        client = APIClient()
+        url = "/api/maintenance/breakdown-logs/reliability/"
+        response = client.get(url, {"start": "2025-02-03", "end": "2025-02-04", "granularity": "day"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["machines"]["M-1"][0]["failures"], 2)
+        self.assertEqual(client.get(url, {"start": "2025-02-04", "end": "2025-02-03"}).status_code, 400)
+        self.assertEqual(client.get(url, {"granularity": "year"}).status_code, 400)
+        self.assertEqual(client.get(url, {"hours_per_day": "25"}).status_code, 400)
@@ -0,0 +1,151 @@
+"""
+Time in each state from the machine status event log.
+
+A machine is in the status (and on the line) of its latest event until its
+next event. For a window [start, end) the state at start comes from each
+machine's last event before start, found with one correlated subquery on
+the (machine, timestamp) index, and is fetched together with the events
+inside the window in a single query ordered by machine and time. One pass
+over those rows adds every interval to its machine, line and floor; line and
+floor names come from the reference registry. Time
+before a machine's first event (history starts with the
+0007_machinestatusevent migration) is reported as "unknown".
+"""
+from collections import defaultdict
+
+from django.db.models import OuterRef, Q, Subquery
+from django.utils import timezone
+
+from .models import Machine, MachineStatusEvent
+from .references import references
+
+
+UNKNOWN = "unknown"
+STATES = tuple(status for status, _ in Machine.STATUS_CHOICES) + (UNKNOWN,)
+
+
+def record(machines, timestamp=None):
+    """Append the current status and line of each machine to the log."""
+    timestamp = timestamp or timezone.now()
+    MachineStatusEvent.objects.bulk_create([
+        MachineStatusEvent(machine_id=machine.pk, status=machine.status, line_id=machine.line_id, timestamp=timestamp)
+        for machine in machines
+    ])
+
+
+def _events(machine_queryset, start, end):
+    """(machine pk, status, line id, timestamp) rows: each machine's state at start, then its events up to end."""
+    state_at_start = Subquery(
+        MachineStatusEvent.objects
+        .filter(machine=OuterRef("pk"), timestamp__lt=start)
+        .order_by("-timestamp", "-id")
+        .values("id")[:1]
+    )
+    initial_events = machine_queryset.order_by().annotate(initial_event=state_at_start).values("initial_event")
+    return (
+        MachineStatusEvent.objects
+        .filter(machine__in=machine_queryset.order_by().values("pk"))
+        .filter(Q(timestamp__gte=start, timestamp__lt=end) | Q(pk__in=initial_events))
+        .order_by("machine_id", "timestamp", "id")
+        .values_list("machine_id", "status", "line_id", "timestamp")
+    )
+
+
+def _hours(seconds):
+    return {state: round(seconds.get(state, 0) / 3600, 2) for state in STATES}
+
+
+def _share(seconds):
+    total = sum(seconds.values())
+    return {state: round(100 * seconds.get(state, 0) / total, 2) if total else 0 for state in STATES}
+
+
+def _summary(seconds, **labels):
+    return {**labels, "hours": _hours(seconds), "share": _share(seconds)}
+
+
+def time_in_state(machine_queryset, start, end, with_events=False):
+    """
+    Hours and share of [start, end) spent in each state per machine, line,
+    floor and fleet-wide. A window reaching into the future stops at now.
+    With with_events, each machine also lists its intervals.
+    """
+    end = max(min(end, timezone.now()), start)
+    machines = dict(machine_queryset.order_by().values_list("pk", "machine_id"))
+
+    machine_seconds = {pk: defaultdict(float) for pk in machines}
+    line_seconds = defaultdict(lambda: defaultdict(float))
+    transitions = defaultdict(int)
+    intervals = defaultdict(list)
+    covered = defaultdict(float)
+
+    def add(machine_pk, status, line_id, since, until):
+        seconds = (until - since).total_seconds()
+        if seconds <= 0:
+            return
+        machine_seconds[machine_pk][status] += seconds
+        if line_id is not None:
+            line_seconds[line_id][status] += seconds
+        covered[machine_pk] += seconds
+        if with_events:
+            intervals[machine_pk].append({
+                "status": status, "line": line_id, "start": since, "end": until, "hours": round(seconds / 3600, 2),
+            })
+
+    current = None
+    for machine_pk, status, line_id, timestamp in _events(machine_queryset, start, end).iterator(chunk_size=2000):
+        if current is not None and current[0] == machine_pk:
+            add(*current, timestamp)
+        elif current is not None:
+            add(*current, end)
+        if timestamp >= start:
+            transitions[machine_pk] += 1
+        current = (machine_pk, status, line_id, max(timestamp, start))
+    if current is not None:
+        add(*current, end)
+
+    window = (end - start).total_seconds()
+    for machine_pk, seconds in machine_seconds.items():
+        if window > covered[machine_pk]:
+            seconds[UNKNOWN] += window - covered[machine_pk]
+
+    lines = {}
+    for line_id in line_seconds:
+        line = references.get("line", line_id)
+        if line:
+            lines[line_id] = (line["name"], line["floor_id"], references.name("floor", line["floor_id"]))
+    floor_seconds = defaultdict(lambda: defaultdict(float))
+    floor_names = {}
+    for line_id, seconds in line_seconds.items():
+        if line_id not in lines:
+            continue
+        _, floor_id, floor_names[floor_id] = lines[line_id]
+        for state, value in seconds.items():
+            floor_seconds[floor_id][state] += value
+    fleet_seconds = defaultdict(float)
+    for seconds in machine_seconds.values():
+        for state, value in seconds.items():
+            fleet_seconds[state] += value
+
+    machine_rows = []
+    for machine_pk, machine_id in sorted(machines.items(), key=lambda item: item[1]):
+        row = _summary(machine_seconds[machine_pk], id=machine_pk, machine_id=machine_id, transitions=transitions[machine_pk])
+        if with_events:
+            row["intervals"] = intervals[machine_pk]
+        machine_rows.append(row)
+
+    return {
+        "start": start,
+        "end": end,
+        "states": STATES,
+        "fleet": _summary(fleet_seconds, machines=len(machines), transitions=sum(transitions.values())),
+        "floors": [
+            _summary(seconds, id=floor_id, name=floor_names[floor_id])
+            for floor_id, seconds in sorted(floor_seconds.items())
+        ],
+        "lines": [
+            _summary(seconds, id=line_id, name=lines[line_id][0], floor=lines[line_id][2])
+            for line_id, seconds in sorted(line_seconds.items()) if line_id in lines
+        ],
+        "machines": machine_rows,
+    }
@@ -0,0 +1,121 @@
+"""
+Bulk machine status transitions.
+
+transition_machines() moves many machines to a new status with a single
+UPDATE, then does what Machine.save() and the clients would have done one
+machine at a time:
+
+- stamps last_breakdown_start (-> broken) or last_repairing_start
+  (-> maintenance) in the same UPDATE,
+- creates the BreakdownLog of every machine that comes back to active from
+  a breakdown, with one bulk_create, and adds them to the daily rollups,
+- invalidates the analytics cache and refreshes the search documents,
+- sends machine_status_changed for every machine whose status changed, and
+  machine_statuses_changed once for the batch, which queues a single
+  notification for all of them,
+- publishes the new breakdown logs to the live floor board stream.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from .models import BreakdownLog, Machine, ProblemCategory
+from .signals import machine_status_changed, machine_statuses_changed
+from . import rollups
+from . import search
+from . import cache as analytics_cache
+from . import live
+
+
+STATUSES = {status for status, _ in Machine.STATUS_CHOICES}
+
+
+def _stamps(new_status, now, last_problem=None):
+    """Fields set alongside the status in the UPDATE."""
+    if new_status == "broken":
+        stamps = {"last_breakdown_start": now, "last_repairing_start": None}
+        if last_problem is not None:
+            stamps["last_problem"] = last_problem
+        return stamps
+    if new_status == "maintenance":
+        return {"last_repairing_start": now}
+    return {}
+
+
+def _breakdown_logs(changes, now):
+    """BreakdownLogs for the machines returning to active from broken or maintenance."""
+    repaired = [
+        machine for machine, old_status in changes
+        if old_status in ("broken", "maintenance") and machine.last_breakdown_start
+    ]
+    problems = dict(
+        ProblemCategory.objects
+        .filter(name__in={machine.last_problem for machine in repaired if machine.last_problem})
+        .values_list("name", "id")
+    ) if repaired else {}
+    return [
+        BreakdownLog(
+            machine=machine,
+            mechanic_id=machine.mechanic_id,
+            operator_id=machine.operator_id,
+            problem_category_id=problems.get(machine.last_problem),
+            line_id=machine.line_id,
+            breakdown_start=machine.last_breakdown_start,
+            repairing_start=machine.last_repairing_start,
+            lost_time=now - machine.last_breakdown_start,
+        )
+        for machine in repaired
+    ]
+
+
+def transition_machines(machine_queryset, new_status, last_problem=None):
+    """
+    Set new_status on every machine in machine_queryset that is not already
+    in it. last_problem is recorded on machines going to broken.
+
+    Returns (machines, breakdown_logs): the changed machines, with their new
+    values, and the BreakdownLogs created for machines back to active.
+    """
+    if new_status not in STATUSES:
+        raise ValueError(f"Unknown machine status: {new_status}")
+
+    now = timezone.now()
+    stamps = _stamps(new_status, now, last_problem)
+    with transaction.atomic():
+        machines = list(
+            machine_queryset
+            .exclude(status=new_status)
+            .select_for_update(of=("self",))
+        )
+        if not machines:
+            return [], []
+        machine_pks = [machine.pk for machine in machines]
+        Machine.objects.filter(pk__in=machine_pks).update(status=new_status, **stamps)
+
+        changes = [(machine, machine.status) for machine in machines]
+        breakdown_logs = _breakdown_logs(changes, now) if new_status == "active" else []
+        if breakdown_logs:
+            # bulk_create sends no signals, so the rollups are updated here
+            BreakdownLog.objects.bulk_create(breakdown_logs)
+            rollups.breakdowns_created(breakdown_logs)
+
+    for machine in machines:
+        machine.status = new_status
+        for name, value in stamps.items():
+            setattr(machine, name, value)
+        machine.remember_stored_values()
+
+    analytics_cache.bump(
+        [analytics_cache.PLANT]
+        + [("machine", machine_pk) for machine_pk in machine_pks]
+        + analytics_cache.location_scopes({machine.line_id for machine in machines})
+    )
+    search.refresh_documents(Machine.objects.filter(pk__in=machine_pks))
+    for machine, old_status in changes:
+        machine_status_changed.send(
+            sender=Machine, machine=machine, old_status=old_status, new_status=new_status, batched=True,
+        )
+    machine_statuses_changed.send(
+        sender=Machine, changes=[(machine, old_status, new_status) for machine, old_status in changes],
+    )
+    live.publish_on_commit([live.breakdown_event(log) for log in breakdown_logs])
+    return machines, breakdown_logs
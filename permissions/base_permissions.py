@@ -69,13 +69,16 @@
 
 
 from rest_framework.permissions import BasePermission, SAFE_METHODS
-from django.contrib.auth.models import Permission
 from django.core.exceptions import ImproperlyConfigured
 
+from .cache import user_permissions
+
 
 class HasGroupPermission(BasePermission):
 
-    
+    # view class -> model, resolved once per process
+    _view_models = {}
+
     action_to_codename = {
         'list': 'view',
         'retrieve': 'view',
@@ -116,6 +119,17 @@ class HasGroupPermission(BasePermission):
         return permission_codename in user_permissions
 
     def _get_model_class(self, view):
+        # The model of a view class never changes; only resolve it once, since
+        # get_queryset() below may run a query
+        view_class = type(view)
+        if view_class not in self._view_models:
+            model_cls = self._resolve_model_class(view)
+            if model_cls is None:
+                return None
+            self._view_models[view_class] = model_cls
+        return self._view_models[view_class]
+
+    def _resolve_model_class(self, view):
         
         queryset = getattr(view, 'queryset', None)
         if queryset is not None:
@@ -155,6 +169,5 @@ class HasGroupPermission(BasePermission):
         return self.method_to_codename.get(request.method)
 
     def _get_user_permissions(self, user):
-        user_groups = user.groups.all()
-        group_permissions = Permission.objects.filter(group__in=user_groups)
-        return set(group_permissions.values_list('codename', flat=True))
+        # Cached per user and invalidated when groups or their permissions change
+        return user_permissions(user)
@@ -0,0 +1,128 @@
+"""
+Cached group permission codenames per user for HasGroupPermission.
+
+A user's codenames are cached under two version counters: the user's own,
+bumped when their groups change, and a global one, bumped when any group's
+permissions change or a group or permission is deleted. A change therefore
+takes effect on the next request without touching other users' entries.
+In steady state a permission check costs two cache reads and no queries.
+
+The counters are only bumped in the cache of the process that made the
+change, so a local-memory cache would keep a revoked permission alive in
+every other worker. With one the codenames are not cached and each check
+queries them; set PERMISSIONS_CACHE["ALIAS"] to a cache every process
+shares to use the cache.
+
+The receivers are connected from UserManagementConfig.ready().
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models.signals import m2m_changed, post_delete
+
+
+DEFAULTS = {
+    "ALIAS": "default",
+    # Safety net for changes that bypass the signals (raw SQL, queryset.update())
+    "TTL": 300,
+    "PREFIX": "group-permissions",
+}
+
+
+def _config():
+    return {**DEFAULTS, **getattr(settings, "PERMISSIONS_CACHE", {})}
+
+
+def _cache():
+    return caches[_config()["ALIAS"]]
+
+
+def _shared():
+    return not isinstance(_cache(), LocMemCache)
+
+
+def _key(*parts):
+    return ":".join([_config()["PREFIX"], *map(str, parts)])
+
+
+def _incr(key):
+    cache = _cache()
+    cache.add(key, time.time_ns(), None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between add() and incr()
+        cache.set(key, time.time_ns(), None)
+
+
+def _versions(keys):
+    cache = _cache()
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Seeded from the clock so an evicted version never repeats
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def user_permissions(user):
+    """The codenames of every permission granted to the user's groups."""
+    if not _shared():
+        return _load(user)
+    global_version, user_version = _versions([_key("version"), _key("version", user.pk)])
+    key = _key("codenames", user.pk, global_version, user_version)
+    cache = _cache()
+    codenames = cache.get(key)
+    if codenames is None:
+        codenames = _load(user)
+        cache.set(key, codenames, _config()["TTL"])
+    return codenames
+
+
+def _load(user):
+    return frozenset(Permission.objects.filter(group__user=user).values_list("codename", flat=True).distinct())
+
+
+def invalidate_user(user_pk):
+    _incr(_key("version", user_pk))
+
+
+def invalidate_all():
+    _incr(_key("version"))
+
+
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith("post_"):
+        return
+    if not reverse:
+        # user.groups.add(...) / remove / clear
+        invalidate_user(instance.pk)
+    elif pk_set:
+        # group.user_set.add(users...)
+        for user_pk in pk_set:
+            invalidate_user(user_pk)
+    else:
+        # group.user_set.clear(): the users are gone from pk_set
+        invalidate_all()
+
+
+def group_permissions_changed(sender, action, **kwargs):
+    if action.startswith("post_"):
+        invalidate_all()
+
+
+def group_or_permission_deleted(sender, **kwargs):
+    invalidate_all()
+
+
+def connect():
+    User = get_user_model()
+    m2m_changed.connect(user_groups_changed, sender=User.groups.through, dispatch_uid="permissions-user-groups")
+    m2m_changed.connect(group_permissions_changed, sender=Group.permissions.through, dispatch_uid="permissions-group-permissions")
+    post_delete.connect(group_or_permission_deleted, sender=Group, dispatch_uid="permissions-group-deleted")
+    post_delete.connect(group_or_permission_deleted, sender=Permission, dispatch_uid="permissions-permission-deleted")
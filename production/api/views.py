@@ -2,19 +2,24 @@ from rest_framework import viewsets
 from ..models import Line, Floor
 from .serializers import LineSerializer, FloorSerializer, LinelistSerializer
 from permissions.base_permissions import HasGroupPermission
+from core.conditional import ConditionalGetMixin
+from core.tenancy import CompanyScopedMixin
 
-class LineViewSet(viewsets.ModelViewSet):
+class LineViewSet(CompanyScopedMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Line.objects.select_related('floor').all()
+    company_field = "floor__company"
     serializer_class = LineSerializer
+    etag_models = (Line, Floor)  # floor is nested
     # permission_classes = [HasGroupPermission]
 
-class FloorViewSet(viewsets.ModelViewSet):
+class FloorViewSet(CompanyScopedMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Floor.objects.all()
     serializer_class = FloorSerializer
     # permission_classes = [HasGroupPermission]
 
 
-class LinelistViewSet(viewsets.ModelViewSet):
+class LinelistViewSet(CompanyScopedMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Line.objects.select_related('floor').all()
+    company_field = "floor__company"
     serializer_class = LinelistSerializer
     # permission_classes = [HasGroupPermission]
\ No newline at end of file
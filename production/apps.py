@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class ProductionConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'production'
+
+    def ready(self):
+        from core import versioning
+        from .models import Floor, Line
+        versioning.register(Floor, Line)
@@ -1,3 +1,58 @@
-from django.test import TestCase
+import os
+import tempfile
 
-# Create your tests here.
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from company.models import Company
+from .models import Floor, Line
+
+
+@override_settings(
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "shared": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": os.path.join(tempfile.gettempdir(), "fasttracker-version-tests"),
+        },
+    },
+    MODEL_VERSIONS={"ALIAS": "shared"},
+)
+class ConditionalGetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        company = Company.objects.create(name="Panacea")
+        cls.floor = Floor.objects.create(name="1", company=company)
+        Line.objects.create(name="Line A", operation_type="sewing", floor=cls.floor)
+
+    def setUp(self):
+        caches["shared"].clear()
+
+    def assert_revalidated(self, url, write):
+        client = APIClient()
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        with self.assertNumQueries(0):
+            self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            write()
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_floors(self):
+        self.assert_revalidated(
+            "/api/production/floors/",
+            lambda: APIClient().patch(f"/api/production/floors/{self.floor.pk}/", {"name": "Ground"}),
+        )
+
+    def test_lines_follow_their_floors(self):
+        # Lines nest their floor, so a floor rename changes the lines' ETag too
+        def rename_floor():
+            self.floor.name = "Ground"
+            self.floor.save()
+
+        self.assert_revalidated("/api/production/lines/", rename_floor)
@@ -21,6 +21,9 @@ from .serializers import (
     UserSerializer
 )
 from permissions.base_permissions import HasGroupPermission
+from core.conditional import ConditionalGetMixin
+from core.pagination import EmployeeCursorPagination
+from core.tenancy import CompanyScopedMixin, scope_queryset
 
 
 # -----------------------------------------------------
@@ -64,9 +67,10 @@ class UserRegistrationView(generics.CreateAPIView):
 # -----------------------------------------------------
 # Add Employee Viewset
 # -----------------------------------------------------
-class AddEmployeeViewset(ModelViewSet):
+class AddEmployeeViewset(CompanyScopedMixin, ModelViewSet):
     queryset = Employee.objects.all()
     serializer_class = AddEmployeeSerializer
+    pagination_class = EmployeeCursorPagination  # opt-in: only with ?cursor= or ?page_size=
     # permission_classes = [HasGroupPermission]
 
 
@@ -113,7 +117,7 @@ class UserListView(APIView):
         """
         Retrieve a list of all Users in the system.
         """
-        users = User.objects.all()
+        users = scope_queryset(User.objects.all(), request, "employee__company")
         data = [
             {"id": user.id, "email": user.email, "username": user.username}
             for user in users
@@ -137,7 +141,7 @@ class EmployeeListAPIView(APIView):
         if id:
             try:
                 # Retrieve a specific employee by ID
-                employee = Employee.objects.get(id=id)
+                employee = scope_queryset(Employee.objects.all(), request).get(id=id)
             except Employee.DoesNotExist:
                 return Response({"detail": "Employee not found."}, status=status.HTTP_404_NOT_FOUND)
             
@@ -146,8 +150,13 @@ class EmployeeListAPIView(APIView):
             return Response(serializer.data, status=status.HTTP_200_OK)
 
         else:
-            # Retrieve all employees
-            employees = Employee.objects.all()
+            # Retrieve all employees, a page at a time when ?cursor= or ?page_size= is given
+            employees = scope_queryset(Employee.objects.all(), request)
+            paginator = EmployeeCursorPagination()
+            page = paginator.paginate_queryset(employees, request, view=self)
+            if page is not None:
+                serializer = UserRegistrationSerializer(page, many=True)
+                return paginator.get_paginated_response(serializer.data)
             serializer = UserRegistrationSerializer(employees, many=True)
             return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -157,7 +166,7 @@ class EmployeeListAPIView(APIView):
         """
         if id:
             try:
-                employee = Employee.objects.get(id=id)
+                employee = scope_queryset(Employee.objects.all(), request).get(id=id)
             except Employee.DoesNotExist:
                 return Response({"detail": "Employee not found."}, status=status.HTTP_404_NOT_FOUND)
             
@@ -188,7 +197,7 @@ class UserLogoutView(APIView):
 # -----------------------------------------------------
 # Department CRUD ViewSet
 # -----------------------------------------------------
-class DepartmentViewSet(ModelViewSet):
+class DepartmentViewSet(CompanyScopedMixin, ConditionalGetMixin, ModelViewSet):
     queryset = Department.objects.all()
     serializer_class = DepartmentSerializer
     # permission_classes = [HasGroupPermission]
@@ -197,7 +206,7 @@ class DepartmentViewSet(ModelViewSet):
 # -----------------------------------------------------
 # Designation CRUD ViewSet
 # -----------------------------------------------------
-class DesignationViewSet(ModelViewSet):
+class DesignationViewSet(CompanyScopedMixin, ConditionalGetMixin, ModelViewSet):
     queryset = Designation.objects.all()
     serializer_class = DesignationSerializer
     # permission_classes = [HasGroupPermission]
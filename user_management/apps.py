@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class UserManagementConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'user_management'
+
+    def ready(self):
+        from core import versioning
+        from .models import Department, Designation
+        versioning.register(Department, Designation)
+        from permissions import cache as permissions_cache
+        permissions_cache.connect()
+        from . import authentication
+        authentication.connect()
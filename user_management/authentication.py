@@ -0,0 +1,192 @@
+"""
+Token authentication that resolves token -> user from memory.
+
+TokenAuthentication joins Token and User on every request. The mobile
+clients poll several times a minute, so CachedTokenAuthentication keeps the
+resolved token with its user, employee and company in a process-local LRU
+of MAX_ENTRIES tokens for at most TTL seconds.
+
+Each entry remembers the user's auth version, a counter in the cache ALIAS
+that is bumped when one of their tokens is deleted or created (logout,
+rotation), when the user is saved (deactivation, password change) or
+deleted, and when their employee record changes. A cached token is only used
+while that version is unchanged, so a revocation in any process takes
+effect on the next request everywhere, at the cost of one cache read.
+Company renames show up when the entry expires.
+
+That only holds when ALIAS is a cache all processes share. A local-memory
+cache keeps a separate version per process, which would let the other
+processes go on accepting a revoked token until its entry expires. With
+one the feature is off: the LRU is not used and requests are authenticated
+exactly like TokenAuthentication does. Configure a shared cache for ALIAS to
+get the speed-up.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+
+DEFAULTS = {
+    "ALIAS": "default",
+    "TTL": 300,
+    "MAX_ENTRIES": 10000,
+    "PREFIX": "auth-token",
+}
+
+
+def _config():
+    return {**DEFAULTS, **getattr(settings, "TOKEN_AUTH_CACHE", {})}
+
+
+def _cache():
+    return caches[_config()["ALIAS"]]
+
+
+def _shared():
+    """Whether the versions are seen by every process, see the module docstring."""
+    return not isinstance(_cache(), LocMemCache)
+
+
+def _version_key(user_pk):
+    return f"{_config()['PREFIX']}:version:{user_pk}"
+
+
+def user_version(user_pk):
+    cache = _cache()
+    key = _version_key(user_pk)
+    version = cache.get(key)
+    if version is None:
+        # Seeded from the clock so an evicted version never repeats
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+class TokenCache:
+    """LRU of token key -> (token, version, expires_at)."""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, token, version):
+        config = _config()
+        with self._lock:
+            self._entries[key] = (token, version, time.monotonic() + config["TTL"])
+            self._entries.move_to_end(key)
+            while len(self._entries) > config["MAX_ENTRIES"]:
+                self._entries.popitem(last=False)
+
+    def discard_user(self, user_pk):
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry[0].user_id == user_pk]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+tokens = TokenCache()
+
+
+def invalidate_user(user_pk):
+    """Drop every cached token of the user, in this process and (through the version) in all others."""
+    if user_pk is None:
+        return
+    # After commit: until then other requests still read the old rows and would cache them again
+    transaction.on_commit(lambda: _invalidate_user(user_pk))
+
+
+def _invalidate_user(user_pk):
+    cache = _cache()
+    key = _version_key(user_pk)
+    cache.add(key, time.time_ns(), None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between add() and incr()
+        cache.set(key, time.time_ns(), None)
+    tokens.discard_user(user_pk)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+
+    def authenticate_credentials(self, key):
+        if not _shared():
+            return super().authenticate_credentials(key)
+
+        entry = tokens.get(key)
+        if entry is not None:
+            token, version = entry[:2]
+            if user_version(token.user_id) == version:
+                # A copy, so nothing a view caches on request.user leaks into the next request
+                token = copy.deepcopy(token)
+                return (token.user, token)
+
+        model = self.get_model()
+        try:
+            token = model.objects.select_related("user__employee__company").get(key=key)
+        except model.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_("Invalid token."))
+        version = user_version(token.user_id)
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_("User inactive or deleted."))
+
+        tokens.set(key, copy.deepcopy(token), version)
+        return (token.user, token)
+
+
+def token_changed(sender, instance, **kwargs):
+    invalidate_user(instance.user_id)
+
+
+def user_saved(sender, instance, update_fields=None, **kwargs):
+    # Logging in only touches last_login
+    if update_fields is not None and set(update_fields) <= {"last_login"}:
+        return
+    invalidate_user(instance.pk)
+
+
+def user_deleted(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+def employee_changed(sender, instance, **kwargs):
+    invalidate_user(instance.user_id)
+
+
+def connect():
+    from rest_framework.authtoken.models import Token
+    from .models import Employee
+
+    User = get_user_model()
+    post_save.connect(token_changed, sender=Token, dispatch_uid="auth-token-saved")
+    post_delete.connect(token_changed, sender=Token, dispatch_uid="auth-token-deleted")
+    post_save.connect(user_saved, sender=User, dispatch_uid="auth-token-user-saved")
+    post_delete.connect(user_deleted, sender=User, dispatch_uid="auth-token-user-deleted")
+    post_save.connect(employee_changed, sender=Employee, dispatch_uid="auth-token-employee-saved")
+    post_delete.connect(employee_changed, sender=Employee, dispatch_uid="auth-token-employee-deleted")
@@ -33,6 +33,12 @@ class Employee(models.Model):
 
     def __str__(self):
         return f"{self.name} - {self.designation}"
+
+    class Meta:
+        indexes = [
+            # Company-scoped lists, ordered by id (core/tenancy.py)
+            models.Index(fields=["company", "id"]),
+        ]
     
 
 class DeviceToken(models.Model):
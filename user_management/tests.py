@@ -1,3 +1,200 @@
-from django.test import TestCase
+import os
+import tempfile
+from types import SimpleNamespace
 
-# Create your tests here.
+from django.contrib.auth.models import Group, Permission, User
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient
+
+from company.models import Company
+from maintenance.api.views import MachineViewSet
+from permissions.base_permissions import HasGroupPermission
+from .authentication import CachedTokenAuthentication, _cache, tokens
+from .models import Department, Designation, Employee
+
+
+SHARED_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "shared": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.path.join(tempfile.gettempdir(), "fasttracker-token-tests"),
+    },
+}
+
+
+@override_settings(CACHES=SHARED_CACHES, TOKEN_AUTH_CACHE={"ALIAS": "shared", "TTL": 300})
+class CachedTokenAuthenticationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="rahim", password="secret")
+        Employee.objects.create(user=cls.user, name="Rahim", company=Company.objects.create(name="Panacea"))
+
+    def setUp(self):
+        _cache().clear()
+        tokens.clear()
+        self.token = Token.objects.create(user=self.user)
+
+    def authenticate(self, key=None):
+        return CachedTokenAuthentication().authenticate_credentials(key or self.token.key)
+
+    def revoke(self, change):
+        """
+        Run change after the token was cached, keeping the entry as another
+        process (whose memory the change cannot reach) still would.
+        """
+        self.authenticate()
+        entry = tokens.get(self.token.key)
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        self.assertIsNone(tokens.get(self.token.key))
+        tokens.set(self.token.key, *entry[:2])
+
+    def test_cached_token_needs_no_queries(self):
+        self.authenticate()
+        with self.assertNumQueries(0):
+            user, token = self.authenticate()
+        self.assertEqual((user, token.key), (self.user, self.token.key))
+        self.assertEqual(user.employee.company.name, "Panacea")
+
+    def test_logout_revokes_the_token_everywhere(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        self.revoke(lambda: self.assertEqual(client.get("/api/user_management/logout/").status_code, 200))
+        with self.assertRaisesMessage(AuthenticationFailed, "Invalid token."):
+            self.authenticate()
+
+    def test_deactivated_users_are_refused(self):
+        def deactivate():
+            self.user.is_active = False
+            self.user.save()
+
+        self.revoke(deactivate)
+        with self.assertRaisesMessage(AuthenticationFailed, "User inactive or deleted."):
+            self.authenticate()
+
+    def test_rotated_tokens_stop_working(self):
+        old_key = self.token.key
+
+        def rotate():
+            self.token.delete()
+            self.token = Token.objects.create(user=self.user)
+
+        self.revoke(rotate)
+        with self.assertRaisesMessage(AuthenticationFailed, "Invalid token."):
+            self.authenticate(old_key)
+        self.assertEqual(self.authenticate()[1].key, self.token.key)
+
+    @override_settings(TOKEN_AUTH_CACHE={"ALIAS": "default"})
+    def test_local_memory_cache_is_not_used(self):
+        self.authenticate()
+        self.assertIsNone(tokens.get(self.token.key))
+        with self.assertNumQueries(1) as queries:
+            self.authenticate()
+        # The same query as TokenAuthentication, without the employee join
+        self.assertNotIn("employee", queries[0]["sql"])
+
+
+@override_settings(CACHES=SHARED_CACHES, PERMISSIONS_CACHE={"ALIAS": "shared"})
+class GroupPermissionCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="rahim", password="secret")
+        cls.other = User.objects.create_user(username="karim", password="secret")
+        cls.group = Group.objects.create(name="Mechanics")
+        cls.view_machine = Permission.objects.get(codename="view_machine")
+        cls.change_machine = Permission.objects.get(codename="change_machine")
+
+    def setUp(self):
+        caches["shared"].clear()
+
+    def allowed(self, user, action="list", method="GET"):
+        view = MachineViewSet()
+        view.action = action
+        return HasGroupPermission().has_permission(SimpleNamespace(user=user, method=method), view)
+
+    def test_changes_take_effect_on_the_next_check(self):
+        self.assertFalse(self.allowed(self.user))
+        self.group.permissions.add(self.view_machine)
+        self.user.groups.add(self.group)
+        self.assertTrue(self.allowed(self.user))
+        with self.assertNumQueries(0):
+            self.assertTrue(self.allowed(self.user))
+            self.assertFalse(self.allowed(self.user, "partial_update", "PATCH"))
+
+        self.group.permissions.add(self.change_machine)
+        self.assertTrue(self.allowed(self.user, "partial_update", "PATCH"))
+        self.group.permissions.remove(self.view_machine)
+        self.assertFalse(self.allowed(self.user))
+
+        # From the group's side
+        self.group.user_set.remove(self.user)
+        self.assertFalse(self.allowed(self.user, "partial_update", "PATCH"))
+        self.group.user_set.add(self.user)
+        self.assertTrue(self.allowed(self.user, "partial_update", "PATCH"))
+        self.group.delete()
+        self.assertFalse(self.allowed(self.user, "partial_update", "PATCH"))
+
+    def test_other_users_keep_their_entries(self):
+        self.group.permissions.add(self.view_machine)
+        self.other.groups.add(self.group)
+        self.assertTrue(self.allowed(self.other))
+        self.user.groups.add(self.group)
+        with self.assertNumQueries(0):
+            self.assertTrue(self.allowed(self.other))
+
+    def test_superusers_need_no_groups(self):
+        superuser = User.objects.create_superuser(username="admin", password="secret")
+        with self.assertNumQueries(0):
+            self.assertTrue(self.allowed(superuser, "destroy", "DELETE"))
+
+    @override_settings(PERMISSIONS_CACHE={"ALIAS": "default"})
+    def test_local_memory_is_not_used(self):
+        # Another worker's revocation would never reach this process's cache
+        self.group.permissions.add(self.view_machine)
+        self.user.groups.add(self.group)
+        self.assertTrue(self.allowed(self.user))
+        with self.assertNumQueries(1):
+            self.assertTrue(self.allowed(self.user))
+
+
+@override_settings(CACHES=SHARED_CACHES, MODEL_VERSIONS={"ALIAS": "shared"})
+class ConditionalGetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(name="Panacea")
+        cls.department = Department.objects.create(name="Maintenance", company=cls.company)
+        Designation.objects.create(title="Mechanic", department=cls.department, company=cls.company)
+
+    def setUp(self):
+        caches["shared"].clear()
+
+    def assert_revalidated(self, url, write):
+        client = APIClient()
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        with self.assertNumQueries(0):
+            self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            write()
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_departments(self):
+        self.assert_revalidated(
+            "/api/user_management/department/",
+            lambda: APIClient().patch(f"/api/user_management/department/{self.department.pk}/", {"code": "MNT"}),
+        )
+
+    def test_designations(self):
+        self.assert_revalidated(
+            "/api/user_management/designation/",
+            lambda: Designation.objects.create(title="Supervisor", company=self.company),
+        )